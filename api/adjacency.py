@@ -0,0 +1,84 @@
+from boto3.dynamodb.conditions import Attr, Key
+
+#
+# タグ・カテゴリ -> 動画の隣接アイテム（逆引きインデックス）
+# ・PK=タグID/カテゴリID, SK=動画のuri（indexKeyを持たないのでGSI-1-SKには載らない）
+# ・再生リスト -> 動画は再生順のアイテム（PK=再生リストID, SK=動画のuri）をそのまま使う
+# ・動画の書き込み時に差分だけ追加・削除する
+# ・読む側は動画本体で所属を確認するので、古い隣接アイテムが残っていても結果は変わらない
+# ・デプロイ順: 先にmaintenance.py backfill-adjacencyで既存の動画の隣接アイテムを作ってから、
+#   隣接アイテムを読むルート（タグ・カテゴリ・再生リストの削除、POST /videosの絞り込み）を出す
+#   隣接アイテムが1件もなければ、今まで通りGSI-1-SKの動画をFilterExpressionで探す
+#   （backfillの前でも結果は変わらない、動画のない項目は毎回全件読むことになる）
+#
+
+VIDEO_PREFIX = "/videos/"
+
+
+def facet_ids(video):
+    """Return tag & category IDs of video (empty values are skipped)"""
+
+    ids = set(video.get("tagIds", None) or [])
+    ids.add(video.get("categoryId", None))
+    return {id for id in ids if id}
+
+
+def adjacency_key(facet_id, uri):
+    """key of adjacency item (facet -> video)"""
+
+    return {"PK": facet_id, "SK": uri}
+
+
+def diff_adjacency(uri, old_ids, new_ids):
+    """Return (keys to put, keys to delete) for facet IDs change"""
+
+    puts = [adjacency_key(id, uri) for id in sorted(set(new_ids) - set(old_ids))]
+    deletes = [adjacency_key(id, uri) for id in sorted(set(old_ids) - set(new_ids))]
+    return puts, deletes
+
+
+def query_facet(facet_id):
+    """input adjacency items (or video orders) of facet"""
+
+    return dict(
+        KeyConditionExpression=Key("PK").eq(facet_id)
+        & Key("SK").begins_with(VIDEO_PREFIX),
+        ProjectionExpression="PK, SK",
+    )
+
+
+def query_videos(attribute, facet_id):
+    """input videos of facet by GSI-1-SK (attribute: tagIds, categoryId, ...)"""
+
+    return dict(
+        IndexName="GSI-1-SK",
+        KeyConditionExpression=Key("indexKey").eq("Video"),
+        FilterExpression=Attr("invalid").exists() & Attr(attribute).contains(facet_id),
+    )
+
+
+def get_facet_videos(db, facet_id, fields=None, attribute=None):
+    """Return (adjacency keys, video items) of facet by key lookups only
+
+    No adjacency items (before backfill) falls back to the GSI with attribute.
+    """
+
+    refs, _ = db.query(query_facet(facet_id))
+    if not refs and attribute is not None:
+        videos, _ = db.query(db.project(query_videos(attribute, facet_id), fields))
+        return [], videos
+    keys = [{"PK": ref["PK"], "SK": ref["SK"]} for ref in refs]
+    videos = db.batch_get([{"PK": ref["SK"], "SK": ref["SK"]} for ref in refs], fields)
+    return keys, list(videos.values())
+
+
+def write_adjacency(table, puts, deletes):
+    """Put & delete adjacency items with batch writer"""
+
+    if not puts and not deletes:
+        return
+    with table.batch_writer() as batch:
+        for key in puts:
+            batch.put_item(Item=key)
+        for key in deletes:
+            batch.delete_item(Key=key)
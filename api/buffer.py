@@ -0,0 +1,206 @@
+import atexit
+import json
+import math
+import os
+import signal
+import threading
+import time
+from collections import Counter
+
+from api.counter import increment_input, periods
+
+#
+# 視聴履歴・いいねの書き込みをプロセス内にためて、まとめて書く(write-behind)
+# ・同じユーザー・同じ動画のイベントは最後の1件だけ書く（連続した再生・いいねの押し直し）
+#   キー(PK, SK)は最初のイベントのものを残すので、先に返したSKがそのまま書かれる
+#   集計(視聴数)はまとめたイベントも1件ずつ数える（直接書いていたときと同じ数になる）
+# ・件数(WRITE_BUFFER_SIZE)か経過時間(WRITE_BUFFER_AGE)でbatch_writerで書き込む
+# ・集計アイテム(api/counter.py)も期間ごとにまとめて1回のADDにする
+# ・シャットダウン(SIGTERM, 終了)時にも残りを書く
+# ・uvicorn等の常駐するサーバーだけで使う。Lambdaはリクエストとリクエストの間は止まり
+#   （タイマーも動かない）、破棄されるときにシグナルも来ないので、ためてもレスポンスの前に
+#   書くしかなくまとめられない。Lambdaでは今まで通りリクエストの中で書いて200を返す
+#
+
+# Lambdaの実行環境には必ずある環境変数
+IN_LAMBDA = "AWS_LAMBDA_FUNCTION_NAME" in os.environ
+WRITE_BUFFER = not IN_LAMBDA and os.environ.get("WRITE_BUFFER", "on") != "off"
+WRITE_BUFFER_SIZE = int(os.environ.get("WRITE_BUFFER_SIZE", 25))
+WRITE_BUFFER_AGE = float(os.environ.get("WRITE_BUFFER_AGE", 2))
+
+
+def write_units(item):
+    """Estimate write capacity units of item (1 unit for each 1KB)"""
+
+    size = len(json.dumps(item, default=str, ensure_ascii=False).encode("utf-8"))
+    return max(1, math.ceil(size / 1024))
+
+
+class WriteBuffer:
+    """Coalescing write-behind buffer of put items & counters"""
+
+    def __init__(
+        self, table, size=WRITE_BUFFER_SIZE, max_age=WRITE_BUFFER_AGE, clock=None
+    ):
+        # table: DynamoDB tableを返す関数（最初に書くときに作る）
+        self.table = table
+        self.size = size
+        self.max_age = max_age
+        self.clock = clock or time.monotonic
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.items = {}
+        self.counts = Counter()
+        self.oldest = None
+        self.timer = None
+        self.counters = Counter()
+
+    def put(self, item, key, metric=None):
+        """Buffer item and return the item to be written
+
+        Same key replaces the pending item but keeps its PK & SK.
+        """
+
+        units = write_units(item) + (2 if metric else 0)
+        with self.lock:
+            self.counters["events"] += 1
+            # バッファがなければ1件ずつ書いていた分
+            self.counters["direct_units"] += units
+            if (pending := self.items.get(key, None)) is not None:
+                self.counters["coalesced"] += 1
+                item = {**item, "PK": pending["PK"], "SK": pending["SK"]}
+            if metric:
+                for period in periods(item["createdAt"]):
+                    self.counts[(metric, period)] += 1
+            self.items[key] = item
+            if self.oldest is None:
+                self.oldest = self.clock()
+                self.start_timer()
+            full = len(self.items) >= self.size
+        if full:
+            self.flush()
+        return item
+
+    def discard(self, pk, sk):
+        """Drop pending item by key, return True if found"""
+
+        with self.lock:
+            for key, item in list(self.items.items()):
+                if item["PK"] == pk and item["SK"] == sk:
+                    del self.items[key]
+                    return True
+        return False
+
+    def has_pending(self, pk):
+        with self.lock:
+            return any(item["PK"] == pk for item in self.items.values())
+
+    def expired(self):
+        with self.lock:
+            return (
+                self.oldest is not None and self.clock() - self.oldest >= self.max_age
+            )
+
+    def start_timer(self):
+        self.timer = threading.Timer(self.max_age, self.flush_expired)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def flush_expired(self):
+        if self.expired():
+            try:
+                self.flush()
+            except Exception:
+                # 書けなかった分はバッファに戻してあるので次に書く
+                pass
+
+    def take(self):
+        with self.lock:
+            items, counts = self.items, self.counts
+            self.items, self.counts = {}, Counter()
+            self.oldest = None
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            return items, counts
+
+    def restore(self, items, counts):
+        # 書けなかった分は戻す（新しいイベントが来ていればそちらを残す）
+        with self.lock:
+            for key, item in items.items():
+                self.items.setdefault(key, item)
+            self.counts.update(counts)
+            if self.items and self.oldest is None:
+                self.oldest = self.clock()
+                self.start_timer()
+
+    def flush(self):
+        """Write pending items with batch writer and counters with ADD"""
+
+        with self.flush_lock:
+            items, counts = self.take()
+            if not items and not counts:
+                return 0
+            table = self.table()
+            try:
+                with table.batch_writer() as batch:
+                    for item in items.values():
+                        batch.put_item(Item=item)
+            except BaseException as err:
+                print(f"write buffer flush failed: {err}")
+                self.restore(items, counts)
+                raise
+
+            failed = Counter()
+            for (metric, period), n in counts.items():
+                try:
+                    table.update_item(**increment_input(metric, period, count=n))
+                except BaseException as err:
+                    print(f"write buffer counter failed: {err}")
+                    failed[(metric, period)] = n
+            self.restore({}, failed)
+
+            with self.lock:
+                self.counters["flushes"] += 1
+                self.counters["written"] += len(items)
+                self.counters["batches"] += math.ceil(len(items) / 25)
+                self.counters["counter_updates"] += len(counts) - len(failed)
+                self.counters["written_units"] += (
+                    sum(write_units(item) for item in items.values())
+                    + len(counts)
+                    - len(failed)
+                )
+            return len(items)
+
+    def stats(self):
+        """Return counters and estimated write units saved by buffering"""
+
+        with self.lock:
+            stats = dict(self.counters)
+            stats["pending"] = len(self.items)
+            # まだ書いていない分は書くときにかかる分を見込んでおく
+            pending_units = sum(write_units(item) for item in self.items.values())
+            pending_units += len(self.counts)
+        stats["saved_units"] = (
+            stats.get("direct_units", 0) - stats.get("written_units", 0) - pending_units
+        )
+        return stats
+
+    def register_shutdown(self):
+        """Flush at interpreter exit & SIGTERM"""
+
+        atexit.register(self.flush)
+        try:
+            previous = signal.getsignal(signal.SIGTERM)
+
+            def on_sigterm(signum, frame):
+                self.flush()
+                if callable(previous):
+                    previous(signum, frame)
+                else:
+                    raise SystemExit(0)
+
+            signal.signal(signal.SIGTERM, on_sigterm)
+        except ValueError:
+            # メインスレッド以外からはシグナルを登録できない
+            pass
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from api.snapshot import encode
+
+#
+# タグ・カテゴリ・ユーザー・再生リストはほとんど変わらないのでプロセス内でキャッシュする
+# ・TTLが切れたら読み直す
+# ・書き込み時にinvalidateしてバージョンを上げる（読み込み中に書き込みがあれば捨てる）
+# ・Lambdaのコンテナ間では共有されないので、他のコンテナはTTLで追従する
+# ・読み込んだ内容のハッシュ(stamp)はETagに使う（api/etag.py、最初に使うときに計算する）
+#
+
+CATALOG_CACHE_TTL = float(os.environ.get("CATALOG_CACHE_TTL", 300))
+
+
+def content_stamp(items):
+    """Return hash of items (same content -> same stamp)"""
+
+    raw = json.dumps(items, sort_keys=True, default=encode, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CatalogCache:
+    """TTL & version stamped cache for each indexKey"""
+
+    def __init__(self, ttl=CATALOG_CACHE_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = {}
+        self.versions = defaultdict(int)
+        self.stamps = {}
+        self.counters = defaultdict(lambda: {"hit": 0, "miss": 0, "invalidate": 0})
+        self.lock = threading.Lock()
+
+    def version(self, index_key):
+        """Return current version stamp of indexKey"""
+
+        return self.versions[index_key]
+
+    def get(self, index_key, loader):
+        """Get items of indexKey from cache or loader"""
+
+        with self.lock:
+            version = self.versions[index_key]
+            entry = self.entries.get(index_key, None)
+            if entry is not None:
+                entry_version, expires_at, items = entry
+                if entry_version == version and self.clock() < expires_at:
+                    self.counters[index_key]["hit"] += 1
+                    return self.copy(items)
+            self.counters[index_key]["miss"] += 1
+
+        items = loader()
+        with self.lock:
+            # 読み込み中にinvalidateされていたらキャッシュしない
+            if self.versions[index_key] == version:
+                self.entries[index_key] = (version, self.clock() + self.ttl, items)
+        return self.copy(items)
+
+    def stamp(self, index_key):
+        """Return content stamp of cached items (None when not cached)"""
+
+        with self.lock:
+            entry = self.entries.get(index_key, None)
+            if entry is None:
+                return None
+            entry_version, expires_at, items = entry
+            if entry_version != self.versions[index_key] or self.clock() >= expires_at:
+                return None
+            # 同じエントリには1回だけ計算する
+            stamp = self.stamps.get(index_key, None)
+            if stamp is not None and stamp[0] is entry:
+                return stamp[1]
+
+        value = content_stamp(items)
+        with self.lock:
+            if self.entries.get(index_key, None) is entry:
+                self.stamps[index_key] = (entry, value)
+        return value
+
+    def invalidate(self, *index_keys):
+        """Invalidate cache of indexKeys and bump their versions"""
+
+        with self.lock:
+            for index_key in index_keys:
+                self.versions[index_key] += 1
+                self.entries.pop(index_key, None)
+                self.stamps.pop(index_key, None)
+                self.counters[index_key]["invalidate"] += 1
+
+    def stats(self):
+        """Return hit/miss counters for each indexKey"""
+
+        with self.lock:
+            stats = {}
+            for index_key, counter in self.counters.items():
+                total = counter["hit"] + counter["miss"]
+                stats[index_key] = {
+                    **counter,
+                    "version": self.versions[index_key],
+                    "hit_rate": counter["hit"] / total if total else 0.0,
+                }
+            return stats
+
+    @staticmethod
+    def copy(items):
+        # 呼び出し側でアイテムを書き換えるのでアイテムごとにコピーして返す
+        return [dict(item) for item in items]
+
+
+catalog_cache = CatalogCache()
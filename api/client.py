@@ -1,6 +1,115 @@
 from requests import HTTPError
 import urllib.parse
+import base64
+import hashlib
+import json
+import uuid
+import threading
+import time
+import concurrent.futures
+from collections import defaultdict
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+from botocore.exceptions import ClientError
 from .auth import Auth
+from .buffer import WRITE_BUFFER, WriteBuffer
+from .cache import catalog_cache
+from .counter import increment
+from .deserialize import (
+    FAST_DESERIALIZE,
+    client_input,
+    deserialize_item,
+    deserialize_page,
+)
+from .rank import sort_orders
+from .reference import ReferenceIndex
+from .vimeo_async import AsyncVimeoClient
+
+TABLE_NAME = "primary_table"
+# BatchGetItemは1リクエスト100キーまで
+BATCH_GET_SIZE = 100
+BATCH_GET_RETRIES = 8
+# TransactWriteItemsは1トランザクション100アイテムまで
+TRANSACT_WRITE_SIZE = 100
+# 一覧に表示する項目だけ読む（お気に入り・履歴・いいね）
+VIDEO_DISPLAY_FIELDS = ["uri", "name", "thumbnail", "duration", "plays", "invalid"]
+USER_DISPLAY_FIELDS = ["name", "image"]
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+
+def projection_input(fields):
+    """input ProjectionExpression (every attribute is aliased for reserved words)"""
+
+    names = {f"#f{i}": field for i, field in enumerate(dict.fromkeys(fields))}
+    return dict(
+        ProjectionExpression=", ".join(names),
+        ExpressionAttributeNames=names,
+    )
+
+
+def plan_transaction(items, size=TRANSACT_WRITE_SIZE):
+    """Split transact items into ordered chunks"""
+
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def chunk_token(token, index):
+    """ClientRequestToken of chunk (same token & index -> same request token)"""
+
+    return hashlib.sha256(f"{token}:{index}".encode("utf-8")).hexdigest()[:36]
+
+
+def encode_cursor(last_key):
+    """Encode LastEvaluatedKey to opaque cursor string"""
+
+    if not last_key:
+        return None
+    raw = json.dumps(last_key, separators=(",", ":"), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Decode opaque cursor string to ExclusiveStartKey"""
+
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii"))
+        return json.loads(raw.decode("utf-8"))
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor.")
+
+
+def paginate(items, limit=None, cursor=None):
+    """Slice items already in memory by offset cursor, return (items, next cursor)"""
+
+    start = (decode_cursor(cursor) or {}).get("offset", 0)
+    if limit is None:
+        return items[start:], None
+    end = start + max(limit, 0)
+    return items[start:end], (
+        encode_cursor({"offset": end}) if end < len(items) else None
+    )
+
+
+#
+# clientはプロセス内で1つだけ、最初に使われたときに作る（Lambdaのコールドスタート対策）
+#
+
+registry = {}
+registry_lock = threading.Lock()
+
+
+def shared(name, factory):
+    """Get process-wide client by name (build at first use)"""
+
+    if (client := registry.get(name, None)) is not None:
+        return client
+    with registry_lock:
+        if (client := registry.get(name, None)) is None:
+            client = registry[name] = factory()
+        return client
 
 
 class DynamoDB(Auth):
@@ -8,50 +117,300 @@ class DynamoDB(Auth):
 
     def __init__(self):
         super().__init__()
-        self.client = self.create_dynamodb_client()
-        self.resource = self.create_dynamodb_resoure()
-        self.s3 = self.create_s3_resource()
-        self.table = self.resource.Table("primary_table")
+        self.key_schemas = shared("dynamodb.key_schemas", dict)
+        self.cache = catalog_cache
+
+    @property
+    def client(self):
+        return shared("dynamodb.client", self.create_dynamodb_client)
+
+    @property
+    def resource(self):
+        return shared("dynamodb.resource", self.create_dynamodb_resoure)
+
+    @property
+    def s3(self):
+        return shared("s3.resource", self.create_s3_resource)
+
+    @property
+    def table(self):
+        return shared("dynamodb.table", lambda: self.resource.Table(TABLE_NAME))
+
+    @property
+    def buffer(self):
+        return write_buffer
+
+    def put_behind(self, item, key, metric=None):
+        """Put item through write buffer, return (item to be written, written)"""
+
+        if WRITE_BUFFER:
+            # まとめられたときは先にバッファにあったアイテムのキーで書かれる
+            return self.buffer.put(item, key, metric), False
+        self.table.put_item(Item=item)
+        if metric:
+            increment(self.table, metric, item["createdAt"])
+        return item, True
+
+    def get_key_names(self, index_name=None):
+        """Get key attribute names of table (and index) from DescribeTable"""
+
+        if index_name in self.key_schemas:
+            return self.key_schemas[index_name]
+
+        names = [key["AttributeName"] for key in self.table.key_schema]
+        if index_name is not None:
+            indexes = (self.table.global_secondary_indexes or []) + (
+                self.table.local_secondary_indexes or []
+            )
+            for index in indexes:
+                if index["IndexName"] == index_name:
+                    names += [key["AttributeName"] for key in index["KeySchema"]]
+        names = list(dict.fromkeys(names))
+        self.key_schemas[index_name] = names
+        return names
+
+    def project(self, input, fields):
+        """Add ProjectionExpression of fields (and key attributes) to input"""
+
+        if not fields:
+            return input
+        # カーソルを作るのでキー項目は必ず読む
+        key_names = self.get_key_names(input.get("IndexName", None))
+        projection = projection_input([*key_names, *fields])
+        return {
+            **input,
+            "ProjectionExpression": projection["ProjectionExpression"],
+            "ExpressionAttributeNames": {
+                **input.get("ExpressionAttributeNames", {}),
+                **projection["ExpressionAttributeNames"],
+            },
+        }
+
+    def query_pages(self, input, cursor=None, fast=FAST_DESERIALIZE):
+        """Query DynamoDB page by page following LastEvaluatedKey
+
+        fast=False reads with Table (Decimal & set) for items written back.
+        """
+
+        input = dict(input)
+        if (start_key := decode_cursor(cursor)) is not None:
+            input["ExclusiveStartKey"] = start_key
+        while True:
+            if fast:
+                # clientで読んでページごとにまとめて変換する（数値はint/float、集合はリスト）
+                res = self.client.query(TableName=TABLE_NAME, **client_input(input))
+                items = deserialize_page(res.get("Items", []))
+                if (last_key := res.get("LastEvaluatedKey", None)) is not None:
+                    last_key = deserialize_item(last_key)
+            else:
+                res = self.table.query(**input)
+                items = res.get("Items", [])
+                last_key = res.get("LastEvaluatedKey", None)
+            yield items, last_key
+            if last_key is None:
+                return
+            input["ExclusiveStartKey"] = last_key
+
+    def query_items(self, input, limit=None, cursor=None, fast=FAST_DESERIALIZE):
+        """Query items as stream and stop when limit is reached"""
+
+        count = 0
+        for items, _ in self.query_pages(input, cursor=cursor, fast=fast):
+            for item in items:
+                if limit is not None and count >= limit:
+                    return
+                count += 1
+                yield item
+
+    def query(
+        self, input, limit=None, cursor=None, cache_key=None, fast=FAST_DESERIALIZE
+    ):
+        """Query items up to limit, return items and cursor for next request"""
+
+        # 全件取得のときだけキャッシュを使う（キャッシュはFAST_DESERIALIZEの形で持つ）
+        if (
+            cache_key is not None
+            and limit is None
+            and cursor is None
+            and fast == FAST_DESERIALIZE
+        ):
+            items = self.cache.get(cache_key, lambda: self.query(input, fast=fast)[0])
+            return items, None
+
+        items = []
+        if limit is not None and limit <= 0:
+            return items, cursor
+        for page, last_key in self.query_pages(input, cursor=cursor, fast=fast):
+            if limit is None or len(items) + len(page) < limit:
+                items.extend(page)
+                next_key = last_key
+                continue
+            # limitに達したページでは最後に返したアイテムからカーソルを作る
+            rest = limit - len(items)
+            items.extend(page[:rest])
+            if rest < len(page):
+                key_names = self.get_key_names(input.get("IndexName", None))
+                next_key = {name: page[rest - 1][name] for name in key_names}
+            else:
+                next_key = last_key
+            break
+        return items, encode_cursor(next_key)
+
+    def batch_get(self, keys, fields=None, fast=FAST_DESERIALIZE):
+        """Get items by keys with BatchGetItem, return dict keyed by (PK, SK)"""
+
+        # 重複したキーがあるとBatchGetItemはエラーになる
+        keys = list({(key["PK"], key["SK"]): key for key in keys}.values())
+        chunks = [
+            keys[i : i + BATCH_GET_SIZE] for i in range(0, len(keys), BATCH_GET_SIZE)
+        ]
+        if len(chunks) <= 1:
+            pages = [self.batch_get_chunk(chunk, fields, fast) for chunk in chunks]
+        else:
+            # チャンクは並列に取得する（clientはスレッドセーフ）
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(len(chunks), 8)
+            ) as executor:
+                pages = list(
+                    executor.map(
+                        lambda c: self.batch_get_chunk(c, fields, fast), chunks
+                    )
+                )
+        return {(item["PK"], item["SK"]): item for page in pages for item in page}
+
+    def hydrate(self, rows, attribute, fields, to):
+        """Join referred items (PK=SK=row[attribute]) to row[to] with batched lookups"""
+
+        ids = [row[attribute] for row in rows if row.get(attribute, None)]
+        items = self.batch_get([{"PK": id, "SK": id} for id in ids], fields)
+        for row in rows:
+            id = row.get(attribute, None)
+            item = items.get((id, id), None)
+            # 削除された動画・ユーザーはNone
+            row[to] = (
+                None if item is None else {f: item[f] for f in fields if f in item}
+            )
+        return rows
+
+    def batch_get_chunk(self, keys, fields=None, fast=FAST_DESERIALIZE):
+        """Get items (up to 100 keys) and retry UnprocessedKeys with backoff"""
+
+        request = dict(
+            Keys=[
+                {name: serializer.serialize(value) for name, value in key.items()}
+                for key in keys
+            ]
+        )
+        if fields:
+            request.update(projection_input(["PK", "SK", *fields]))
+
+        items = []
+        attempt = 0
+        while True:
+            res = self.client.batch_get_item(RequestItems={TABLE_NAME: request})
+            items.extend(res.get("Responses", {}).get(TABLE_NAME, []))
+            if not (unprocessed := res.get("UnprocessedKeys", {}).get(TABLE_NAME)):
+                break
+            if attempt >= BATCH_GET_RETRIES:
+                raise RuntimeError("BatchGetItem: unprocessed keys remain")
+            request = unprocessed
+            time.sleep(min(0.05 * 2**attempt, 2))
+            attempt += 1
+
+        if fast:
+            return deserialize_page(items)
+        return [
+            {name: deserializer.deserialize(value) for name, value in item.items()}
+            for item in items
+        ]
+
+    def transact_write(self, items, token=None):
+        """Write transact items chunk by chunk with idempotent request tokens"""
+
+        # 同じtokenで再実行すると適用済みのチャンクはDynamoDB側で無視される（10分間）
+        # 途中で失敗したらエラーメッセージのtokenで再実行すれば続きから適用される
+        # 再実行でアイテムが変わっていると(タイムスタンプ・絞り込みでチャンクの区切りがずれる)
+        # 同じtokenが別のアイテムを指すので、適用済みとみなさずにエラーにする
+        token = token or str(uuid.uuid4())
+        chunks = plan_transaction(items)
+        result = dict(token=token, chunks=[], ConsumedCapacity=[])
+
+        for index, chunk in enumerate(chunks):
+            request_token = chunk_token(token, index)
+            try:
+                res = self.client.transact_write_items(
+                    TransactItems=chunk,
+                    ClientRequestToken=request_token,
+                    ReturnConsumedCapacity="INDEXES",
+                )
+            except ClientError as err:
+                error = err.response["Error"]
+                error["FailedChunk"] = index
+                if error.get("Code") == "IdempotentParameterMismatchException":
+                    error["Message"] = (
+                        f"chunk {index + 1}/{len(chunks)} does not match the request"
+                        f" sent before with token {token} (items have changed),"
+                        f" chunks before it are applied: retry with a new token"
+                    )
+                else:
+                    error["Message"] = (
+                        f"{error.get('Message', '')} (chunk {index + 1}/{len(chunks)}"
+                        f" failed, retry with token {token})"
+                    )
+                raise err
+
+            capacity = res.get("ConsumedCapacity", [])
+            result["chunks"].append(
+                dict(
+                    index=index,
+                    items=len(chunk),
+                    token=request_token,
+                    ConsumedCapacity=capacity,
+                )
+            )
+            result["ConsumedCapacity"].extend(capacity)
+        return result
 
     def merge_paths(self, paths, videos):
         """merge learning paths & video orders"""
 
+        # 再生リストごとにまとめてから付与する（O(P+V)）
+        orders = defaultdict(list)
+        for video in videos:
+            orders[video.get("PK")].append(video)
         for i, path in enumerate(paths, 1):
             path["id"] = i
-            orders = [
-                {"uri": video.get("SK", None), "order": video.get("order", 0)}
-                for video in videos
-                if path.get("PK") == video.get("PK")
+            path["videos"] = [
+                {"uri": video.get("SK", None), "order": video["order"]}
+                for video in sort_orders(orders.get(path.get("PK"), []))
             ]
-            path["videos"] = orders
-            path["videos"].sort(key=lambda x: x["order"])
         return paths
 
     def merge_categories(self, categories):
         """merge parent and child categories"""
 
-        def find_parent_name(category):
-            if (parent_id := category.get("parentId", None)) == "C999":
-                return ""
-            else:
-                for category in categories:
-                    if category.get("PK", None) == parent_id:
-                        return category["name"]
-                return ""
-
+        index = ReferenceIndex.build(categories=categories)
         merged = [
-            {**category, **{"id": i}, **{"parent": find_parent_name(category)}}
+            {**category, **{"id": i}, **{"parent": index.parent_name(category)}}
             for i, category in enumerate(categories, 1)
         ]
         return merged
 
 
+# 書き込みバッファもプロセス内で1つだけ
+write_buffer = WriteBuffer(lambda: DynamoDB().table)
+
+
 class VimeoAPI(Auth):
     """Generate VimeoAPI client"""
 
-    def __init__(self):
-        super().__init__()
-        self.client = self.create_vimeo_client()
+    @property
+    def client(self):
+        return shared("vimeo.client", self.create_vimeo_client)
+
+    @property
+    def aio(self):
+        return shared("vimeo.async", lambda: AsyncVimeoClient(token=self.vimeo_token))
 
     def sort(self, json):
         """Sort vimeo response"""
@@ -101,3 +460,9 @@ class VimeoAPI(Auth):
             raise err
         except BaseException as err:
             raise err
+
+    async def get_videos(self, page=1, all=False):
+        """Get videos from Vimeo by page (rest pages in parallel when all)"""
+
+        data = await self.aio.get_videos(page=page, all=all)
+        return [self.sort(d) for d in data]
@@ -0,0 +1,181 @@
+import os
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    # brotliがなければgzipだけ
+    brotli = None
+
+#
+# レスポンスの圧縮(gzip / brotli)
+# ・Accept-Encodingでbrを受け付けるならbrotli、なければgzip（q=0は使わない）
+# ・COMPRESS_MIN_SIZEより小さいレスポンス・圧縮済み・JSON/テキスト以外はそのまま返す
+# ・ストリーミング(ndjson)はチャンクごとにflushして、届いた行から読めるようにする
+# ・強いETagは表現(圧縮方式)ごとに変えるので、-gzip/-brを付ける（api/etag.pyで比べるときに外す）
+# ・圧縮したボディはMangumがbase64にして返す
+#   REST APIではbinaryMediaTypesに*/*を入れて、API Gatewayでバイナリに戻す(serverless.yml)
+#   入れないとクライアントにはbase64の文字列がContent-Encoding付きで届く
+#
+
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", 6))
+# 11は遅すぎるのでリクエストごとに圧縮するなら4くらい
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 4))
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "text/",
+)
+
+
+def accepted_encodings(accept_encoding):
+    """Return {encoding: q} of Accept-Encoding header"""
+
+    encodings = {}
+    for part in accept_encoding.split(","):
+        name, *params = [p.strip() for p in part.split(";")]
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        encodings[name.lower()] = q
+    return encodings
+
+
+def choose_encoding(accept_encoding):
+    """Return "br", "gzip" or None for Accept-Encoding header"""
+
+    encodings = accepted_encodings(accept_encoding or "")
+    candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+    wildcard = encodings.get("*", 0.0)
+    scored = [(encodings.get(name, wildcard), name) for name in candidates]
+    # qが同じならbrを優先する
+    q, name = max(scored, key=lambda score: score[0])
+    return name if q > 0 else None
+
+
+class Compressor:
+    """gzip / brotli compressor with same interface"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self.engine = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self.engine = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + 15)
+
+    def compress(self, data):
+        if self.encoding == "br":
+            return self.engine.process(data)
+        return self.engine.compress(data)
+
+    def flush(self):
+        """Flush pending output (stream can be read up to here)"""
+
+        if self.encoding == "br":
+            return self.engine.flush()
+        return self.engine.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == "br":
+            return self.engine.finish()
+        return self.engine.flush(zlib.Z_FINISH)
+
+
+def compressible(headers):
+    """Whether response of headers should be compressed"""
+
+    if "content-encoding" in headers:
+        return False
+    content_type = headers.get("content-type", "")
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses with brotli or gzip"""
+
+    def __init__(self, app, minimum_size=COMPRESS_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", None))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = CompressionResponder(self.app, encoding, self.minimum_size)
+        await responder(scope, receive, send)
+
+
+class CompressionResponder:
+    """Compress body of one response"""
+
+    def __init__(self, app, encoding, minimum_size):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send = None
+        self.start = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    def set_headers(self, headers):
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if (etag := headers.get("etag", None)) and etag.endswith('"'):
+            headers["ETag"] = f'{etag[:-1]}-{self.encoding}"'
+
+    async def send_compressed(self, message):
+        if message["type"] == "http.response.start":
+            # ボディの大きさを見てから決めるので、ヘッダーは最初のボディまで送らない
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is None:
+            headers = MutableHeaders(raw=self.start["headers"])
+            if not compressible(headers) or (
+                not more_body and len(body) < self.minimum_size
+            ):
+                self.passthrough = True
+                await self.send(self.start)
+                await self.send(message)
+                return
+            self.compressor = Compressor(self.encoding)
+            self.set_headers(headers)
+            if not more_body:
+                body = self.compressor.compress(body) + self.compressor.finish()
+                headers["Content-Length"] = str(len(body))
+                await self.send(self.start)
+                await self.send({**message, "body": body})
+                return
+            # ストリーミングは長さがわからない
+            del headers["Content-Length"]
+            await self.send(self.start)
+
+        if more_body:
+            body = self.compressor.compress(body) + self.compressor.flush()
+        else:
+            body = self.compressor.compress(body) + self.compressor.finish()
+        await self.send({**message, "body": body})
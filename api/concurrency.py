@@ -0,0 +1,97 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+
+#
+# 独立した読み込みを並列に実行する（複数のテーブル読み込みをまとめるエンドポイント用）
+# ・スレッドプールはプロセス内で1つだけ、同時実行数はFANOUT_WORKERSまで
+# ・boto3のclient/tableの呼び出しはI/O待ちなのでスレッドで十分並列になる
+# ・ブランチごとの所要時間を返すので、Server-Timingヘッダーにして遅い読み込みを見つける
+# ・ブランチの中からさらにgatherすると、プールが埋まって待ち合う(deadlock)ことがあるので
+#   ワーカースレッドの中では順番に実行する
+#
+
+FANOUT_WORKERS = int(os.environ.get("FANOUT_WORKERS", 8))
+
+executor = None
+executor_lock = threading.Lock()
+local = threading.local()
+
+
+def get_executor():
+    """Get process-wide bounded thread pool (build at first use)"""
+
+    global executor
+    if executor is None:
+        with executor_lock:
+            if executor is None:
+                executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=FANOUT_WORKERS, thread_name_prefix="fanout"
+                )
+    return executor
+
+
+def timed(func):
+    """Run func in worker, return (result, elapsed seconds)"""
+
+    local.in_worker = True
+    start = time.perf_counter()
+    try:
+        return func(), time.perf_counter() - start
+    finally:
+        local.in_worker = False
+
+
+def gather(**branches):
+    """Run branches (name=callable) in parallel, return (results, timings)
+
+    The first exception of branches (in given order) is raised.
+    """
+
+    if getattr(local, "in_worker", False) or len(branches) <= 1:
+        # 入れ子のgatherと1ブランチだけのときはその場で実行する
+        outcomes = {}
+        for name, func in branches.items():
+            start = time.perf_counter()
+            outcomes[name] = (func(), time.perf_counter() - start)
+    else:
+        pool = get_executor()
+        futures = {name: pool.submit(timed, func) for name, func in branches.items()}
+        outcomes = {name: future.result() for name, future in futures.items()}
+    results = {name: result for name, (result, _) in outcomes.items()}
+    timings = {name: elapsed for name, (_, elapsed) in outcomes.items()}
+    return results, timings
+
+
+async def gather_async(**branches):
+    """gather() for async endpoints (event loop is not blocked)"""
+
+    loop = asyncio.get_running_loop()
+    names = list(branches)
+    outcomes = await asyncio.gather(
+        *(loop.run_in_executor(get_executor(), timed, branches[n]) for n in names)
+    )
+    results = {name: result for name, (result, _) in zip(names, outcomes)}
+    timings = {name: elapsed for name, (_, elapsed) in zip(names, outcomes)}
+    return results, timings
+
+
+def server_timing(timings):
+    """Return Server-Timing header value of timings (milliseconds)"""
+
+    return ", ".join(
+        f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in timings.items()
+    )
+
+
+def set_server_timing(response, timings):
+    """Append timings to Server-Timing header of response"""
+
+    if response is None or not timings:
+        return
+    value = server_timing(timings)
+    if current := response.headers.get("Server-Timing", None):
+        value = f"{current}, {value}"
+    response.headers["Server-Timing"] = value
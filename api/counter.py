@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+#
+# 日別・時間別の集計アイテム（視聴数・ログイン数・アップロード数）
+# ・PK=Counter#<metric>, SK=D#yyyy-mm-dd（日別）/ H#yyyy-mm-dd hh（時間別）
+# ・イベントを書き込むときにADDで1ずつ足すので、件数は1回のGetItemで読める
+# ・ログインはユーザーの重複を数えないように、数えたユーザーをmembersに入れておく
+# ・indexKeyを持たないのでGSI-1-SKには載らない
+#
+
+COUNTER_PREFIX = "Counter#"
+DAILY = "D#"
+HOURLY = "H#"
+# metric: 同じ日(時間)に同じユーザーを数えるか
+METRICS = {"views": False, "logins": True, "uploads": False}
+MAX_SERIES_DAYS = 366
+
+
+def periods(timestamp):
+    """Return (day, hour) of timestamp formated yyyy-mm-dd hh:mm:ss"""
+
+    timestamp = timestamp.replace("T", " ")
+    return timestamp[:10], timestamp[:13]
+
+
+def counter_key(metric, period):
+    """key of counter item (period is yyyy-mm-dd or yyyy-mm-dd hh)"""
+
+    prefix = HOURLY if len(period) > 10 else DAILY
+    return {"PK": f"{COUNTER_PREFIX}{metric}", "SK": f"{prefix}{period}"}
+
+
+def increment_input(metric, period, member=None, count=1):
+    """input count up counter item"""
+
+    input = dict(
+        Key=counter_key(metric, period),
+        UpdateExpression="ADD #count :count",
+        # count is reserved
+        ExpressionAttributeNames={"#count": "count"},
+        ExpressionAttributeValues={":count": count},
+    )
+    if member is not None:
+        input["UpdateExpression"] += ", members :members"
+        input["ConditionExpression"] = "NOT contains(members, :member)"
+        input["ExpressionAttributeValues"][":members"] = {member}
+        input["ExpressionAttributeValues"][":member"] = member
+    return input
+
+
+def increment(table, metric, timestamp, member=None):
+    """Count up daily & hourly counters of event"""
+
+    if not METRICS[metric]:
+        member = None
+    for period in periods(timestamp):
+        try:
+            table.update_item(**increment_input(metric, period, member))
+        except ClientError as err:
+            # 数え済みのユーザー
+            if err.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+
+def get_count(table, metric, period):
+    """Return count of period with one GetItem"""
+
+    res = table.get_item(
+        Key=counter_key(metric, period),
+        ProjectionExpression="#count",
+        ExpressionAttributeNames={"#count": "count"},
+    )
+    return int(res.get("Item", {}).get("count", 0))
+
+
+def date_range(start, end):
+    """Return dates (yyyy-mm-dd) from start to end"""
+
+    first = datetime.strptime(start, "%Y-%m-%d")
+    last = datetime.strptime(end, "%Y-%m-%d")
+    days = (last - first).days + 1
+    if days < 1:
+        raise ValueError(f"Invalid date range: {start} - {end}")
+    if days > MAX_SERIES_DAYS:
+        raise ValueError(f"Date range is too long (max {MAX_SERIES_DAYS} days)")
+    return [(first + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+
+
+def query_series(metric, start, end, hourly=False):
+    """input get counters of metric from start to end"""
+
+    prefix = HOURLY if hourly else DAILY
+    last = f"{end} 23" if hourly else end
+    return dict(
+        KeyConditionExpression=Key("PK").eq(f"{COUNTER_PREFIX}{metric}")
+        & Key("SK").between(f"{prefix}{start}", f"{prefix}{last}"),
+        ProjectionExpression="SK, #count",
+        ExpressionAttributeNames={"#count": "count"},
+    )
+
+
+def fill_series(items, start, end, hourly=False):
+    """Return [{period, count}] of every day (hour) including zero"""
+
+    counts = {item["SK"][2:]: int(item.get("count", 0)) for item in items}
+    series = []
+    for day in date_range(start, end):
+        if hourly:
+            series.extend(
+                {"period": f"{day} {h:02}", "count": counts.get(f"{day} {h:02}", 0)}
+                for h in range(24)
+            )
+        else:
+            series.append({"period": day, "count": counts.get(day, 0)})
+    return series
@@ -0,0 +1,110 @@
+import os
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeSerializer
+
+#
+# client(低レベルAPI)のレスポンスをPythonの値にまとめて変換する
+# ・resource(Table)はTypeDeserializerで属性ごとにDecimal/setを作り、pydanticがもう一度変換している
+# ・数値は整数ならint、15桁までの小数ならfloat（それより長い小数は丸めないようにDecimal）
+# ・集合(SS/NS/BS)はリストにする（JSONにそのまま出せる、path/tagのlist()の回避策も不要）
+# ・バイナリはclientがbytesにしているのでそのまま
+# ・FAST_DESERIALIZE=offならresourceのTable経由で読む（今まで通り）
+# ・読み込み専用: floatとリストはTypeSerializerで書けない(float)・型が変わる(SS->L)ので、
+#   読んだアイテムをそのまま書き戻すときはquery/batch_getにfast=Falseを付けて読む
+#
+
+FAST_DESERIALIZE = os.environ.get("FAST_DESERIALIZE", "on") != "off"
+# floatで誤差なく表せる10進の桁数
+FLOAT_DIGITS = 15
+
+serializer = TypeSerializer()
+
+
+def to_number(text):
+    """Return int, float (up to 15 digits) or Decimal of DynamoDB number"""
+
+    if "." not in text and "e" not in text and "E" not in text:
+        return int(text)
+    digits = sum(char.isdigit() for char in text.split("e")[0].split("E")[0])
+    if digits <= FLOAT_DIGITS:
+        return float(text)
+    return Decimal(text)
+
+
+def deserialize_value(value):
+    """Return Python value of DynamoDB attribute value ({"S": ...} etc.)"""
+
+    # 属性値は1つのキーだけを持つ（多い順に調べる）
+    if "S" in value:
+        return value["S"]
+    if "N" in value:
+        return to_number(value["N"])
+    if "BOOL" in value:
+        return value["BOOL"]
+    if "M" in value:
+        return deserialize_item(value["M"])
+    if "L" in value:
+        return [deserialize_value(v) for v in value["L"]]
+    if "NULL" in value:
+        return None
+    if "SS" in value:
+        return list(value["SS"])
+    if "NS" in value:
+        return [to_number(n) for n in value["NS"]]
+    if "B" in value:
+        return value["B"]
+    if "BS" in value:
+        return list(value["BS"])
+    raise TypeError(f"Unknown DynamoDB data type: {', '.join(value) or 'empty'}")
+
+
+def deserialize_item(item):
+    """Return dict of DynamoDB item"""
+
+    return {
+        name: v["S"] if "S" in v else deserialize_value(v) for name, v in item.items()
+    }
+
+
+def deserialize_page(items):
+    """Return list of dict of DynamoDB items (Items of Query/Scan/BatchGetItem)"""
+
+    # 関数呼び出しを減らすため、文字列はその場で取り出す
+    value = deserialize_value
+    return [
+        {name: v["S"] if "S" in v else value(v) for name, v in item.items()}
+        for item in items
+    ]
+
+
+def serialize_item(item):
+    """Return DynamoDB item of dict (keys, ExpressionAttributeValues)"""
+
+    return {name: serializer.serialize(value) for name, value in item.items()}
+
+
+def client_input(input):
+    """Convert Table.query input (conditions & Python values) for client.query"""
+
+    input = dict(input)
+    names = dict(input.get("ExpressionAttributeNames", {}))
+    values = dict(input.get("ExpressionAttributeValues", {}))
+    builder = ConditionExpressionBuilder()
+    for param, is_key in (
+        ("KeyConditionExpression", True),
+        ("FilterExpression", False),
+    ):
+        if isinstance(condition := input.get(param, None), ConditionBase):
+            built = builder.build_expression(condition, is_key_condition=is_key)
+            input[param] = built.condition_expression
+            names.update(built.attribute_name_placeholders)
+            values.update(built.attribute_value_placeholders)
+    if names:
+        input["ExpressionAttributeNames"] = names
+    if values:
+        input["ExpressionAttributeValues"] = serialize_item(values)
+    if (start_key := input.get("ExclusiveStartKey", None)) is not None:
+        input["ExclusiveStartKey"] = serialize_item(start_key)
+    return input
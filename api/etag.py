@@ -0,0 +1,98 @@
+import hashlib
+
+from fastapi import Response
+
+from api.cache import catalog_cache, content_stamp
+
+#
+# 一覧の条件付きGET（ETag / If-None-Match -> 304）
+# ・ETagは内容から作る強いETag（同じ内容なら、どのLambdaコンテナ・いつ作っても同じ値になる）
+# ・カタログ（タグ・カテゴリ・ユーザー・再生リスト）はキャッシュした内容のハッシュ(stamp)から作る
+#   キャッシュが有効な間はDynamoDBを読まずに304を返せる
+#   （CatalogCacheのバージョンはプロセスごとの連番なので、コンテナ間で比べられるETagには使わない）
+# ・キャッシュしない一覧は、全アイテムにupdatedAtがあれば(件数, 最大のupdatedAt, キーとupdatedAt)から、
+#   なければ内容そのものから作る
+# ・圧縮したレスポンスはETagに-gzip/-brを付ける(api/compression.py)ので、比べるときは外す
+#
+
+ENCODING_SUFFIXES = ("-gzip", "-br")
+
+
+def etag_of(*parts):
+    """Return strong ETag (quoted) of parts"""
+
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def result_etag(items, *parts):
+    """Return ETag of query result (by updatedAt when every item has it)"""
+
+    if items and all("updatedAt" in item for item in items):
+        keys = hashlib.sha256()
+        for item in items:
+            keys.update(f"{item.get('PK')}\0{item.get('SK')}\0".encode("utf-8"))
+            keys.update(f"{item['updatedAt']}\0".encode("utf-8"))
+        latest = max(item["updatedAt"] for item in items)
+        return etag_of(len(items), latest, keys.hexdigest(), *parts)
+    return etag_of(content_stamp(items), *parts)
+
+
+def catalog_etag(index_key, *parts):
+    """Return ETag of cached catalog (None when cache is not loaded)"""
+
+    if (stamp := catalog_cache.stamp(index_key)) is None:
+        return None
+    return etag_of(index_key, stamp, *parts)
+
+
+def matches(request, etag):
+    """Whether If-None-Match of request matches etag"""
+
+    if request is None or etag is None:
+        return False
+    if not (value := request.headers.get("if-none-match", None)):
+        return False
+    for tag in value.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        # If-None-Matchは弱い比較をする
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        for suffix in ENCODING_SUFFIXES:
+            if tag.endswith(f'{suffix}"'):
+                tag = tag[: -len(suffix) - 1] + '"'
+        if tag == etag:
+            return True
+    return False
+
+
+def set_etag(response, etag):
+    """Set ETag to response header"""
+
+    if response is not None and etag is not None:
+        response.headers["ETag"] = etag
+
+
+def conditional(request, response, etag):
+    """Return 304 response if etag matches, otherwise set ETag and return None"""
+
+    if etag is None:
+        return None
+    if matches(request, etag):
+        return not_modified(etag, response)
+    set_etag(response, etag)
+    return None
+
+
+def not_modified(etag, response=None):
+    """Return 304 response (headers set to response are kept)"""
+
+    headers = dict(response.headers) if response is not None else {}
+    headers.pop("content-length", None)
+    headers["ETag"] = etag
+    return Response(status_code=304, headers=headers)
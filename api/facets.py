@@ -0,0 +1,182 @@
+import threading
+import time
+from collections import defaultdict
+
+from api.cache import CATALOG_CACHE_TTL, catalog_cache
+
+#
+# 動画の絞り込み用のビットマップインデックス（プロセス内）
+# ・動画ごとに連番(ordinal)を振って、タグ・カテゴリ・再生リスト・公開/非公開をintのビット列で持つ
+# ・連番は作成日時の古い順に振るので、上位ビットから読めば新しい順になる
+# ・複数条件はビット演算(&, |)で絞り込み、件数はビット数で数える
+# ・動画の書き込みで差分だけ更新する、再生リスト・タグの削除などはinvalidate("Video")で作り直す
+#
+
+FACETS = {
+    "categoryIds": "categoryId",
+    "tagIds": "tagIds",
+    "learningPathIds": "learningPathIds",
+}
+
+
+def popcount(bits):
+    # int.bit_count()は3.10から
+    return bin(bits).count("1")
+
+
+def iter_bits(bits):
+    """Yield ordinals of set bits from highest"""
+
+    while bits:
+        ordinal = bits.bit_length() - 1
+        yield ordinal
+        bits ^= 1 << ordinal
+
+
+def values_of(video, attribute):
+    value = video.get(attribute, None)
+    if not value:
+        return set()
+    if isinstance(value, str):
+        return {value}
+    return {v for v in value if v}
+
+
+class FacetIndex:
+    """Bitmap index of videos by category, tags, learning paths & invalid"""
+
+    def __init__(self, ttl=CATALOG_CACHE_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        self.videos = []
+        self.ordinals = {}
+        self.bitmaps = {facet: defaultdict(int) for facet in FACETS}
+        self.all = 0
+        self.invalid = 0
+        self.version = None
+        self.expires_at = 0.0
+
+    def build(self, videos, version=None):
+        """Build index from video items (ordinals by createdAt)"""
+
+        with self.lock:
+            self.reset()
+            for video in sorted(videos, key=lambda v: v.get("createdAt", "")):
+                self.upsert(video)
+            self.version = version
+            self.expires_at = self.clock() + self.ttl
+        return self
+
+    def ensure(self, loader):
+        """Rebuild from loader when expired or invalidated"""
+
+        version = catalog_cache.version("Video")
+        with self.lock:
+            if self.version == version and self.clock() < self.expires_at:
+                return self
+        return self.build(loader(), version)
+
+    def upsert(self, video):
+        """Add or replace video (new video gets the highest ordinal)"""
+
+        with self.lock:
+            uri = video["PK"]
+            if (ordinal := self.ordinals.get(uri, None)) is None:
+                ordinal = len(self.videos)
+                self.ordinals[uri] = ordinal
+                self.videos.append(video)
+            else:
+                self.unset(ordinal)
+                self.videos[ordinal] = video
+
+            bit = 1 << ordinal
+            self.all |= bit
+            if video.get("invalid", False):
+                self.invalid |= bit
+            for facet, attribute in FACETS.items():
+                for value in values_of(video, attribute):
+                    self.bitmaps[facet][value] |= bit
+
+    def update(self, uri, attributes):
+        """Merge updated attributes into indexed video"""
+
+        with self.lock:
+            if (ordinal := self.ordinals.get(uri, None)) is None:
+                return
+            self.upsert({**self.videos[ordinal], **attributes})
+
+    def unset(self, ordinal):
+        video = self.videos[ordinal]
+        mask = ~(1 << ordinal)
+        self.all &= mask
+        self.invalid &= mask
+        for facet, attribute in FACETS.items():
+            bitmaps = self.bitmaps[facet]
+            for value in values_of(video, attribute):
+                bitmaps[value] &= mask
+                if not bitmaps[value]:
+                    del bitmaps[value]
+
+    def scope(self, open=True, name=None):
+        """Bits of videos before facet filters (open & name)"""
+
+        bits = self.all & ~self.invalid if open else self.all
+        if name:
+            # タイトルの部分一致はビットマップにできないので候補だけ見る
+            for ordinal in iter_bits(bits):
+                if name not in (self.videos[ordinal].get("name", None) or ""):
+                    bits &= ~(1 << ordinal)
+        return bits
+
+    def mask(self, filters, scope, exclude=None):
+        """Bits of videos matching filters (OR in a facet, AND across facets)"""
+
+        bits = scope
+        for facet, values in filters.items():
+            if facet == exclude or not values:
+                continue
+            bitmaps = self.bitmaps[facet]
+            bits &= self.union(bitmaps.get(value, 0) for value in values)
+        return bits
+
+    @staticmethod
+    def union(bitmaps):
+        bits = 0
+        for bitmap in bitmaps:
+            bits |= bitmap
+        return bits
+
+    def counts(self, filters, scope):
+        """Count videos of each facet value (other facets are applied)"""
+
+        result = {}
+        for facet, bitmaps in self.bitmaps.items():
+            # 選んだ値以外の件数も出せるように、自分のファセットは除いて数える
+            bits = self.mask(filters, scope, exclude=facet)
+            result[facet] = {
+                value: n
+                for value, bitmap in bitmaps.items()
+                if (n := popcount(bitmap & bits))
+            }
+        return result
+
+    def search(self, filters, open=True, name=None, offset=0, limit=None):
+        """Return (videos of page, total, counts) for filters"""
+
+        with self.lock:
+            scope = self.scope(open, name)
+            bits = self.mask(filters, scope)
+            videos = []
+            for i, ordinal in enumerate(iter_bits(bits)):
+                if limit is not None and i >= offset + limit:
+                    break
+                if i >= offset:
+                    videos.append(dict(self.videos[ordinal]))
+            return videos, popcount(bits), self.counts(filters, scope)
+
+
+facet_index = FacetIndex()
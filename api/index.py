@@ -14,6 +14,11 @@ from .routes.favorite import favorite
 from .routes.like import like
 from .routes.history import history
 from .routes.thread import thread
+from .routes.cache import cache
+from .routes.counter import counter
+from .buffer import IN_LAMBDA, WRITE_BUFFER
+from .client import VimeoAPI, write_buffer
+from .compression import COMPRESS_MIN_SIZE, CompressionMiddleware
 
 app = FastAPI(
     title="Prime Studio API v2",
@@ -32,6 +37,8 @@ app.include_router(favorite.router)
 app.include_router(like.router)
 app.include_router(history.router)
 app.include_router(thread.router)
+app.include_router(cache.router)
+app.include_router(counter.router)
 
 # Allow domain
 origins = [
@@ -49,6 +56,24 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Server-Timing"],
 )
+# gzip / brotli (小さいレスポンスは圧縮しない)
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESS_MIN_SIZE)
 
 handler = Mangum(app)
+
+
+async def close_vimeo():
+    """Close Vimeo connection pool of server event loop"""
+
+    await VimeoAPI().aio.close()
+
+
+# Mangumは呼び出しごとにshutdownを送るので、Lambdaではコネクションを閉じない（使い回す）
+if not IN_LAMBDA:
+    app.add_event_handler("shutdown", close_vimeo)
+
+# 常駐するサーバーで動かすときは、ためた書き込みを終了時に書く（Lambdaではバッファを使わない）
+if WRITE_BUFFER:
+    write_buffer.register_shutdown()
@@ -0,0 +1,75 @@
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+#
+# DynamoDBのアイテムとVimeoのレコードをキーで結合する
+# inner: 両方にあるものだけ
+# left : 左側(DB)は全て
+# outer: 両方とも全て
+#
+
+HOW = ("inner", "left", "outer")
+
+
+@dataclass
+class JoinResult:
+    """Joined records & unmatched records for each side"""
+
+    records: list = field(default_factory=list)
+    left_only: list = field(default_factory=list)
+    right_only: list = field(default_factory=list)
+
+
+def build_index(records, key):
+    """Build hash index of records by key"""
+
+    index = defaultdict(list)
+    for record in records:
+        if (value := record.get(key, None)) is not None:
+            index[value].append(record)
+    return index
+
+
+def hash_join(left, right, left_key="PK", right_key="uri", how="outer"):
+    """Join records by hash index (left is updated with right)"""
+
+    if how not in HOW:
+        raise ValueError(f"how must be one of {HOW}")
+
+    index = build_index(right, right_key)
+    matched = set()
+    result = JoinResult()
+
+    for item in left:
+        value = item.get(left_key, None)
+        if (data := index.get(value, None)) is None:
+            # 左側にだけある
+            item["match"] = False
+            result.left_only.append(item)
+            if how != "inner":
+                result.records.append(item)
+            continue
+        matched.add(value)
+        for d in data:
+            item.update(d)
+            item["match"] = True
+            result.records.append(item)
+
+    for data in right:
+        if data.get(right_key, None) in matched:
+            data["match"] = True
+            continue
+        # 右側にだけある
+        data["match"] = False
+        result.right_only.append(data)
+        if how == "outer":
+            result.records.append(data)
+
+    return result
+
+
+def join_videos(db_items, vimeo_data, all):
+    """Join videos from DynamoDB & videos from Vimeo by PK/uri"""
+
+    how = "outer" if all else "inner"
+    return hash_join(db_items, vimeo_data, left_key="PK", right_key="uri", how=how)
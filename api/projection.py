@@ -0,0 +1,63 @@
+from functools import lru_cache
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import create_model
+
+#
+# 読み込みの項目指定(fields=uri,name,thumbnail)
+# ・DynamoDBにはProjectionExpressionで指定した項目だけ読ませる（予約語はclient.projection_inputで別名にする）
+# ・レスポンスは指定した項目だけのモデル(部分モデル)で検証して返す
+#   （response_modelはリクエストごとに変えられないのでJSONResponseで返す）
+# ・fieldsがなければ今まで通り、アイテム全体をresponse_modelで返す
+#
+
+
+def parse_fields(fields, model):
+    """Return field names of comma separated fields (None when not given)"""
+
+    if not fields:
+        return None
+    names = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [name for name in names if name not in model.__fields__]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+
+@lru_cache(maxsize=256)
+def partial_model(model, fields):
+    """Model with only fields (every field is optional)"""
+
+    definitions = {}
+    for name in fields:
+        field = model.__fields__[name]
+        default = None if field.required else field.default
+        definitions[name] = (field.outer_type_, default)
+    return create_model(f"{model.__name__}Partial", **definitions)
+
+
+def shape(items, model, fields):
+    """Validate items (list or item) by partial model of fields"""
+
+    partial = partial_model(model, tuple(fields))
+    if isinstance(items, list):
+        return [partial(**item).dict() for item in items]
+    return partial(**items).dict()
+
+
+def partial_response(content, response=None):
+    """JSONResponse of shaped content (headers set to response are kept)"""
+
+    headers = dict(response.headers) if response is not None else None
+    if headers:
+        headers.pop("content-length", None)
+    return JSONResponse(content=jsonable_encoder(content), headers=headers)
+
+
+def select(items, model, fields, response=None):
+    """Return items as is, or partial response when fields are given"""
+
+    if fields is None:
+        return items
+    return partial_response(shape(items, model, fields), response)
@@ -0,0 +1,111 @@
+#
+# 再生順のランクキー（辞書順で並ぶ文字列）
+# ・2つのランクの間には必ず別のランクが作れるので、移動・追加は動かした動画の行だけ書き換える
+# ・間に入れ続けると文字列が長くなるので、長くなったら再生リストごとに振り直す(rebalance)
+# ・APIのorderは読み込み時にランク順で1から振り直す
+#
+
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+REBALANCE_LENGTH = 12
+
+
+def rank_between(before=None, after=None):
+    """Return rank between before and after (None means open end)"""
+
+    before = before or ""
+    if after is not None and not before < after:
+        raise ValueError(f"Invalid rank range: {before} - {after}")
+
+    rank = ""
+    i = 0
+    while True:
+        low = DIGITS.index(before[i]) if i < len(before) else 0
+        high = DIGITS.index(after[i]) if after is not None and i < len(after) else BASE
+        if low == high:
+            rank += DIGITS[low]
+            i += 1
+            continue
+        middle = (low + high) // 2
+        if middle > low:
+            return rank + DIGITS[middle]
+        # 隣り合う桁なら下側の桁を取って、以降は上限なしで間を探す
+        rank += DIGITS[low]
+        i += 1
+        after = None
+
+
+def spread_ranks(n):
+    """Return n ranks spread evenly (for migration & rebalance)"""
+
+    width = 1
+    while BASE**width <= n:
+        width += 1
+    width += 1
+    step = BASE**width // (n + 1)
+    ranks = []
+    for k in range(1, n + 1):
+        value = step * k
+        digits = []
+        for _ in range(width):
+            value, digit = divmod(value, BASE)
+            digits.append(DIGITS[digit])
+        # 末尾の0は落としても順序は変わらない（0で終わると前に入れられない）
+        ranks.append("".join(reversed(digits)).rstrip("0"))
+    return ranks
+
+
+def plan_ranks(current, desired):
+    """Return {uri: new rank} for rows to change so that desired order holds
+
+    current: {uri: rank} of existing rows (rank can be None)
+    desired: uris in new order
+    """
+
+    # 今の順序のまま残せる最大の行（最長増加部分列）は書き換えない
+    ranked = [(i, current[uri]) for i, uri in enumerate(desired) if current.get(uri)]
+    tails, links = [], [None] * len(ranked)
+    for j, (_, rank) in enumerate(ranked):
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ranked[tails[mid]][1] < rank:
+                lo = mid + 1
+            else:
+                hi = mid
+        links[j] = tails[lo - 1] if lo else None
+        if lo == len(tails):
+            tails.append(j)
+        else:
+            tails[lo] = j
+    keep = set()
+    j = tails[-1] if tails else None
+    while j is not None:
+        keep.add(ranked[j][0])
+        j = links[j]
+
+    # 後ろ側で一番近い残す行のランク
+    following = [None] * len(desired)
+    for i in range(len(desired) - 2, -1, -1):
+        following[i] = current[desired[i + 1]] if i + 1 in keep else following[i + 1]
+
+    changes = {}
+    previous = None
+    for i, uri in enumerate(desired):
+        if i in keep:
+            previous = current[uri]
+            continue
+        previous = rank_between(previous, following[i])
+        changes[uri] = previous
+    return changes
+
+
+def sort_orders(rows):
+    """Sort order rows by rank (legacy rows by order) and number them from 1"""
+
+    rows = sorted(
+        rows, key=lambda row: (row.get("rank", None) or "", row.get("order", 0))
+    )
+    for i, row in enumerate(rows, 1):
+        row["order"] = i
+    return rows
@@ -0,0 +1,120 @@
+from dataclasses import dataclass, field
+
+#
+# カテゴリ・タグ・再生リスト・ユーザーをPKで引くためのインデックス
+# リクエストごとに1回作る（またはキャッシュして使い回す）
+#
+
+ROOT_CATEGORY = "C999"
+
+
+@dataclass
+class ReferenceIndex:
+    """Lookup index of categories, tags, paths and users by PK"""
+
+    categories: dict = field(default_factory=dict)
+    tags: dict = field(default_factory=dict)
+    paths: dict = field(default_factory=dict)
+    users: dict = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, categories=(), tags=(), paths=(), users=()):
+        """Build index from items of DynamoDB"""
+
+        def names(items):
+            return {item["PK"]: item.get("name", "") for item in items}
+
+        def positions(items):
+            # 名前は参照データの並び順で返すので位置も持っておく
+            return {
+                item["PK"]: (i, item.get("name", "")) for i, item in enumerate(items)
+            }
+
+        return cls(
+            categories={category["PK"]: category for category in categories},
+            tags=positions(tags),
+            paths=positions(paths),
+            users=names(users),
+        )
+
+    def category_names(self, category_id):
+        """Return (parent name, category name) of category"""
+
+        if (category := self.categories.get(category_id, None)) is None:
+            return "", ""
+        parent_id = category.get("parentId", ROOT_CATEGORY)
+        if (
+            parent_id == ROOT_CATEGORY
+            or (parent := self.categories.get(parent_id, None)) is None
+        ):
+            return "", category.get("name", "")
+        return parent.get("name", ""), category.get("name", "")
+
+    def parent_name(self, category):
+        """Return parent category name of category"""
+
+        return self.category_names(category.get("PK", None))[0]
+
+    def tag_names(self, tag_ids):
+        """Return tag names of tag IDs (unknown IDs are skipped)"""
+
+        return self._names(self.tags, tag_ids)
+
+    def path_names(self, path_ids):
+        """Return learning path names of path IDs (unknown IDs are skipped)"""
+
+        return self._names(self.paths, path_ids)
+
+    @staticmethod
+    def _names(positions, ids):
+        if not ids:
+            return []
+        found = sorted(positions[id] for id in ids if id in positions)
+        return [name for _, name in found]
+
+    def user_name(self, user_id):
+        """Return user name of user ID"""
+
+        return self.users.get(user_id, "")
+
+
+def build_video_rows(videos, index):
+    """Create table rows for videos in one pass"""
+
+    category_names = index.category_names
+    tag_names = index.tag_names
+    path_names = index.path_names
+    user_name = index.user_name
+
+    rows = []
+    for i, video in enumerate(videos, 1):
+        get = video.get
+        thumbnail = get("thumbnail", None) or {}
+        stats = get("stats", None) or {}
+        primary, secondary = category_names(get("categoryId", None))
+        created_user = get("createdUser", None)
+        rows.append(
+            {
+                "id": i,
+                "match": get("match", True),
+                "uri": get("uri", ""),
+                "invalid": get("invalid", True),
+                "thumbnail": thumbnail.get("link", ""),
+                "name": get("name", ""),
+                "description": get("description", ""),
+                "primary": primary,
+                "secondary": secondary,
+                "tags": tag_names(get("tagIds", None)),
+                "paths": path_names(get("learningPathIds", None)),
+                "note": get("note", ""),
+                "duration": get("duration", 0),
+                "plays": stats.get("plays", 0),
+                "createdUser": user_name(created_user) if created_user else "",
+                "updatedUser": (
+                    user_name(get("updatedUser", None)) if created_user else ""
+                ),
+                "createdAt": get("createdAt", ""),
+                "updatedAt": get("updatedAt", ""),
+            }
+        )
+    return rows
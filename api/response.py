@@ -0,0 +1,132 @@
+import json
+from functools import lru_cache
+
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic.fields import SHAPE_SINGLETON
+
+from api.snapshot import encode
+
+try:
+    import orjson
+except ImportError:
+    # orjsonがなければ標準のjsonで書く（区切りの空白を省くだけ）
+    orjson = None
+
+#
+# 大きな一覧(数千件)を速く返すためのレスポンス(mode=fast / mode=ndjson)
+# ・DynamoDB/Vimeoから読んだデータはresponse_modelで検証しない
+#   modelを渡すと、ないフィールドはモデルのデフォルトで埋めて、int/floatのフィールドが
+#   文字列で入っていれば数値にする（modeがなくても同じ型で返るように、変換はここまで）
+#   モデルにない属性もそのまま出る、Decimal/setはJSONにするときに変換する
+# ・fast: orjsonで1回でJSONにする
+# ・ndjson: 1行1アイテムで少しずつ返す（全体のJSONを作らないので、メモリは1チャンク分）
+#   Lambda(API Gateway)ではまとめて返ることになるが、uvicornで動かすと届いた行から表示できる
+# ・modeがなければ今まで通りresponse_modelで検証して返す
+#
+
+MODES = ("fast", "ndjson")
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# ndjsonで1回に送る行数
+NDJSON_CHUNK_ROWS = 500
+
+
+def parse_mode(mode):
+    """Return response mode (None when not given)"""
+
+    if not mode:
+        return None
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode: {mode} ({', '.join(MODES)})")
+    return mode
+
+
+def dumps(content):
+    """Encode content to JSON bytes (Decimal & set are converted)"""
+
+    if orjson is not None:
+        return orjson.dumps(content, default=encode)
+    return json.dumps(
+        content, default=encode, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded without validation & jsonable_encoder"""
+
+    def render(self, content):
+        return dumps(content)
+
+
+@lru_cache(maxsize=None)
+def model_defaults(model):
+    """Return (defaults, {number field: type}) of pydantic model"""
+
+    defaults, numbers = {}, {}
+    for name, field in model.__fields__.items():
+        if not field.required:
+            defaults[name] = field.default
+        if field.shape == SHAPE_SINGLETON and field.type_ in (int, float):
+            numbers[name] = field.type_
+    return defaults, numbers
+
+
+def conform(items, model):
+    """Return items with model defaults & numbers converted (no validation)"""
+
+    defaults, numbers = model_defaults(model)
+    rows = []
+    for item in items:
+        row = {**defaults, **item}
+        for name, kind in numbers.items():
+            # update_itemで書いた値は文字列のことがある（pydanticと同じく変換する）
+            if isinstance(value := row.get(name, None), str):
+                try:
+                    row[name] = kind(value)
+                except ValueError:
+                    pass
+        rows.append(row)
+    return rows
+
+
+def pick(items, fields):
+    """Return items with only fields (no validation)"""
+
+    return [{name: item.get(name, None) for name in fields} for item in items]
+
+
+def ndjson_lines(items, fields=None, size=NDJSON_CHUNK_ROWS, model=None):
+    """Yield chunks of JSON lines of items"""
+
+    for i in range(0, len(items), size):
+        rows = items[i : i + size]
+        if model is not None:
+            rows = conform(rows, model)
+        if fields is not None:
+            rows = pick(rows, fields)
+        yield b"".join(dumps(row) + b"\n" for row in rows)
+
+
+def headers_of(response):
+    # エンドポイントで設定したヘッダー(X-Next-Cursor等)を引き継ぐ
+    headers = dict(response.headers) if response is not None else {}
+    headers.pop("content-length", None)
+    return headers
+
+
+def fast_response(items, mode, response=None, fields=None, model=None):
+    """Return FastJSONResponse or streaming NDJSON response of items
+
+    model fills defaults & converts numbers of items (same types as without mode).
+    """
+
+    if mode == "ndjson":
+        return StreamingResponse(
+            ndjson_lines(items, fields, model=model),
+            media_type=NDJSON_MEDIA_TYPE,
+            headers=headers_of(response),
+        )
+    if model is not None:
+        items = conform(items, model)
+    if fields is not None:
+        items = pick(items, fields)
+    return FastJSONResponse(content=items, headers=headers_of(response))
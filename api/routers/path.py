@@ -1,6 +1,6 @@
 from api.routers.video import get_video
 from typing import List
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
 from botocore.exceptions import ClientError
 from aws_dynamodb_parser import parse
 
@@ -18,6 +18,7 @@ from api.dynamodb import (
     create_dynamodb_client,
 )
 from api.util import merge_paths_and_videos
+from api.concurrency import gather, set_server_timing
 import time
 
 router = APIRouter()
@@ -59,16 +60,16 @@ def get_path(path_id):
 # OK
 # 遅い？？->DynamoDBの性能の問題
 @router.get("/paths", response_model=List[Path])
-def get_paths():
+def get_paths(response: Response = None):
     """Get learning paths and video orders from DynamoDB"""
 
     start = time.time()
     print(inspect.currentframe().f_code.co_name)
 
     try:
-        paths = get_paths_db()
-        videos = get_paths_videos()
-        res = merge_paths_and_videos(paths, videos)
+        results, timings = gather(paths=get_paths_db, videos=get_paths_videos)
+        res = merge_paths_and_videos(results["paths"], results["videos"])
+        set_server_timing(response, timings)
 
         print("/path/path", time.time() - start)
         return res
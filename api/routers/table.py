@@ -1,6 +1,6 @@
 from typing import List
 from api.schema import VideoTableRow
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
 from botocore.exceptions import ClientError
 from requests import HTTPError
 from api.util import merge_table_for_video
@@ -13,9 +13,13 @@ from api.routers.category import get_categories
 # from api.routers.video import get_videos
 from api.routers.video import get_videos_muliprocess
 
+import asyncio
 import inspect
 import time
 
+from api.concurrency import gather_async, set_server_timing
+from api.response import fast_response, parse_mode
+
 router = APIRouter()
 
 #
@@ -26,21 +30,38 @@ router = APIRouter()
 # クライアント側で処理するので不要
 # 型定義は欲しいので残す
 @router.get("/table/videos", response_model=List[VideoTableRow])
-async def get_table_videos():
+async def get_table_videos(mode: str = None, response: Response = None):
     """Get videos merged VimeoAPI & DynamoDB for table"""
     start = time.time()
     print(inspect.currentframe().f_code.co_name)
     try:
-        # videos = get_videos(all=True)
-        videos = await get_videos_muliprocess(all=True)
-        categories = get_categories()
-        tags = get_tags()
-        paths = get_paths()
-        users = get_users()
-        table_data = merge_table_for_video(
-            videos=videos, categories=categories, tags=tags, paths=paths, users=users
+        mode = parse_mode(mode)
+        # Vimeoを待っている間にDynamoDBの読み込みを並列に進める
+        reads = asyncio.ensure_future(
+            gather_async(
+                categories=get_categories,
+                tags=get_tags,
+                paths=get_paths,
+                users=get_users,
+            )
         )
+        # videos = get_videos(all=True)
+        vimeo_start = time.perf_counter()
+        try:
+            videos = await get_videos_muliprocess(all=True)
+        except BaseException:
+            # 並列の読み込みを取り消して結果(例外)も受け取っておく（始まったスレッドは終わるまで動く）
+            reads.cancel()
+            await asyncio.gather(reads, return_exceptions=True)
+            raise
+        vimeo_elapsed = time.perf_counter() - vimeo_start
+        results, timings = await reads
+        table_data = merge_table_for_video(videos=videos, **results)
+        set_server_timing(response, {"videos": vimeo_elapsed, **timings})
         print(time.time() - start)
+        # 行はこちらで作ったものなので検証せずに返せる
+        if mode is not None:
+            return fast_response(table_data, mode, response)
         return table_data
 
     except HTTPError as err:
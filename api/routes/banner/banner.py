@@ -4,6 +4,7 @@ from botocore.exceptions import ClientError
 
 from api.util import document_it, timestamp_jst
 from api.client import DynamoDB
+from api.projection import parse_fields, select
 from .schema import Banner, ReqBannerPost, ReqBannerPut
 import api.routes.banner.input as banner_input
 
@@ -16,21 +17,19 @@ import shutil
 
 router = APIRouter()
 db = DynamoDB()
-table = db.table
-s3 = db.s3
 
 
 @router.get("/banners", response_model=List[Banner])
 @document_it
-def get_banners(active: bool = False):
+def get_banners(active: bool = False, fields: str = None):
     """Get banners from DynamoDB"""
 
     try:
-        input = banner_input.query(active)
-        res = table.query(**input)
-        items = res.get("Items", {})
+        names = parse_fields(fields, Banner)
+        input = db.project(banner_input.query(active), names)
+        items, _ = db.query(input)
         items = [{**item, **{"id": i}} for i, item in enumerate(items, 1)]
-        return items
+        return select(items, Banner, names)
 
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
@@ -47,7 +46,7 @@ def post_banner(req_banner: ReqBannerPost):
 
     try:
         input = banner_input.put_item(req_banner)
-        res = table.put_item(Item=input)
+        res = db.table.put_item(Item=input)
         return res
 
     except ClientError as err:
@@ -76,7 +75,7 @@ def post_banner_image(image: UploadFile = File(...)):
             output_filename = f"{name}_{timestamp}{suffix}"
 
             # upload
-            bucket = s3.Bucket("px-ad-img")
+            bucket = db.s3.Bucket("px-ad-img")
             bucket.upload_file(
                 Filename=str(input_filename),
                 Key=output_filename,
@@ -103,7 +102,7 @@ def put_banner(req_banner: ReqBannerPut):
 
     try:
         input = banner_input.update_item(req_banner)
-        res = table.update_item(**input)
+        res = db.table.update_item(**input)
         return res
 
     except ClientError as err:
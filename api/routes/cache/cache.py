@@ -0,0 +1,23 @@
+from fastapi import APIRouter
+
+from api.util import document_it
+from api.cache import catalog_cache
+from api.client import write_buffer
+
+router = APIRouter()
+
+
+@router.get("/cache/stats")
+@document_it
+def get_cache_stats():
+    """Get hit/miss counters of catalog cache (this process only)"""
+
+    return catalog_cache.stats()
+
+
+@router.get("/buffer/stats")
+@document_it
+def get_buffer_stats():
+    """Get write buffer counters and saved write units (this process only)"""
+
+    return write_buffer.stats()
@@ -1,28 +1,34 @@
 from typing import List
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from botocore.exceptions import ClientError
 
 from api.util import document_it
-from api.routes.video.video import get_videos
-from api.routes.video.schema import VideoFilter
+from api.adjacency import get_facet_videos, write_adjacency
 from api.client import DynamoDB
+from api.etag import catalog_etag, conditional
 from .schema import Category, ReqCategoryPost, ReqCategoryPut
 import api.routes.category.input as category_input
 
 router = APIRouter()
 db = DynamoDB()
-table = db.table
 
 
 @router.get("/categories", response_model=List[Category])
 @document_it
-def get_categories():
+def get_categories(request: Request = None, response: Response = None):
     """Get categories from DynamoDB"""
 
     try:
+        # キャッシュが有効ならDynamoDBを読まずに304を返す
+        etag = catalog_etag("Category")
+        if (not_modified := conditional(request, response, etag)) is not None:
+            return not_modified
         input = category_input.query()
-        res = table.query(**input)
-        items = res.get("Items", [])
+        items, _ = db.query(input, cache_key="Category")
+        if etag is None:
+            etag = catalog_etag("Category")
+            if (not_modified := conditional(request, response, etag)) is not None:
+                return not_modified
         items.sort(key=lambda x: x["SK"])
 
         items = db.merge_categories(items)
@@ -42,7 +48,8 @@ def post_category(req_category: ReqCategoryPost):
 
     try:
         input = category_input.put_item(req_category)
-        res = table.put_item(Item=input)
+        res = db.table.put_item(Item=input)
+        db.cache.invalidate("Category")
         return res
 
     except ClientError as err:
@@ -60,7 +67,8 @@ def put_category(req_category: ReqCategoryPut):
 
     try:
         input = category_input.update_item(req_category)
-        res = table.update_item(**input)
+        res = db.table.update_item(**input)
+        db.cache.invalidate("Category")
         return res
 
     except ClientError as err:
@@ -80,13 +88,16 @@ def delete_category(category_id):
     # 一応サーバ側でも判定する
 
     try:
-        filter = {"categoryId": category_id}
-        videos = get_videos(filter=VideoFilter(**filter), open=False)
-        if videos:
+        # 逆引き（カテゴリ -> 動画）から直接取得する
+        keys, videos = get_facet_videos(db, category_id, attribute="categoryId")
+        if any(video.get("categoryId", None) == category_id for video in videos):
             return {"relations": True}
 
         input = category_input.delete_item(category_id)
-        res = table.delete_item(**input)
+        res = db.table.delete_item(**input)
+        # 古い逆引きが残っていれば消しておく
+        write_adjacency(db.table, [], keys)
+        db.cache.invalidate("Category")
         return res
 
     except ClientError as err:
@@ -0,0 +1,42 @@
+from fastapi import APIRouter, HTTPException
+from botocore.exceptions import ClientError
+
+from api.util import document_it, get_today_string
+from api.client import DynamoDB
+from api.counter import METRICS, fill_series, get_count, query_series
+from .schema import CounterSeries
+
+router = APIRouter()
+db = DynamoDB()
+
+
+@router.get("/counters/{metric}", response_model=CounterSeries)
+@document_it
+def get_counter_series(
+    metric: str, start: str = None, end: str = None, hourly: bool = False
+):
+    """Get daily (hourly) counts of views, logins or uploads (default today)"""
+
+    try:
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        end = end or get_today_string()
+        start = start or end
+        if not hourly and start == end:
+            count = get_count(db.table, metric, start)
+            items = [{"period": start, "count": count}]
+        else:
+            rows, _ = db.query(query_series(metric, start, end, hourly))
+            items = fill_series(rows, start, end, hourly)
+        return {
+            "metric": metric,
+            "total": sum(item["count"] for item in items),
+            "items": items,
+        }
+
+    except ClientError as err:
+        err_message = err.response["Error"]["Message"]
+        raise HTTPException(status_code=404, detail=err_message)
+
+    except BaseException as err:
+        raise HTTPException(status_code=404, detail=str(err))
@@ -0,0 +1,17 @@
+from typing import List
+from pydantic import BaseModel
+
+
+class CounterPoint(BaseModel):
+    """count of a day (yyyy-mm-dd) or an hour (yyyy-mm-dd hh)"""
+
+    period: str
+    count: int = 0
+
+
+class CounterSeries(BaseModel):
+    """counter series response"""
+
+    metric: str
+    total: int = 0
+    items: List[CounterPoint] = []
@@ -3,25 +3,27 @@ from fastapi import APIRouter, HTTPException
 from botocore.exceptions import ClientError
 
 from api.util import document_it
-from api.client import DynamoDB
+from api.client import DynamoDB, VIDEO_DISPLAY_FIELDS
+from api.projection import parse_fields, select
 from .schema import Favorite, ReqFavorite
 import api.routes.favorite.input as favorite_input
 
 router = APIRouter()
 db = DynamoDB()
-table = db.table
 
 
 @router.get("/favorite/{user_id}", response_model=List[Favorite])
 @document_it
-def get_favorite(user_id):
-    """Get favorite videos for each user from DynamoDB"""
+def get_favorite(user_id, hydrate: bool = False, fields: str = None):
+    """Get favorite videos for each user from DynamoDB (hydrate: with video)"""
 
     try:
-        input = favorite_input.query(user_id)
-        res = table.query(**input)
-        items = res.get("Items", [])
-        return items
+        names = parse_fields(fields, Favorite)
+        input = db.project(favorite_input.query(user_id), names)
+        items, _ = db.query(input)
+        if hydrate:
+            db.hydrate(items, "SK", VIDEO_DISPLAY_FIELDS, to="video")
+        return select(items, Favorite, names)
 
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
@@ -38,7 +40,7 @@ def post_favorite(req_favorite: ReqFavorite):
 
     try:
         input = favorite_input.put_item(req_favorite)
-        res = table.put_item(Item=input)
+        res = db.table.put_item(Item=input)
         return res
 
     except ClientError as err:
@@ -56,7 +58,7 @@ def delete_favorite(req_favorite: ReqFavorite):
 
     try:
         input = favorite_input.delete_item(req_favorite)
-        res = table.delete_item(**input)
+        res = db.table.delete_item(**input)
         return res
 
     except ClientError as err:
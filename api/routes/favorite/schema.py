@@ -1,5 +1,7 @@
 from pydantic import BaseModel
 
+from api.routes.video.schema import VideoSummary
+
 
 class Favorite(BaseModel):
     """Favorite from dynamoDB"""
@@ -8,6 +10,7 @@ class Favorite(BaseModel):
     PK: str
     SK: str
     createdAt: str
+    video: VideoSummary = None
 
 
 class ReqFavorite(BaseModel):
@@ -1,28 +1,43 @@
 from typing import List
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
 from botocore.exceptions import ClientError
 
-from api.util import document_it
-from api.client import DynamoDB
+from api.util import document_it, get_today_string
+from api.client import DynamoDB, VIDEO_DISPLAY_FIELDS
+from api.projection import parse_fields, select
+from api.counter import get_count
 from .schema import UserHistory, ReqHistory
 import api.routes.history.input as history_input
 
 router = APIRouter()
 db = DynamoDB()
-table = db.table
 
 
 @router.get("/history/{user_id}", response_model=List[UserHistory])
 @document_it
-def get_history(user_id, limit: int = 30):
-    """Get histories for each user from DynamoDB (limit 30)"""
+def get_history(
+    user_id,
+    limit: int = 30,
+    start: str = None,
+    end: str = None,
+    hydrate: bool = False,
+    fields: str = None,
+):
+    """Get latest histories for each user (limit 30, hydrate: with video)"""
 
     try:
-        input = history_input.query_by_user(user_id, limit=limit)
-        res = table.query(**input)
-        items = res.get("Items", [])
-        items.sort(key=lambda x: x["createdAt"], reverse=True)
-        return items
+        # まだ書いていない履歴があれば先に書く
+        if db.buffer.has_pending(user_id):
+            db.buffer.flush()
+        names = parse_fields(fields, UserHistory)
+        input = history_input.query_by_user(user_id, limit=limit, start=start, end=end)
+        if names is not None:
+            # 動画を付けるときはvideoUriも読む
+            input = db.project(input, [*names, "videoUri"] if hydrate else names)
+        items, _ = db.query(input, limit=limit)
+        if hydrate:
+            db.hydrate(items, "videoUri", VIDEO_DISPLAY_FIELDS, to="video")
+        return select(items, UserHistory, names)
 
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
@@ -38,10 +53,7 @@ def get_histories():
     """Get histories today"""
 
     try:
-        input = history_input.query_all()
-        res = table.query(**input)
-        items = res.get("Items", [])
-        return {"count": len(items)}
+        return {"count": get_count(db.table, "views", get_today_string())}
 
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
@@ -53,13 +65,17 @@ def get_histories():
 
 @router.post("/history")
 @document_it
-def post_history(req_history: ReqHistory):
-    """Post history to DynamoDB"""
+def post_history(req_history: ReqHistory, response: Response = None):
+    """Post history to DynamoDB (202 when accepted before written)"""
 
     try:
         input = history_input.put_item(req_history)
-        res = table.put_item(Item=input)
-        return res
+        # 同じユーザーが同じ動画を続けて送ってきたら最後の1件だけ書く
+        key = ("History", req_history.user, req_history.video)
+        item, written = db.put_behind(input, key, metric="views")
+        if not written and response is not None:
+            response.status_code = 202
+        return {"accepted": True, "written": written, "SK": item["SK"]}
 
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
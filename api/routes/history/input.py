@@ -1,28 +1,26 @@
-from boto3.dynamodb.conditions import Key, Attr
-from api.util import get_today_string
+from boto3.dynamodb.conditions import Key
 from decimal import Decimal
-import uuid
 
+from api.timeid import id_ceil, id_floor, new_id
 
-def query_by_user(user_id, limit):
-    """input get histories for each user from DynamoDB"""
-
-    return dict(
-        KeyConditionExpression=Key("PK").eq(user_id),
-        FilterExpression=Attr("indexKey").eq("History"),
-        ScanIndexForward=False,
-        Limit=limit,
-    )
+HISTORY_PREFIX = "H-"
 
 
-def query_all():
-    """input get histories today"""
+def query_by_user(user_id, limit, start=None, end=None):
+    """input get latest histories for each user (in period) from DynamoDB"""
 
+    # SKは時刻順のIDなので、新しい順にキー条件だけで読める（Limitがそのまま件数になる）
+    if start or end:
+        sk = Key("SK").between(
+            HISTORY_PREFIX + (id_floor(start) if start else ""),
+            HISTORY_PREFIX + (id_ceil(end) if end else "~"),
+        )
+    else:
+        sk = Key("SK").begins_with(HISTORY_PREFIX)
     return dict(
-        IndexName="GSI-1-SK",
-        KeyConditionExpression=Key("indexKey").eq("History")
-        & Key("createdAt").begins_with(get_today_string()),
+        KeyConditionExpression=Key("PK").eq(user_id) & sk,
         ScanIndexForward=False,
+        Limit=limit,
     )
 
 
@@ -31,10 +29,14 @@ def put_item(history):
 
     # float-decimal問題が後々顕在化するかも。。
 
-    id = f"H-{str(uuid.uuid1())[:8]}"
+    # 視聴した時刻(createdAt)のIDにして、SKの順番と視聴順をそろえる
+    try:
+        id = new_id(history.createdAt)
+    except ValueError:
+        id = new_id()
     return dict(
         PK=history.user,
-        SK=id,
+        SK=f"{HISTORY_PREFIX}{id}",
         indexKey="History",
         createdAt=history.createdAt,
         videoUri=history.video,
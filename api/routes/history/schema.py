@@ -1,5 +1,7 @@
 from pydantic import BaseModel
 
+from api.routes.video.schema import VideoSummary
+
 
 class UserHistory(BaseModel):
     """History response body from dynamoDB"""
@@ -12,6 +14,7 @@ class UserHistory(BaseModel):
     parse: float = 0
     finishedAt: str = None
     referrer: str = None
+    video: VideoSummary = None
 
 
 class ReqHistory(BaseModel):
@@ -1,27 +1,28 @@
-from boto3.dynamodb.conditions import Key, Attr
-import uuid
+from boto3.dynamodb.conditions import Key
 
-from api.util import timestamp_jst
+from api.timeid import id_timestamp, new_id
+
+LIKE_PREFIX = "like-"
 
 
 def query(video_id):
     """input get likes for video from DynamoDB"""
 
     return dict(
-        KeyConditionExpression=Key("PK").eq(f"/videos/{video_id}"),
-        FilterExpression=Attr("indexKey").eq("Like"),
+        KeyConditionExpression=Key("PK").eq(f"/videos/{video_id}")
+        & Key("SK").begins_with(LIKE_PREFIX),
     )
 
 
 def put_item(like):
     """input post like for video to DynamoDB"""
 
-    id = f"like-{str(uuid.uuid1())[:8]}"
+    id = new_id()
     return dict(
         PK=like.video,
-        SK=id,
+        SK=f"{LIKE_PREFIX}{id}",
         indexKey="Like",
-        createdAt=timestamp_jst(),
+        createdAt=id_timestamp(id),
         createdUser=like.user,
         like=like.like,
     )
@@ -1,29 +1,47 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
 from botocore.exceptions import ClientError
 
 from api.util import document_it
-from api.client import DynamoDB
-from .schema import Likes, ReqLikePost, ReqLikeDelete
+from api.client import DynamoDB, USER_DISPLAY_FIELDS, VIDEO_DISPLAY_FIELDS
+from api.projection import parse_fields, partial_response, shape
+from .schema import Like, Likes, ReqLikePost, ReqLikeDelete
 import api.routes.like.input as like_input
 
 router = APIRouter()
 db = DynamoDB()
-table = db.table
 
 
 @router.get("/like/{video_id}", response_model=Likes)
 @document_it
-def get_likes(video_id):
-    """Get likes for video from DynamoDB"""
+def get_likes(video_id, hydrate: bool = False, fields: str = None):
+    """Get likes for video from DynamoDB (hydrate: with video & users)"""
 
     try:
+        names = parse_fields(fields, Like)
         input = like_input.query(video_id)
-        res = table.query(**input)
-        items = res.get("Items", [])
+        if names is not None:
+            # good/badに分けるlikeとユーザーを付けるcreatedUserは必ず読む
+            input = db.project(input, [*names, "like", "createdUser"])
+        if db.buffer.has_pending(f"/videos/{video_id}"):
+            db.buffer.flush()
+        items, _ = db.query(input)
 
         good = [item for item in items if item.get("like")]
         bad = [item for item in items if not item.get("like")]
-        return {"good": good, "bad": bad}
+        video = None
+        if hydrate:
+            # いいねは全て同じ動画なので、動画は1件、ユーザーはまとめて読む
+            db.hydrate(items, "createdUser", USER_DISPLAY_FIELDS, to="user")
+            video = db.hydrate(
+                [{"uri": f"/videos/{video_id}"}],
+                "uri",
+                VIDEO_DISPLAY_FIELDS,
+                to="video",
+            )[0]["video"]
+        if names is not None:
+            good, bad = shape(good, Like, names), shape(bad, Like, names)
+            return partial_response({"good": good, "bad": bad, "video": video})
+        return {"good": good, "bad": bad, "video": video}
 
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
@@ -35,13 +53,17 @@ def get_likes(video_id):
 
 @router.post("/like")
 @document_it
-def post_like(req_like: ReqLikePost):
-    """Post like for video to DynamoDB"""
+def post_like(req_like: ReqLikePost, response: Response = None):
+    """Post like for video to DynamoDB (202 when accepted before written)"""
 
     try:
         input = like_input.put_item(req_like)
-        res = table.put_item(Item=input)
-        return res
+        # いいねの押し直しは最後の1件だけ書く
+        key = ("Like", req_like.video, req_like.user)
+        item, written = db.put_behind(input, key)
+        if not written and response is not None:
+            response.status_code = 202
+        return {"accepted": True, "written": written, "SK": item["SK"]}
 
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
@@ -58,7 +80,9 @@ def delete_like(req_like: ReqLikeDelete):
 
     try:
         input = like_input.delete_item(req_like)
-        res = table.delete_item(**input)
+        # まだ書いていなければバッファから消すだけでよい
+        db.buffer.discard(req_like.video, req_like.id)
+        res = db.table.delete_item(**input)
         return res
 
     except ClientError as err:
@@ -1,6 +1,9 @@
 from typing import List
 from pydantic import BaseModel
 
+from api.routes.user.schema import UserSummary
+from api.routes.video.schema import VideoSummary
+
 
 class Like(BaseModel):
     """Like for video"""
@@ -11,6 +14,7 @@ class Like(BaseModel):
     createdAt: str
     createdUser: str
     like: bool
+    user: UserSummary = None
 
 
 class Likes(BaseModel):
@@ -18,6 +22,7 @@ class Likes(BaseModel):
 
     good: List[Like]
     bad: List[Like]
+    video: VideoSummary = None
 
 
 class ReqLikePost(BaseModel):
@@ -6,11 +6,11 @@ from boto3.dynamodb.conditions import Key, Attr
 
 from api.util import document_it
 from api.client import DynamoDB
+from api.rank import sort_orders
 from .schema import ReqOrder, Order
 
 router = APIRouter()
 db = DynamoDB()
-table = db.table
 
 
 @router.post("/order", response_model=Order)
@@ -20,7 +20,7 @@ def get_order(req_order: ReqOrder):
 
     try:
         input = dict(Key={"PK": req_order.PK, "SK": req_order.uri})
-        res = table.get_item(**input)
+        res = db.table.get_item(**input)
         item = res.get("Item", {})
         return item
 
@@ -42,10 +42,9 @@ def get_orders_contain_any_path(path_id):
             KeyConditionExpression=Key("PK").eq(path_id),
             FilterExpression=Attr("order").exists(),
         )
-        res = table.query(**input)
-        items = res.get("Items", [])
-        items.sort(key=lambda x: x["order"])
-        return items
+        items, _ = db.query(input)
+        # ランク順に並べてorderを振り直す
+        return sort_orders(items)
 
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
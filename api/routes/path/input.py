@@ -1,13 +1,14 @@
 from collections import defaultdict
 from boto3.dynamodb.conditions import Key, Attr
 
-from api.routes.order.order import get_order, get_orders_contain_any_path
-from api.routes.video.video import get_video_from_db, get_videos
-from api.routes.video.schema import VideoFilter
-from api.routes.order.schema import ReqOrder
+from api.adjacency import get_facet_videos
+from api.client import DynamoDB
+from api.rank import plan_ranks
 from api.util import timestamp_jst
 import uuid
 
+db = DynamoDB()
+
 
 def get_item(path_id):
     """input specified path from DynamoDB"""
@@ -15,6 +16,12 @@ def get_item(path_id):
     return dict(Key={"PK": path_id, "SK": path_id})
 
 
+def query_path(path_id):
+    """input learning path & its video orders (same partition)"""
+
+    return dict(KeyConditionExpression=Key("PK").eq(path_id))
+
+
 def query_paths():
     """input learning paths from DynamoDB"""
 
@@ -35,6 +42,20 @@ def query_videos():
     )
 
 
+def video_key(uri):
+    """key of video item from video uri"""
+
+    video_id = uri.split("/")[2]
+    uri = f"/videos/{video_id}"
+    return {"PK": uri, "SK": uri}
+
+
+def order_key(path_id, uri):
+    """key of video order item in learning path"""
+
+    return {"PK": path_id, "SK": uri}
+
+
 def put_item(path):
     """input post learning path to DynamoDB"""
 
@@ -59,6 +80,14 @@ def transact_update_path(path):
 
     # transact_write_itemsはclientAPIなので注意
 
+    # 追加・削除される動画と既存の再生順はBatchGetItemでまとめて取得する
+    keys = [video_key(uri) for uri in [*path.appended, *path.removed]]
+    keys += [order_key(path.PK, order.uri) for order in path.orders]
+    items = db.batch_get(keys)
+
+    def prefetched(key):
+        return items.get((key["PK"], key["SK"]), {})
+
     def update_path(path):
         """input put learning path to DynamoDB"""
 
@@ -93,18 +122,15 @@ def transact_update_path(path):
 
         def get_videos(appended):
             for uri in appended:
-                video_id = uri.split("/")[2]
-                video = get_video_from_db(video_id)
-                yield video
+                yield prefetched(video_key(uri))
 
         def generate_input(video, path_id, user):
-            path_ids = video.get("learningPathIds", [])
             # escape empty
-            # なぜか集合のケースがあるので明示的にリストにする
-            path_ids = list(path_ids)
-            if not path_ids[0]:
-                path_ids.remove("")
-            path_ids.append(path_id)
+            # 読んだアイテムを書き換えないようにコピーする（FAST_DESERIALIZE=offだと集合）
+            path_ids = [id for id in video.get("learningPathIds", []) if id]
+            # 再実行で追加済みの動画もあるので、同じIDは重ねない（SSに重複があるとエラー）
+            if path_id not in path_ids:
+                path_ids.append(path_id)
 
             input = dict(
                 TableName="primary_table",
@@ -128,9 +154,7 @@ def transact_update_path(path):
 
         def get_videos(removed):
             for uri in removed:
-                video_id = uri.split("/")[2]
-                video = get_video_from_db(video_id)
-                yield video
+                yield prefetched(video_key(uri))
 
         def generate_input(video, path_id, user):
             path_ids = video.get("learningPathIds", [])
@@ -159,43 +183,41 @@ def transact_update_path(path):
         return it_inputs
 
     def update_video_order(orders, path_id):
-        """input append or update video orders"""
-
-        def get_orders(orders, path_id):
-            for order in orders:
-                req_order = {"PK": path_id, "uri": order.uri}
-                current_order = get_order(req_order=ReqOrder(**req_order))
-                if current_order:
-                    yield True, order
-                else:
-                    yield False, order
-
-        def generate_input(order_with_update_or_append, path_id):
-            is_update, order = order_with_update_or_append
-            if is_update:
+        """input append or move video orders (only rows whose rank changes)"""
+
+        # 今のランクのまま新しい順序になる行は書き換えない
+        current = {
+            order.uri: prefetched(order_key(path_id, order.uri)).get("rank", None)
+            for order in orders
+        }
+        desired = [order.uri for order in sorted(orders, key=lambda o: o.order)]
+        changes = plan_ranks(current, desired)
+        positions = {uri: i for i, uri in enumerate(desired, 1)}
+
+        def generate_input(uri, rank):
+            if prefetched(order_key(path_id, uri)):
                 input = dict(
                     TableName="primary_table",
-                    Key={"PK": {"S": path_id}, "SK": {"S": order.uri}},
-                    UpdateExpression="SET #order=:order",
-                    # order is reserved
-                    ExpressionAttributeNames={"#order": "order"},
-                    ExpressionAttributeValues={":order": {"N": str(order.order)}},
+                    Key={"PK": {"S": path_id}, "SK": {"S": uri}},
+                    UpdateExpression="SET #rank=:rank",
+                    # 予約語に当たらないように別名にしておく
+                    ExpressionAttributeNames={"#rank": "rank"},
+                    ExpressionAttributeValues={":rank": {"S": rank}},
                 )
                 return {"Update": input}
             else:
                 input = dict(
                     PK={"S": path_id},
-                    SK={"S": order.uri},
+                    SK={"S": uri},
                     indexKey={"S": "Video"},
                     createdAt={"S": str(uuid.uuid1())[:8]},
-                    order={"N": str(order.order)},
+                    order={"N": str(positions[uri])},
+                    rank={"S": rank},
                 )
                 item = {"TableName": "primary_table", "Item": input}
                 return {"Put": item}
 
-        it_orders = get_orders(orders, path_id)
-        it_inputs = (generate_input(order, path_id) for order in it_orders)
-        return it_inputs
+        return (generate_input(uri, rank) for uri, rank in changes.items())
 
     def remove_video_order(removed, path_id):
         """input remove video orders"""
@@ -243,16 +265,16 @@ def transact_remove_path(path):
         )
         return {"Delete": input}
 
-    def remove_path_from_video(path_id, user):
+    def remove_path_from_video(path_id, videos, user):
         """remove path from video"""
 
-        filter = {"learningPathId": path_id}
-        videos = get_videos(filter=VideoFilter(**filter), open=False)
-
         new_videos = []
         for video in videos:
             path_ids = video.get("learningPathIds", [])
             path_ids = list(path_ids)
+            # 再生順だけ残っている場合は動画側に再生リストがない
+            if path_id not in path_ids:
+                continue
             path_ids.remove(path_id)
             # escape empty
             if len(path_ids) <= 0:
@@ -275,10 +297,9 @@ def transact_remove_path(path):
             new_videos.append({"Update": input})
         return new_videos
 
-    def remove_video_order(path_id):
+    def remove_video_order(orders):
         """remove video order"""
 
-        orders = get_orders_contain_any_path(path_id)
         remove_orders = []
         for order in orders:
             input = dict(
@@ -291,11 +312,15 @@ def transact_remove_path(path):
             remove_orders.append({"Delete": input})
         return remove_orders
 
+    # 再生リストの動画は再生順のアイテム（再生リスト -> 動画）から直接取得する
+    orders, videos = get_facet_videos(db, path.PK, attribute="learningPathIds")
+
+    # チャンクに分かれるので再生リスト本体は最後に削除する（途中で失敗しても再実行できる）
     transact_items = []
-    # delete path meta
-    transact_items.append(delete_path(path.PK))
     # update video meta
-    transact_items.extend(remove_path_from_video(path.PK, path.user))
+    transact_items.extend(remove_path_from_video(path.PK, videos, path.user))
     # remove video order
-    transact_items.extend(remove_video_order(path.PK))
+    transact_items.extend(remove_video_order(orders))
+    # delete path meta
+    transact_items.append(delete_path(path.PK))
     return transact_items
@@ -1,15 +1,18 @@
 from typing import List
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header, Request, Response
 from botocore.exceptions import ClientError
 
-from api.util import document_it
+from api.util import document_it, set_cursor
 from api.client import DynamoDB
+from api.concurrency import gather, set_server_timing
+from api.cache import content_stamp
+from api.etag import catalog_etag, conditional, etag_of, result_etag
+from api.response import fast_response, parse_mode
 from .schema import Path, ReqPathPost, ReqPathPutTransact, ReqPathDeleteTransact
 import api.routes.path.input as path_input
 
 router = APIRouter()
 db = DynamoDB()
-table = db.table
 
 
 @router.get("/path/{path_id}", response_model=Path)
@@ -18,11 +21,12 @@ def get_path(path_id):
     """Get specific learningPath from DynamoDB"""
 
     try:
-        input = path_input.get_item(path_id)
-        res = table.get_item(**input)
-        item = res.get("Item", {})
+        # 再生リスト本体と再生順は同じパーティションなので1回のQueryで取得する
+        input = path_input.query_path(path_id)
+        items, _ = db.query(input)
+        item = next((item for item in items if item["SK"] == path_id), {})
+        videos = [item for item in items if "order" in item]
 
-        videos = get_videos_contains_path()
         paths = db.merge_paths(paths=[item], videos=videos)
         path, *_ = paths
         return path
@@ -36,14 +40,24 @@ def get_path(path_id):
 
 @router.get("/paths", response_model=List[Path])
 @document_it
-def get_paths():
-    """Get learning paths and video orders from DynamoDB"""
+def get_paths(mode: str = None, request: Request = None, response: Response = None):
+    """Get learning paths and video orders (mode=fast|ndjson skips validation)"""
 
     try:
-        paths = get_paths_from_db()
-        videos = get_videos_contains_path()
-
-        res = db.merge_paths(paths, videos)
+        mode = parse_mode(mode)
+        # 再生リストと再生順は別々のQueryなので並列に読む
+        results, timings = gather(
+            paths=get_paths_from_db, videos=get_videos_contains_path
+        )
+        set_server_timing(response, timings)
+
+        res = db.merge_paths(results["paths"], results["videos"])
+        # 再生順の変更は再生リストのupdatedAtに出ないことがあるので内容から作る（帯域だけ減らす）
+        etag = etag_of(content_stamp(res), mode)
+        if (not_modified := conditional(request, response, etag)) is not None:
+            return not_modified
+        if mode is not None:
+            return fast_response(res, mode, response, model=Path)
         return res
 
     except ClientError as err:
@@ -56,13 +70,29 @@ def get_paths():
 
 @router.get("/paths/paths")
 @document_it
-def get_paths_from_db():
+def get_paths_from_db(
+    limit: int = None,
+    cursor: str = None,
+    request: Request = None,
+    response: Response = None,
+):
     """Get learning paths from DynamoDB"""
 
     try:
+        # 全件のときはキャッシュが有効ならDynamoDBを読まずに304を返す
+        whole = limit is None and cursor is None
+        etag = catalog_etag("LearningPath") if whole else None
+        if (not_modified := conditional(request, response, etag)) is not None:
+            return not_modified
         input = path_input.query_paths()
-        res = table.query(**input)
-        items = res.get("Items", [])
+        items, next_cursor = db.query(
+            input, limit=limit, cursor=cursor, cache_key="LearningPath"
+        )
+        if whole and etag is None:
+            etag = catalog_etag("LearningPath")
+            if (not_modified := conditional(request, response, etag)) is not None:
+                return not_modified
+        set_cursor(response, next_cursor)
         return items
 
     except ClientError as err:
@@ -75,14 +105,16 @@ def get_paths_from_db():
 
 @router.get("/paths/videos")
 @document_it
-def get_videos_contains_path():
+def get_videos_contains_path(request: Request = None, response: Response = None):
     """Get videos & playback orders included in learning paths"""
 
     try:
         input = path_input.query_videos()
-        res = table.query(**input)
-        items = res.get("Items", [])
+        items, _ = db.query(input)
         items.sort(key=lambda x: x["PK"])
+        etag = result_etag(items)
+        if (not_modified := conditional(request, response, etag)) is not None:
+            return not_modified
         return items
 
     except ClientError as err:
@@ -100,7 +132,8 @@ def post_path(req_path: ReqPathPost):
 
     try:
         input = path_input.put_item(path=req_path)
-        res = table.put_item(Item=input)
+        res = db.table.put_item(Item=input)
+        db.cache.invalidate("LearningPath")
         return res
 
     except ClientError as err:
@@ -113,15 +146,15 @@ def post_path(req_path: ReqPathPost):
 
 @router.put("/path")
 @document_it
-def put_path_to_db(req_path: ReqPathPutTransact):
+def put_path_to_db(req_path: ReqPathPutTransact, idempotency_key: str = Header(None)):
     """Put learning path to DynamoDB"""
 
     try:
         transact_items = path_input.transact_update_path(path=req_path)
         # return transact_items
-        res = db.client.transact_write_items(
-            ReturnConsumedCapacity="INDEXES", TransactItems=transact_items
-        )
+        res = db.transact_write(transact_items, token=idempotency_key)
+        # 動画の再生リストも変わるのでファセットを作り直す
+        db.cache.invalidate("LearningPath", "Video")
         return res
 
     except ClientError as err:
@@ -134,15 +167,15 @@ def put_path_to_db(req_path: ReqPathPutTransact):
 
 @router.delete("/path")
 @document_it
-def delete_path(req_path: ReqPathDeleteTransact):
+def delete_path(req_path: ReqPathDeleteTransact, idempotency_key: str = Header(None)):
     """Delete learning path and relations from DynamoDB"""
 
     try:
         transact_items = path_input.transact_remove_path(path=req_path)
         # return transact_items
-        res = db.client.transact_write_items(
-            ReturnConsumedCapacity="INDEXES", TransactItems=transact_items
-        )
+        res = db.transact_write(transact_items, token=idempotency_key)
+        # 動画の再生リストも変わるのでファセットを作り直す
+        db.cache.invalidate("LearningPath", "Video")
         return res
 
     except ClientError as err:
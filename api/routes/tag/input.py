@@ -1,10 +1,12 @@
 from collections import defaultdict
 from boto3.dynamodb.conditions import Key
-from api.routes.video.video import get_videos
-from api.routes.video.schema import VideoFilter
+from api.adjacency import get_facet_videos
+from api.client import DynamoDB
 from api.util import timestamp_jst
 import uuid
 
+db = DynamoDB()
+
 
 def query():
     """input get tags from DynamoDB"""
@@ -68,16 +70,16 @@ def transact_remove_tag(tag):
         )
         return {"Delete": input}
 
-    def remove_tag_from_video(tag_id, user):
+    def remove_tag_from_video(tag_id, videos, user):
         """input remove tag from video"""
 
-        filter = {"tagId": tag_id}
-        videos = get_videos(filter=VideoFilter(**filter), open=False)
-
         new_videos = []
         for video in videos:
             tag_ids = video.get("tagIds", [])
             tag_ids = list(tag_ids)
+            # 逆引きが古い場合は動画側にタグがない
+            if tag_id not in tag_ids:
+                continue
             tag_ids.remove(tag_id)
             # escape empty
             if len(tag_ids) <= 0:
@@ -97,7 +99,25 @@ def transact_remove_tag(tag):
             new_videos.append({"Update": input})
         return new_videos
 
+    def remove_adjacency(keys):
+        """input delete tag -> video adjacency items"""
+
+        return [
+            {
+                "Delete": dict(
+                    TableName="primary_table",
+                    Key={"PK": {"S": key["PK"]}, "SK": {"S": key["SK"]}},
+                )
+            }
+            for key in keys
+        ]
+
+    # タグが付いた動画は逆引き（タグ -> 動画）から直接取得する
+    keys, videos = get_facet_videos(db, tag.PK, attribute="tagIds")
+
+    # チャンクに分かれるのでタグ本体は最後に削除する（途中で失敗しても再実行できる）
     transact_items = []
+    transact_items.extend(remove_tag_from_video(tag.PK, videos, tag.user))
+    transact_items.extend(remove_adjacency(keys))
     transact_items.append(delete_item(tag.PK))
-    transact_items.extend(remove_tag_from_video(tag.PK, tag.user))
     return transact_items
@@ -1,29 +1,30 @@
 from typing import List
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header, Request, Response
 from botocore.exceptions import ClientError
 
-from api.util import document_it
+from api.util import document_it, set_cursor
 from api.client import DynamoDB
+from api.etag import catalog_etag, conditional
+from api.projection import parse_fields, select
 from .schema import Tag, ReqTagPost, ReqTagPut, ReqTagDelete
 import api.routes.tag.input as tag_input
 
-
 router = APIRouter()
 db = DynamoDB()
-table = db.table
 
 
 @router.get("/tag/{tag_id}", response_model=Tag)
 @document_it
-def get_tag(tag_id):
+def get_tag(tag_id, fields: str = None):
     """Get a specific tag from DynamoDB"""
 
     try:
-        input = dict(Key={"PK": tag_id, "SK": tag_id})
-        res = table.get_item(**input)
+        names = parse_fields(fields, Tag)
+        input = db.project(dict(Key={"PK": tag_id, "SK": tag_id}), names)
+        res = db.table.get_item(**input)
         item = res.get("Item", {})
         item = {**item, **{"id": 1}}
-        return item
+        return select(item, Tag, names)
 
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
@@ -35,16 +36,34 @@ def get_tag(tag_id):
 
 @router.get("/tags", response_model=List[Tag])
 @document_it
-def get_tags():
-    """Get tags from DynamoDB"""
+def get_tags(
+    limit: int = None,
+    cursor: str = None,
+    fields: str = None,
+    request: Request = None,
+    response: Response = None,
+):
+    """Get tags from DynamoDB (fields: only response is shaped, items are cached)"""
 
     try:
+        names = parse_fields(fields, Tag)
+        # 全件のときはキャッシュが有効ならDynamoDBを読まずに304を返す
+        whole = limit is None and cursor is None
+        etag = catalog_etag("Tag", names) if whole else None
+        if (not_modified := conditional(request, response, etag)) is not None:
+            return not_modified
         input = tag_input.query()
-        res = table.query(**input)
-        items = res.get("Items", [])
+        items, next_cursor = db.query(
+            input, limit=limit, cursor=cursor, cache_key="Tag"
+        )
+        if whole and etag is None:
+            etag = catalog_etag("Tag", names)
+            if (not_modified := conditional(request, response, etag)) is not None:
+                return not_modified
+        set_cursor(response, next_cursor)
         # append index
         items = [{**item, **{"id": i}} for i, item in enumerate(items, 1)]
-        return items
+        return select(items, Tag, names, response)
 
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
@@ -68,7 +87,8 @@ def post_tag(req_tag: ReqTagPost):
             return {"duplicate": True}
 
         input = tag_input.put_item(tag=req_tag)
-        res = table.put_item(Item=input)
+        res = db.table.put_item(Item=input)
+        db.cache.invalidate("Tag")
         return res
 
     except ClientError as err:
@@ -86,7 +106,8 @@ def put_tag(req_tag: ReqTagPut):
 
     try:
         input = tag_input.update_item(tag=req_tag)
-        res = table.update_item(**input)
+        res = db.table.update_item(**input)
+        db.cache.invalidate("Tag")
         return res
 
     except ClientError as err:
@@ -99,15 +120,15 @@ def put_tag(req_tag: ReqTagPut):
 
 @router.delete("/tag")
 @document_it
-def delete_tag(req_tag: ReqTagDelete):
+def delete_tag(req_tag: ReqTagDelete, idempotency_key: str = Header(None)):
     """Delete tag from DynamoDB"""
 
     try:
         transact_items = tag_input.transact_remove_tag(tag=req_tag)
         # return transact_items
-        res = db.client.transact_write_items(
-            ReturnConsumedCapacity="INDEXES", TransactItems=transact_items
-        )
+        res = db.transact_write(transact_items, token=idempotency_key)
+        # 動画のタグも変わるのでファセットを作り直す
+        db.cache.invalidate("Tag", "Video")
         return res
 
     except ClientError as err:
@@ -1,34 +1,85 @@
 from boto3.dynamodb.conditions import Attr, Key
+from api.timeid import id_ceil, id_floor, id_timestamp, is_time_id, new_id
 from api.util import timestamp_jst
 
+# SK: thread-<親スレッドのID>_<投稿のID>（返信は親スレッドの直後に並ぶ）
+THREAD_PREFIX = "thread-"
+
 
 def query(video_id):
     """input get threads for video from DynamoDB"""
 
     return dict(
-        KeyConditionExpression=Key("PK").eq(f"/videos/{video_id}"),
+        KeyConditionExpression=Key("PK").eq(f"/videos/{video_id}")
+        & Key("SK").begins_with(THREAD_PREFIX),
+        FilterExpression=Attr("invalid").eq(False),
+    )
+
+
+# 以前のSKは<親スレッドの日時>_<投稿の日時>（maintenance.py migrate-time-idsで書き換えるまで残る）
+def query_legacy(video_id):
+    """input get threads with date SK (not migrated yet) for video from DynamoDB"""
+
+    return dict(
+        KeyConditionExpression=Key("PK").eq(f"/videos/{video_id}")
+        & Key("SK").between("0", "9~"),
         FilterExpression=Attr("indexKey").eq("Thread") & Attr("invalid").eq(False),
     )
 
 
-def put_item(thread):
+def root_of(thread_id):
+    """Return ID of parent thread from SK (or ID) of thread"""
+
+    if thread_id.startswith(THREAD_PREFIX):
+        thread_id = thread_id[len(THREAD_PREFIX) :]
+    return thread_id.split("_")[0]
+
+
+def query_root(video, timestamp):
+    """input find parent thread posted at timestamp (old clients send the date)"""
+
+    return dict(
+        KeyConditionExpression=Key("PK").eq(video)
+        & Key("SK").between(
+            f"{THREAD_PREFIX}{id_floor(timestamp)}",
+            f"{THREAD_PREFIX}{id_ceil(timestamp)}~",
+        ),
+        ProjectionExpression="SK",
+        Limit=1,
+    )
+
+
+def put_item(thread, root=None):
     """input post thread for video to DynamoDB"""
 
-    # 親スレッドがあれば日付をつけてPKにする
-    if thread.thread:
-        # replay
-        thread_post = f"{thread.thread}_{timestamp_jst()}"
-        created_at = thread.thread
-    else:
+    id = new_id()
+    if root is None:
         # new thread
-        thread_post = f"{timestamp_jst()}_{timestamp_jst()}"
-        created_at = timestamp_jst()
+        root = id
+    if not is_time_id(root):
+        raise ValueError(f"Invalid parent thread: {thread.thread}")
+
+    return dict(
+        PK=thread.video,
+        SK=f"{THREAD_PREFIX}{root}_{id}",
+        indexKey="Thread",
+        # 返信は親スレッドの日時（今までと同じ）
+        createdAt=id_timestamp(root),
+        createdUser=thread.user,
+        body=thread.body,
+        invalid=False,
+    )
+
+
+def put_legacy_item(thread):
+    """input post reply to thread with date SK (not migrated yet) to DynamoDB"""
 
+    root = root_of(thread.thread)
     return dict(
         PK=thread.video,
-        SK=thread_post,
+        SK=f"{root}_{timestamp_jst()}",
         indexKey="Thread",
-        createdAt=created_at,
+        createdAt=root,
         createdUser=thread.user,
         body=thread.body,
         invalid=False,
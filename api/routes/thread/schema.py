@@ -18,7 +18,7 @@ class ReqThreadPost(BaseModel):
     video: str
     user: str
     body: str
-    thread: str = None  # 親スレッドのdate
+    thread: str = None  # 親スレッドのSK（IDか、以前のように日時でもよい）
 
 
 class ReqThreadPut(BaseModel):
@@ -4,25 +4,28 @@ from botocore.exceptions import ClientError
 
 from api.util import document_it
 from api.client import DynamoDB
+from api.projection import parse_fields, select
+from api.timeid import is_time_id
 from .schema import Thread, ReqThreadPost, ReqThreadPut
 import api.routes.thread.input as thread_input
 
 router = APIRouter()
 db = DynamoDB()
-table = db.table
 
 
 @router.get("/thread/{video_id}", response_model=List[Thread])
 @document_it
-def get_thread(video_id):
+def get_thread(video_id, fields: str = None):
     """Get threads for video from DynamoDB"""
 
     try:
-        input = thread_input.query(video_id)
-        res = table.query(**input)
-        items = res.get("Items", [])
+        names = parse_fields(fields, Thread)
+        # 移行前の日時のSKのスレッドも読む（日時のSKの方が古いので先に並べる）
+        legacy, _ = db.query(db.project(thread_input.query_legacy(video_id), names))
+        items, _ = db.query(db.project(thread_input.query(video_id), names))
+        items = legacy + items
         # items.sort(key=lambda x: x["createdAt"], reverse=True)
-        return items
+        return select(items, Thread, names)
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
         raise HTTPException(status_code=404, detail=err_message)
@@ -37,8 +40,23 @@ def post_thread(req_thread: ReqThreadPost):
     """Post thread for video to DynamoDB"""
 
     try:
-        input = thread_input.put_item(req_thread)
-        res = table.put_item(Item=input)
+        root = None
+        if req_thread.thread:
+            root = thread_input.root_of(req_thread.thread)
+            if not is_time_id(root):
+                # 親スレッドの日時から、その秒に投稿された親スレッドを探す
+                input = thread_input.query_root(req_thread.video, req_thread.thread)
+                items, _ = db.query(input, limit=1)
+                if items:
+                    root = thread_input.root_of(items[0]["SK"])
+                else:
+                    # 移行前の親スレッドには、以前と同じ日時のSKで返信する
+                    root = None
+        if req_thread.thread and root is None:
+            input = thread_input.put_legacy_item(req_thread)
+        else:
+            input = thread_input.put_item(req_thread, root)
+        res = db.table.put_item(Item=input)
         return res
 
     except ClientError as err:
@@ -56,7 +74,7 @@ def put_thread(req_thread: ReqThreadPut):
 
     try:
         input = thread_input.update_item(req_thread)
-        res = table.update_item(**input)
+        res = db.table.update_item(**input)
         return res
 
     except ClientError as err:
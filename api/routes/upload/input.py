@@ -1,42 +1,61 @@
-from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.conditions import Key
+from api.timeid import id_ceil, id_floor, id_timestamp, new_id
 from api.util import get_today_string
 
+STATUS_PREFIX = "status-"
+
 
 def query():
     """input get upload status from DynamoDB"""
 
     return dict(
         IndexName="GSI-1-SK",
-        KeyConditionExpression=Key("indexKey").eq("Status"),
-        # FilterExpression=Attr("SK").begins_with("2021-12-16"),
-        FilterExpression=Attr("SK").begins_with(get_today_string()),
+        # createdAt(=SK)はGSIのソートキーなので、今日の分だけをキー条件で読む
+        KeyConditionExpression=Key("indexKey").eq("Status")
+        & Key("createdAt").begins_with(get_today_string()),
         ScanIndexForward=False,
     )
 
 
-def put_item(status, created_at):
+def put_item(status):
     """input post upload status to DynamoDB"""
 
     # なんでidがuriなのか。。
 
+    id = new_id()
     return dict(
         id=status.uri,
         PK=status.uri,
-        SK=created_at,
+        SK=f"{STATUS_PREFIX}{id}",
         indexKey="Status",
         name=status.name,
         filename=status.filename,
-        createdAt=created_at,
+        createdAt=id_timestamp(id),
         createdUser=status.user,
         status=status.status,
     )
 
 
-def update_item(status):
+def query_by_timestamp(status):
+    """input find upload status posted at timestamp (old clients send only it)"""
+
+    return dict(
+        KeyConditionExpression=Key("PK").eq(status.uri)
+        & Key("SK").between(
+            f"{STATUS_PREFIX}{id_floor(status.timestamp)}",
+            f"{STATUS_PREFIX}{id_ceil(status.timestamp)}",
+        ),
+        ProjectionExpression="SK",
+        ScanIndexForward=False,
+        Limit=1,
+    )
+
+
+def update_item(status, sk):
     """input put upload status to DynamoDB"""
 
     return dict(
-        Key={"PK": status.uri, "SK": status.timestamp},
+        Key={"PK": status.uri, "SK": sk},
         UpdateExpression="SET #status=:status",
         # status is reserved
         ExpressionAttributeNames={"#status": "status"},
@@ -21,6 +21,7 @@ class ResUploadStatus(BaseModel):
     uri: str
     timestamp: str
     status: str
+    id: str = None  # SK（ないときはtimestampから探す）
 
 
 class ReqUploadStatusPost(BaseModel):
@@ -1,28 +1,35 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
 from botocore.exceptions import ClientError
 from typing import List
 
-from api.util import document_it, timestamp_jst
+from api.util import document_it, set_cursor
 from api.client import DynamoDB
+from api.counter import increment
+from api.projection import parse_fields, select
 from .schema import UploadStatus, ReqUploadStatusPost, ResUploadStatus
 import api.routes.upload.input as upload_input
 
 router = APIRouter()
 db = DynamoDB()
-table = db.table
 
 
 @router.get("/upload/status", response_model=List[UploadStatus])
 @document_it
-def get_upload_status():
+def get_upload_status(
+    limit: int = None,
+    cursor: str = None,
+    fields: str = None,
+    response: Response = None,
+):
     """Get upload status from DynamoDB (today only)"""
 
     try:
-        input = upload_input.query()
-        res = table.query(**input)
-        items = res.get("Items", {})
+        names = parse_fields(fields, UploadStatus)
+        input = db.project(upload_input.query(), names)
+        items, next_cursor = db.query(input, limit=limit, cursor=cursor)
+        set_cursor(response, next_cursor)
         items = [{**item, **{"id": item["PK"]}} for i, item in enumerate(items, 1)]
-        return items
+        return select(items, UploadStatus, names, response)
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
         raise HTTPException(status_code=404, detail=err_message)
@@ -36,14 +43,15 @@ def get_upload_status():
 def post_upload_status(req_status: ReqUploadStatusPost):
     """Post upload status to DynamoDB"""
 
-    created_at = timestamp_jst()
     try:
-        input = upload_input.put_item(req_status, created_at)
-        table.put_item(Item=input)
+        input = upload_input.put_item(req_status)
+        db.table.put_item(Item=input)
+        increment(db.table, "uploads", input["createdAt"])
         return {
             "uri": req_status.uri,
-            "timestamp": created_at,
+            "timestamp": input["createdAt"],
             "status": req_status.status,
+            "id": input["SK"],
         }
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
@@ -59,12 +67,19 @@ def put_upload_status(req_status: ResUploadStatus):
     """Put upload status to DynamoDB"""
 
     try:
-        input = upload_input.update_item(req_status)
-        table.update_item(**input)
+        sk = req_status.id
+        if sk is None:
+            # 移行前のアイテムはSKが作成日時のまま
+            input = upload_input.query_by_timestamp(req_status)
+            items, _ = db.query(input, limit=1)
+            sk = items[0]["SK"] if items else req_status.timestamp
+        input = upload_input.update_item(req_status, sk)
+        db.table.update_item(**input)
         return {
             "uri": req_status.uri,
             "timestamp": req_status.timestamp,
             "status": req_status.status,
+            "id": sk,
         }
 
     except ClientError as err:
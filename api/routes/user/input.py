@@ -1,16 +1,19 @@
 from collections import defaultdict
 from boto3.dynamodb.conditions import Key
-from api.util import get_today_string, timestamp_jst
+from api.util import timestamp_jst
 
+# 一覧(キャッシュ)に出す項目、これが変わったときだけキャッシュを捨てる
+# createdAtはログインのたびに変わるので、一覧ではキャッシュのTTLまで古いままになる
+CATALOG_FIELDS = ("name", "image", "acl")
 
-def login_count():
-    """input get login users count today"""
 
-    return dict(
-        IndexName="GSI-1-SK",
-        KeyConditionExpression=Key("indexKey").eq("User")
-        & Key("createdAt").begins_with(get_today_string()),
-        ScanIndexForward=False,
+def catalog_changed(old, new):
+    """Whether catalog fields changed (old is None for new user)"""
+
+    if old is None:
+        return True
+    return any(
+        name in new and old.get(name, None) != new[name] for name in CATALOG_FIELDS
     )
 
 
@@ -15,6 +15,13 @@ class User(BaseModel):
     acl: str = "user"
 
 
+class UserSummary(BaseModel):
+    """display fields of user (hydrate=true)"""
+
+    name: str = ""
+    image: str = ""
+
+
 class ReqUser(BaseModel):
     """Post & Put user request body"""
 
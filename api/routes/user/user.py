@@ -1,15 +1,17 @@
 from typing import List
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from botocore.exceptions import ClientError
 
-from api.util import document_it
+from api.util import document_it, get_today_string, set_cursor
 from api.client import DynamoDB
+from api.counter import get_count, increment
+from api.etag import catalog_etag, conditional
+from api.projection import parse_fields, select
 from .schema import User, ReqUser
 import api.routes.user.input as user_input
 
 router = APIRouter()
 db = DynamoDB()
-table = db.table
 
 
 @router.get("/users/login")
@@ -18,10 +20,7 @@ def get_user_count():
     """Get login users count today"""
 
     try:
-        input = user_input.login_count()
-        res = table.query(**input)
-        items = res.get("Items", [])
-        return {"count": len(items)}
+        return {"count": get_count(db.table, "logins", get_today_string())}
 
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
@@ -33,14 +32,15 @@ def get_user_count():
 
 @router.get("/user/{user_id}", response_model=User)
 @document_it
-def get_user(user_id):
+def get_user(user_id, fields: str = None):
     """Get user from DynamoDB"""
 
     try:
-        input = user_input.get_item(user_id)
-        res = table.get_item(**input)
+        names = parse_fields(fields, User)
+        input = db.project(user_input.get_item(user_id), names)
+        res = db.table.get_item(**input)
         item = res.get("Item", {})
-        return item
+        return select(item, User, names)
 
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
@@ -52,16 +52,34 @@ def get_user(user_id):
 
 @router.get("/users", response_model=List[User])
 @document_it
-def get_users():
-    """Get users from DynamoDB"""
+def get_users(
+    limit: int = None,
+    cursor: str = None,
+    fields: str = None,
+    request: Request = None,
+    response: Response = None,
+):
+    """Get users from DynamoDB (fields: only response is shaped, items are cached)"""
 
     try:
+        names = parse_fields(fields, User)
+        # 全件のときはキャッシュが有効ならDynamoDBを読まずに304を返す
+        whole = limit is None and cursor is None
+        etag = catalog_etag("User", names) if whole else None
+        if (not_modified := conditional(request, response, etag)) is not None:
+            return not_modified
         input = user_input.query()
-        res = table.query(**input)
-        items = res.get("Items", {})
+        items, next_cursor = db.query(
+            input, limit=limit, cursor=cursor, cache_key="User"
+        )
+        if whole and etag is None:
+            etag = catalog_etag("User", names)
+            if (not_modified := conditional(request, response, etag)) is not None:
+                return not_modified
+        set_cursor(response, next_cursor)
         # append index
         items = [{**item, **{"id": i}} for i, item in enumerate(items, 1)]
-        return items
+        return select(items, User, names, response)
 
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
@@ -78,7 +96,10 @@ def post_user(req_user: ReqUser):
 
     try:
         input = user_input.put_item(user=req_user)
-        res = table.put_item(Item=input)
+        res = db.table.put_item(Item=input, ReturnValues="ALL_OLD")
+        if user_input.catalog_changed(res.pop("Attributes", None), input):
+            db.cache.invalidate("User")
+        increment(db.table, "logins", input["createdAt"], member=req_user.PK)
         return res
 
     except ClientError as err:
@@ -91,12 +112,31 @@ def post_user(req_user: ReqUser):
 
 @router.put("/user")
 @document_it
-def put_user(req_user: ReqUser):
-    """Put user to DynamoDB"""
+def put_user(req_user: ReqUser, login: bool = None):
+    """Put user to DynamoDB (login: count as login, default: without acl)"""
 
     try:
         input = user_input.update_item(user=req_user)
-        res = table.update_item(**input)
+        res = db.table.update_item(**input, ReturnValues="UPDATED_OLD")
+        # 新しいユーザーなら前の値はない（createdAtは必ず前の値がある）
+        old = res.pop("Attributes", None)
+        new = {
+            name: input["ExpressionAttributeValues"][f":{name}"]
+            for name in user_input.CATALOG_FIELDS
+            if f":{name}" in input["ExpressionAttributeValues"]
+        }
+        if user_input.catalog_changed(old, new):
+            db.cache.invalidate("User")
+        # ログインのときだけ数える（管理画面での編集は権限(acl)を送るのでログインではない）
+        if login is None:
+            login = req_user.acl is None
+        if login:
+            increment(
+                db.table,
+                "logins",
+                input["ExpressionAttributeValues"][":date"],
+                member=req_user.PK,
+            )
         return res
 
     except ClientError as err:
@@ -36,6 +36,54 @@ def query(filter, open):
     return input
 
 
+def key_facet(filter):
+    """Return facet ID to query by key condition (None if no facet)"""
+
+    # 絞り込みが強い順（再生リスト > タグ > カテゴリ）
+    return filter.learningPathId or filter.tagId or filter.categoryId or None
+
+
+def key_facet_attribute(filter):
+    """Return video attribute of key_facet() (GSI fallback before backfill)"""
+
+    if filter.learningPathId:
+        return "learningPathIds"
+    if filter.tagId:
+        return "tagIds"
+    if filter.categoryId:
+        return "categoryId"
+    return None
+
+
+# match()と並び替えに使う項目（fields指定でも読む）
+MATCH_FIELDS = [
+    "invalid",
+    "categoryId",
+    "tagIds",
+    "learningPathIds",
+    "name",
+    "createdAt",
+]
+
+
+def match(video, filter, open):
+    """Filter video in python same as FilterExpression of query()"""
+
+    if "invalid" not in video or (open and video["invalid"]):
+        return False
+    if filter.categoryId and filter.categoryId not in video.get("categoryId", ""):
+        return False
+    if filter.tagId and filter.tagId not in (video.get("tagIds", None) or []):
+        return False
+    if filter.learningPathId and filter.learningPathId not in (
+        video.get("learningPathIds", None) or []
+    ):
+        return False
+    if filter.name and filter.name not in video.get("name", ""):
+        return False
+    return True
+
+
 def put_item(video):
     """input post video to DynamoDB"""
 
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List
 from pydantic import BaseModel
 
 
@@ -32,6 +32,17 @@ class VideoDB(VideoVimeo):
     match: bool = True
 
 
+class VideoSummary(BaseModel):
+    """display fields of video (hydrate=true)"""
+
+    uri: str = ""
+    name: str = ""
+    thumbnail: str = ""
+    duration: int = 0
+    plays: int = 0
+    invalid: bool = False
+
+
 class VideoFilter(BaseModel):
     """video search request body from DynamoDB"""
 
@@ -41,6 +52,36 @@ class VideoFilter(BaseModel):
     name: str = ""
 
 
+class FacetFilter(BaseModel):
+    """facet search request body (OR in a facet, AND across facets)"""
+
+    categoryIds: List[str] = []
+    tagIds: List[str] = []
+    learningPathIds: List[str] = []
+    name: str = ""
+
+
+class FacetResult(BaseModel):
+    """facet search response with counts of each facet value"""
+
+    total: int = 0
+    items: List[VideoDB] = []
+    counts: Dict[str, Dict[str, int]] = {}
+
+
+class SearchHit(VideoDB):
+    """video of full-text search with BM25 score"""
+
+    score: float = 0.0
+
+
+class SearchResult(BaseModel):
+    """full-text search response"""
+
+    total: int = 0
+    items: List[SearchHit] = []
+
+
 class ReqVideoPost(BaseModel):
     """post video request body to DynamoDB"""
 
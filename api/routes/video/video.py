@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, HTTPException, UploadFile, File, Response
+from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
 from requests import HTTPError
 from typing import List
@@ -9,17 +10,26 @@ import shutil
 import glob
 import os
 
-import math
-import asyncio
-import concurrent.futures
-from functools import reduce
-
-from api.util import document_it
-from api.client import DynamoDB, VimeoAPI
+from api.util import document_it, set_cursor
+from api.adjacency import (
+    diff_adjacency,
+    facet_ids,
+    get_facet_videos,
+    write_adjacency,
+)
+from api.client import DynamoDB, VimeoAPI, decode_cursor, encode_cursor, paginate
+from api.facets import facet_index
+from api.projection import parse_fields, partial_response, select, shape
+from api.response import fast_response, parse_mode
+from api.search import search_index
 from .schema import (
+    FacetFilter,
+    FacetResult,
     ReqVideoPost,
     ReqVideoPut,
     ReqVimeoPut,
+    SearchHit,
+    SearchResult,
     VideoDB,
     VideoFilter,
     VideoVimeo,
@@ -28,20 +38,20 @@ import api.routes.video.input as video_input
 
 router = APIRouter()
 db = DynamoDB()
-table = db.table
 vimeo = VimeoAPI()
 
 
 @router.get("/video/{video_id}", response_model=VideoDB)
 @document_it
-def get_video_from_db(video_id):
-    """Get a specific video from DynamoDB"""
+def get_video_from_db(video_id, fields: str = None):
+    """Get a specific video from DynamoDB (fields: comma separated)"""
 
     try:
-        input = video_input.get_item(video_id)
-        res = table.get_item(**input)
+        names = parse_fields(fields, VideoDB)
+        input = db.project(video_input.get_item(video_id), names)
+        res = db.table.get_item(**input)
         item = res.get("Item", {})
-        return item
+        return select(item, VideoDB, names)
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
         raise HTTPException(status_code=404, detail=err_message)
@@ -73,14 +83,103 @@ def get_video_from_vimeo(video_id):
 
 @router.post("/videos", response_model=List[VideoDB])
 @document_it
-def get_videos(filter: VideoFilter, open: bool = True):
-    """Get videos from DynamoDB filtered by tags, categories, playlist, title"""
+def get_videos(
+    filter: VideoFilter,
+    open: bool = True,
+    limit: int = None,
+    cursor: str = None,
+    fields: str = None,
+    mode: str = None,
+    response: Response = None,
+):
+    """Get videos from DynamoDB filtered by tags, categories, playlist, title
+
+    mode=fast|ndjson returns items without validation (large lists).
+    """
+
+    try:
+        names = parse_fields(fields, VideoDB)
+        mode = parse_mode(mode)
+        if video_input.key_facet(filter):
+            items, next_cursor = get_videos_by_facet(
+                filter, open, limit, cursor, fields=names
+            )
+        else:
+            input = db.project(video_input.query(filter, open), names)
+            items, next_cursor = db.query(input, limit=limit, cursor=cursor)
+        set_cursor(response, next_cursor)
+        if mode is not None:
+            return fast_response(items, mode, response, fields=names, model=VideoDB)
+        return select(items, VideoDB, names, response)
+
+    except ClientError as err:
+        err_message = err.response["Error"]["Message"]
+        raise HTTPException(status_code=404, detail=err_message)
+
+    except BaseException as err:
+        raise HTTPException(status_code=404, detail=str(err))
+
+
+@router.post("/videos/facets", response_model=FacetResult)
+@document_it
+def search_videos_by_facets(
+    filter: FacetFilter,
+    open: bool = True,
+    limit: int = None,
+    cursor: str = None,
+    fields: str = None,
+    response: Response = None,
+):
+    """Search videos by multiple facets in memory with counts of each facet"""
+
+    try:
+        # インデックスはプロセス内で持ち回り、期限切れ・invalidateで読み直す
+        index = facet_index.ensure(load_videos)
+        offset = (decode_cursor(cursor) or {}).get("offset", 0)
+        filters = filter.dict(exclude={"name"})
+        items, total, counts = index.search(
+            filters, open=open, name=filter.name, offset=offset, limit=limit
+        )
+        if limit is not None and offset + limit < total:
+            set_cursor(response, encode_cursor({"offset": offset + limit}))
+        # メモリ上のインデックスなので読み込みは変わらない、レスポンスだけ小さくする
+        names = parse_fields(fields, VideoDB)
+        if names is not None:
+            result = {"total": total, "items": shape(items, VideoDB, names)}
+            return partial_response({**result, "counts": counts}, response)
+        return {"total": total, "items": items, "counts": counts}
+
+    except ClientError as err:
+        err_message = err.response["Error"]["Message"]
+        raise HTTPException(status_code=404, detail=err_message)
+
+    except BaseException as err:
+        raise HTTPException(status_code=404, detail=str(err))
+
+
+@router.get("/videos/search", response_model=SearchResult)
+@document_it
+def search_videos(
+    q: str,
+    open: bool = True,
+    limit: int = None,
+    cursor: str = None,
+    fields: str = None,
+    response: Response = None,
+):
+    """Search videos by title, description & tag names (ranked by BM25)"""
 
     try:
-        input = video_input.query(filter, open)
-        res = table.query(**input)
-        items = res.get("Items", [])
-        return items
+        index = search_index.ensure(load_search_documents)
+        offset = (decode_cursor(cursor) or {}).get("offset", 0)
+        items, total = index.search(q, open=open, offset=offset, limit=limit)
+        if limit is not None and offset + limit < total:
+            set_cursor(response, encode_cursor({"offset": offset + limit}))
+        names = parse_fields(fields, SearchHit)
+        if names is not None:
+            items = shape(items, SearchHit, names)
+            return partial_response({"total": total, "items": items}, response)
+        return {"total": total, "items": items}
 
     except ClientError as err:
         err_message = err.response["Error"]["Message"]
@@ -90,6 +189,58 @@ def get_videos(filter: VideoFilter, open: bool = True):
         raise HTTPException(status_code=404, detail=str(err))
 
 
+@router.get("/videos/suggest", response_model=List[str])
+@document_it
+def suggest_videos(q: str, limit: int = 10):
+    """Suggest video titles & tag names starting with q"""
+
+    try:
+        return search_index.ensure(load_search_documents).suggest(q, limit)
+
+    except ClientError as err:
+        err_message = err.response["Error"]["Message"]
+        raise HTTPException(status_code=404, detail=err_message)
+
+    except BaseException as err:
+        raise HTTPException(status_code=404, detail=str(err))
+
+
+def load_search_documents():
+    """Get all videos & tags for search index"""
+
+    tags, _ = db.query(
+        dict(IndexName="GSI-1-SK", KeyConditionExpression=Key("indexKey").eq("Tag")),
+        cache_key="Tag",
+    )
+    return load_videos(), tags
+
+
+def load_videos():
+    """Get all videos (open & closed) from DynamoDB"""
+
+    items, _ = db.query(video_input.query(VideoFilter(), open=False))
+    return items
+
+
+def get_videos_by_facet(filter, open, limit=None, cursor=None, fields=None):
+    """Get videos of a facet by key condition (adjacency items) & BatchGetItem"""
+
+    if fields:
+        fields = [*fields, *video_input.MATCH_FIELDS]
+    # 該当する動画のuriだけKeyConditionで読んで、本体はまとめて取得する
+    # 隣接アイテムがなければ（backfill-adjacencyの前）今まで通りGSI-1-SKから読む
+    _, videos = get_facet_videos(
+        db,
+        video_input.key_facet(filter),
+        fields,
+        attribute=video_input.key_facet_attribute(filter),
+    )
+    videos = [video for video in videos if video_input.match(video, filter, open)]
+    # GSI-1-SKの降順（作成日時の新しい順）に揃える
+    videos.sort(key=lambda video: video.get("createdAt", ""), reverse=True)
+    return paginate(videos, limit, cursor)
+
+
 @router.post("/video")
 @document_it
 def post_video_to_db(req_video: ReqVideoPost):
@@ -97,7 +248,11 @@ def post_video_to_db(req_video: ReqVideoPost):
 
     try:
         input = video_input.put_item(video=req_video)
-        res = table.put_item(Item=input)
+        res = db.table.put_item(Item=input)
+        puts, deletes = diff_adjacency(input["PK"], [], facet_ids(input))
+        write_adjacency(db.table, puts, deletes)
+        facet_index.upsert(input)
+        search_index.upsert(input)
         return res
 
     except ClientError as err:
@@ -115,7 +270,25 @@ def put_video_to_db(req_video: ReqVideoPut):
 
     try:
         input = video_input.update_item(video=req_video)
-        res = table.update_item(**input)
+        if req_video.categoryId is None and req_video.tagIds is None:
+            res = db.table.update_item(**input)
+            update_indexes(req_video)
+            return res
+
+        # 変更前のタグ・カテゴリと比べて隣接アイテムを差分更新する
+        res = db.table.update_item(**input, ReturnValues="UPDATED_OLD")
+        old = res.pop("Attributes", {})
+        new = {
+            "categoryId": old.get("categoryId", None),
+            "tagIds": old.get("tagIds", None),
+        }
+        if req_video.categoryId is not None:
+            new["categoryId"] = req_video.categoryId
+        if req_video.tagIds is not None:
+            new["tagIds"] = req_video.tagIds
+        puts, deletes = diff_adjacency(req_video.PK, facet_ids(old), facet_ids(new))
+        write_adjacency(db.table, puts, deletes)
+        update_indexes(req_video)
         return res
 
     except ClientError as err:
@@ -126,6 +299,14 @@ def put_video_to_db(req_video: ReqVideoPut):
         raise HTTPException(status_code=404, detail=str(err))
 
 
+def update_indexes(req_video):
+    """Apply attributes written by update_item to facet & search index"""
+
+    attributes = req_video.dict(exclude={"PK", "user"}, exclude_none=True)
+    facet_index.update(req_video.PK, attributes)
+    search_index.update(req_video.PK, attributes)
+
+
 @router.put("/vimeo/video")
 @document_it
 def put_video_to_vimeo(req_video: ReqVimeoPut):
@@ -198,35 +379,17 @@ def post_thumbnail_to_vimeo(video_id: str, image: UploadFile = File(...)):
 
 
 @router.get("/vimeo/videos", response_model=List[VideoVimeo])
-async def get_videos_from_vimeo(all: bool = False, page: int = 1):
-    """Get videos from Vimeo by page"""
-
-    chunk = 100
-
-    def set_iter_times(page):
-        times = 1
-        # get specific page
-        if page >= times + 1:
-            times = page
-        # get all page
-        if all:
-            pre = vimeo.get_total()
-            times = math.ceil(pre["total"] / chunk)
-        return times
+async def get_videos_from_vimeo(all: bool = False, page: int = 1, mode: str = None):
+    """Get videos from Vimeo by page (mode=fast|ndjson skips validation)"""
 
     try:
-        times = set_iter_times(page)
-        loop = asyncio.get_running_loop()
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-            tasks = [
-                loop.run_in_executor(executor, vimeo.get_videos_by_page, chunk, i)
-                for i in range(page, times + 1)
-            ]
-            data = await asyncio.gather(*tasks)
-            merged = reduce(lambda a, b: a + b, data)
-            print("total:", len(merged))
-            return merged
+        mode = parse_mode(mode)
+        # allなら最初のページの総数を見て残りのページを並列に取得する
+        data = await vimeo.get_videos(page=page, all=all)
+        print("total:", len(data))
+        if mode is not None:
+            return fast_response(data, mode, model=VideoVimeo)
+        return data
 
     except HTTPError as err:
         raise HTTPException(status_code=404, detail=str(err))
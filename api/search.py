@@ -0,0 +1,343 @@
+import bisect
+import gzip
+import json
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+
+from api.cache import CATALOG_CACHE_TTL, catalog_cache
+from api.snapshot import encode
+
+#
+# 動画のタイトル・説明・タグ名の全文検索（プロセス内の転置インデックス）
+# ・NFKCで全角/半角をそろえ、小文字・カタカナをひらがなにして、2文字ずつ(bi-gram)に分ける
+# ・クエリのbi-gramを全て含む動画をBM25でスコア順に返す（フィールドごとに重みを付ける）
+# ・タイトル・タグ名の前方一致で入力補完する
+# ・gzipしたJSONに保存しておけばコールドスタートで読み込むだけで使える
+# ・期限切れ(TTL)のときは今のインデックスで答えながら、別スレッドで作り直して入れ替える
+#   （invalidateされたときだけリクエストの中で作り直す）
+# ・更新・削除した動画の転置リストは消す（文書頻度(df)に古い動画を数えない）
+#
+
+SEARCH_FORMAT = 1
+SEARCH_SNAPSHOT = os.environ.get("SEARCH_SNAPSHOT", "search.json.gz")
+SEARCH_FIELDS = {"name": 3.0, "tags": 2.0, "description": 1.0}
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+SEPARATOR = re.compile(r"[\W_]+")
+
+
+def normalize(text):
+    """Normalize width, case and kana (katakana -> hiragana)"""
+
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return "".join(chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c for c in text)
+
+
+def ngrams(text):
+    """Split text into bi-grams (1 char segment is kept as uni-gram)"""
+
+    terms = []
+    for segment in SEPARATOR.split(normalize(text)):
+        if len(segment) == 1:
+            terms.append(segment)
+        else:
+            terms.extend(segment[i : i + 2] for i in range(len(segment) - 1))
+    return terms
+
+
+class SearchIndex:
+    """Bi-gram inverted index of videos with BM25 ranking"""
+
+    def __init__(self, ttl=CATALOG_CACHE_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.refreshing = False
+        # 書き込みの回数（作り直している間に書き込みがあったかを見る）
+        self.writes = 0
+        self.reset()
+
+    def reset(self):
+        self.videos = []
+        self.lengths = []
+        self.ordinals = {}
+        # 連番ごとのbi-gram（更新・削除で転置リストから消す）
+        self.terms = {}
+        self.postings = defaultdict(dict)
+        self.tags = {}
+        self.total_length = 0.0
+        self.suggestions = None
+        self.version = None
+        self.expires_at = 0.0
+
+    @staticmethod
+    def current_version():
+        return [catalog_cache.version("Video"), catalog_cache.version("Tag")]
+
+    def build(self, videos, tags, version=None):
+        """Build index from video items & tag items"""
+
+        with self.lock:
+            self.reset()
+            self.tags = {tag["PK"]: tag.get("name", "") for tag in tags}
+            for video in videos:
+                self.upsert(video)
+            self.version = version
+            self.expires_at = self.clock() + self.ttl
+        return self
+
+    def ensure(self, loader):
+        """Rebuild from loader (returns videos, tags) when invalidated
+
+        Expired index is returned as it is and refreshed in background.
+        """
+
+        version = self.current_version()
+        with self.lock:
+            if self.version == version:
+                if self.clock() >= self.expires_at:
+                    self.refresh_later(loader, version)
+                return self
+        return self.build(*loader(), version)
+
+    def refresh_later(self, loader, version):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        thread = threading.Thread(
+            target=self.refresh, args=(loader, version), daemon=True
+        )
+        thread.start()
+
+    def refresh(self, loader, version):
+        """Build new index from loader and replace this one"""
+
+        writes = self.writes
+        try:
+            fresh = SearchIndex(self.ttl, self.clock).build(*loader(), version)
+            with self.lock:
+                # 作っている間に書き込み・invalidateがあれば捨てる（次のensureで作り直す）
+                if self.writes == writes and self.current_version() == version:
+                    self.replace(fresh)
+        except Exception as err:
+            print(f"search index refresh failed: {err}")
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def replace(self, other):
+        for name in (
+            "videos",
+            "lengths",
+            "ordinals",
+            "terms",
+            "postings",
+            "tags",
+            "total_length",
+            "suggestions",
+            "version",
+            "expires_at",
+        ):
+            setattr(self, name, getattr(other, name))
+
+    def fields(self, video):
+        tag_ids = video.get("tagIds", None) or []
+        return {
+            "name": video.get("name", None) or "",
+            "tags": " ".join(self.tags.get(id, "") for id in tag_ids),
+            "description": video.get("description", None) or "",
+        }
+
+    def upsert(self, video):
+        """Add or replace video"""
+
+        with self.lock:
+            uri = video["PK"]
+            self.remove(uri)
+            self.writes += 1
+            ordinal = len(self.videos)
+            self.ordinals[uri] = ordinal
+            self.videos.append(video)
+
+            weights = defaultdict(float)
+            length = 0.0
+            for field, text in self.fields(video).items():
+                terms = ngrams(text)
+                length += SEARCH_FIELDS[field] * len(terms)
+                for term in terms:
+                    weights[term] += SEARCH_FIELDS[field]
+            for term, weight in weights.items():
+                self.postings[term][ordinal] = weight
+            self.terms[ordinal] = list(weights)
+            self.lengths.append(length)
+            self.total_length += length
+            self.suggestions = None
+
+    def remove(self, uri):
+        """Remove video from postings, return True if found"""
+
+        with self.lock:
+            if (ordinal := self.ordinals.pop(uri, None)) is None:
+                return False
+            self.writes += 1
+            for term in self.terms.pop(ordinal, []):
+                postings = self.postings[term]
+                postings.pop(ordinal, None)
+                if not postings:
+                    del self.postings[term]
+            self.total_length -= self.lengths[ordinal]
+            self.suggestions = None
+            return True
+
+    def update(self, uri, attributes):
+        """Merge updated attributes into indexed video"""
+
+        with self.lock:
+            if (ordinal := self.ordinals.get(uri, None)) is None:
+                return
+            self.upsert({**self.videos[ordinal], **attributes})
+
+    def matches(self, term):
+        """Postings of term (uni-gram matches every bi-gram starting with it)"""
+
+        if len(term) > 1:
+            return [self.postings.get(term, {})]
+        return [
+            postings for key, postings in self.postings.items() if key.startswith(term)
+        ]
+
+    def search(self, query, open=True, offset=0, limit=None):
+        """Return (hits of page, total) ranked by BM25 (all terms must match)"""
+
+        with self.lock:
+            terms = list(dict.fromkeys(ngrams(query)))
+            if not terms:
+                return [], 0
+            alive = len(self.ordinals)
+            average = self.total_length / alive if alive else 0.0
+
+            scores = None
+            for term in terms:
+                term_scores = defaultdict(float)
+                for postings in self.matches(term):
+                    df = len(postings)
+                    idf = math.log(1 + (alive - df + 0.5) / (df + 0.5))
+                    for ordinal, weight in postings.items():
+                        norm = 1 - BM25_B + BM25_B * self.lengths[ordinal] / average
+                        term_scores[ordinal] += (
+                            idf * weight * (BM25_K1 + 1) / (weight + BM25_K1 * norm)
+                        )
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {
+                        ordinal: score + term_scores[ordinal]
+                        for ordinal, score in scores.items()
+                        if ordinal in term_scores
+                    }
+
+            hits = [
+                (score, ordinal)
+                for ordinal, score in scores.items()
+                if not (open and self.videos[ordinal].get("invalid", False))
+            ]
+            hits.sort(key=lambda hit: (-hit[0], hit[1]))
+            end = None if limit is None else offset + limit
+            page = [
+                {**self.videos[ordinal], "score": score}
+                for score, ordinal in hits[offset:end]
+            ]
+            return page, len(hits)
+
+    def suggest(self, prefix, limit=10):
+        """Return video names & tag names starting with prefix"""
+
+        with self.lock:
+            if self.suggestions is None:
+                names = {
+                    self.videos[ordinal].get("name", None) or ""
+                    for ordinal in self.ordinals.values()
+                }
+                names.update(self.tags.values())
+                self.suggestions = sorted((normalize(n), n) for n in names if n)
+
+            key = normalize(prefix)
+            if not key:
+                return []
+            start = bisect.bisect_left(self.suggestions, (key, ""))
+            found = []
+            for normalized, name in self.suggestions[start:]:
+                if not normalized.startswith(key) or len(found) >= limit:
+                    break
+                found.append(name)
+            return found
+
+    def save(self, path=SEARCH_SNAPSHOT):
+        """Save compact snapshot (gzip JSON without replaced videos)"""
+
+        with self.lock:
+            alive = sorted(self.ordinals.values())
+            renumber = {old: new for new, old in enumerate(alive)}
+            postings = {}
+            for term, entries in self.postings.items():
+                flat = []
+                for ordinal, weight in sorted(entries.items()):
+                    if ordinal in renumber:
+                        flat.extend((renumber[ordinal], weight))
+                if flat:
+                    postings[term] = flat
+            data = dict(
+                format=SEARCH_FORMAT,
+                tags=self.tags,
+                videos=[self.videos[ordinal] for ordinal in alive],
+                lengths=[self.lengths[ordinal] for ordinal in alive],
+                postings=postings,
+            )
+        raw = json.dumps(
+            data, default=encode, ensure_ascii=False, separators=(",", ":")
+        )
+        tmp = f"{path}.tmp"
+        with gzip.open(tmp, "wb", compresslevel=6) as f:
+            f.write(raw.encode("utf-8"))
+        os.replace(tmp, path)
+
+    def load(self, path=SEARCH_SNAPSHOT):
+        """Load snapshot without tokenizing (valid for TTL)"""
+
+        with gzip.open(path, "rb") as f:
+            data = json.loads(f.read())
+        if data.get("format", None) != SEARCH_FORMAT:
+            raise ValueError(f"Unsupported search snapshot format: {path}")
+
+        with self.lock:
+            self.reset()
+            self.tags = data["tags"]
+            self.videos = data["videos"]
+            self.lengths = data["lengths"]
+            self.ordinals = {video["PK"]: i for i, video in enumerate(self.videos)}
+            self.total_length = sum(self.lengths)
+            terms = defaultdict(list)
+            for term, flat in data["postings"].items():
+                self.postings[term] = dict(zip(flat[::2], flat[1::2]))
+                for ordinal in flat[::2]:
+                    terms[ordinal].append(term)
+            self.terms = dict(terms)
+            self.version = self.current_version()
+            self.expires_at = self.clock() + self.ttl
+        return self
+
+
+search_index = SearchIndex()
+# スナップショットがあればコールドスタート時に読み込んでおく
+if os.path.exists(SEARCH_SNAPSHOT):
+    try:
+        search_index.load()
+    except (OSError, ValueError) as err:
+        print(f"search snapshot is not loaded: {err}")
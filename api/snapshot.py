@@ -0,0 +1,165 @@
+import json
+import mmap
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from decimal import Decimal
+
+#
+# DynamoDB/Vimeoのカタログをローカルに保存するスナップショット
+# ・<root>/<name>/<version>/ に保存する（versionは作成日時、latestは一番新しいもの）
+# ・data.ndjson : 1行1アイテムのJSON、キー(PK)順に並べる
+# ・index.json  : キーごとの(オフセット, バイト数, 件数)
+# ・manifest.json : フォーマットのバージョン・件数など
+# dataはmmapで開くので、PKで絞り込むときは該当する行だけ読む
+#
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_ROOT = os.environ.get("SNAPSHOT_ROOT", "snapshots")
+
+
+def encode(value):
+    """JSON encoder for DynamoDB types (Decimal, set)"""
+
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def write_snapshot(name, items, key="PK", sort_key="SK", root=SNAPSHOT_ROOT):
+    """Write items as new version of snapshot and return manifest"""
+
+    items = sorted(items, key=lambda item: (item[key], str(item.get(sort_key, ""))))
+    version = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    directory = os.path.join(root, name)
+    os.makedirs(directory, exist_ok=True)
+
+    # 書き終わってからリネームするので、途中のスナップショットは見えない
+    tmp = tempfile.mkdtemp(dir=directory, prefix=".tmp-")
+    try:
+        index = {}
+        offset = 0
+        with open(os.path.join(tmp, "data.ndjson"), "wb") as f:
+            for item in items:
+                line = json.dumps(item, default=encode, ensure_ascii=False)
+                line = line.encode("utf-8") + b"\n"
+                f.write(line)
+                value = item[key]
+                if value in index:
+                    index[value][1] += len(line)
+                    index[value][2] += 1
+                else:
+                    index[value] = [offset, len(line), 1]
+                offset += len(line)
+        with open(os.path.join(tmp, "index.json"), "w") as f:
+            json.dump(index, f, ensure_ascii=False)
+
+        manifest = dict(
+            format=SNAPSHOT_FORMAT,
+            name=name,
+            version=version,
+            key=key,
+            sortKey=sort_key,
+            count=len(items),
+            keys=len(index),
+            bytes=offset,
+            createdAt=datetime.now().isoformat(),
+        )
+        with open(os.path.join(tmp, "manifest.json"), "w") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.rename(tmp, os.path.join(directory, version))
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return manifest
+
+
+def list_versions(name, root=SNAPSHOT_ROOT):
+    """Return versions of snapshot (oldest first)"""
+
+    directory = os.path.join(root, name)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(v for v in os.listdir(directory) if not v.startswith("."))
+
+
+class Snapshot:
+    """Read-only snapshot on mmap (use as context manager)"""
+
+    def __init__(self, name, version=None, root=SNAPSHOT_ROOT):
+        if version is None:
+            versions = list_versions(name, root)
+            if not versions:
+                raise FileNotFoundError(f"No snapshot of {name} in {root}")
+            version = versions[-1]
+        self.path = os.path.join(root, name, version)
+
+        with open(os.path.join(self.path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format", None) != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported snapshot format: {self.manifest}")
+        with open(os.path.join(self.path, "index.json")) as f:
+            self.index = json.load(f)
+
+        self.file = open(os.path.join(self.path, "data.ndjson"), "rb")
+        # 空ファイルはmmapできない
+        self.data = (
+            mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.manifest["bytes"]
+            else b""
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.manifest["count"]
+
+    def __contains__(self, key):
+        return key in self.index
+
+    @property
+    def version(self):
+        return self.manifest["version"]
+
+    def keys(self):
+        """Return keys (PK) in order"""
+
+        return self.index.keys()
+
+    def get(self, key):
+        """Return items of key (PK) without reading other lines"""
+
+        if (entry := self.index.get(key, None)) is None:
+            return []
+        offset, length, _ = entry
+        lines = self.data[offset : offset + length].splitlines()
+        return [json.loads(line) for line in lines]
+
+    def iter(self, keys=None):
+        """Stream items (only of keys when given)"""
+
+        if keys is not None:
+            # オフセット順に読むとディスク上で連続する
+            entries = sorted(self.index[key] for key in set(keys) if key in self.index)
+            for offset, length, _ in entries:
+                for line in self.data[offset : offset + length].splitlines():
+                    yield json.loads(line)
+            return
+
+        start = 0
+        while start < len(self.data):
+            end = self.data.find(b"\n", start)
+            yield json.loads(self.data[start:end])
+            start = end + 1
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
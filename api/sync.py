@@ -0,0 +1,240 @@
+import asyncio
+import concurrent.futures
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from api.client import TABLE_NAME, DynamoDB, VimeoAPI, serializer
+from api.snapshot import SNAPSHOT_ROOT, Snapshot, write_snapshot
+from api.vimeo_async import VIMEO_FIELDS
+
+#
+# VimeoとDynamoDBの差分同期
+# ・前回同期した時刻（ハイウォーターマーク）以降にVimeoで更新された動画だけ取得する
+# ・DBは対象の動画だけBatchGetItemで取得して、PK/uriのハッシュで突き合わせる
+# ・変更があった属性だけUpdateItemで書き込む
+#
+
+SYNC_KEY = {"PK": "Sync", "SK": "Vimeo"}
+# 比べて書き込む属性（uriはPK/SKと同じキーなので突き合わせに使うだけで比べない）
+SYNC_ATTRIBUTES = ("name", "duration", "plays", "html", "thumbnail")
+SYNC_WORKERS = 8
+
+
+@dataclass
+class SyncResult:
+    """Result of sync between Vimeo & DynamoDB"""
+
+    since: str = None
+    watermark: str = None
+    fetched: int = 0
+    changes: list = field(default_factory=list)
+    missing_in_db: list = field(default_factory=list)
+    missing_in_vimeo: list = field(default_factory=list)
+    written: int = 0
+
+
+def parse_time(value):
+    """Parse Vimeo timestamp (ISO 8601)"""
+
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def normalize(value):
+    # DBには数値が文字列で入っていることがあるので文字列で比べる
+    return None if value is None else str(value)
+
+
+def diff_attributes(item, data):
+    """Return changed attributes of Vimeo record against DB item"""
+
+    return {
+        key: data[key]
+        for key in SYNC_ATTRIBUTES
+        if key in data and normalize(item.get(key, None)) != normalize(data[key])
+    }
+
+
+def update_input(uri, changes):
+    """input update only changed attributes (client API)"""
+
+    names = {f"#a{i}": key for i, key in enumerate(changes)}
+    values = {
+        f":v{i}": serializer.serialize(value)
+        for i, value in enumerate(changes.values())
+    }
+    return dict(
+        TableName=TABLE_NAME,
+        Key={"PK": {"S": uri}, "SK": {"S": uri}},
+        UpdateExpression="SET " + ", ".join(f"{n}={v}" for n, v in zip(names, values)),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+        # 同期中に削除された動画は作らない
+        ConditionExpression="attribute_exists(PK)",
+    )
+
+
+class VimeoSync:
+    """Incremental sync from Vimeo to DynamoDB"""
+
+    def __init__(self, db=None, vimeo=None):
+        self.db = db or DynamoDB()
+        self.vimeo = vimeo or VimeoAPI()
+
+    def get_watermark(self):
+        """Get modified time of last sync"""
+
+        res = self.db.table.get_item(Key=SYNC_KEY)
+        return res.get("Item", {}).get("modifiedTime", None)
+
+    def put_watermark(self, watermark, result):
+        """Put modified time of this sync"""
+
+        self.db.table.put_item(
+            Item={
+                **SYNC_KEY,
+                "modifiedTime": watermark,
+                "fetched": result.fetched,
+                "written": result.written,
+            }
+        )
+
+    async def fetch_modified(self, since=None, per_page=100):
+        """Fetch Vimeo videos modified after since (newest first)"""
+
+        # 更新日時の降順で取得して、sinceより古い動画に来たら止める（同時刻は念のため取り直す）
+        since = parse_time(since) if since else None
+        fields = f"{VIMEO_FIELDS},modified_time"
+        videos = []
+        page = 1
+        while True:
+            res = await self.vimeo.aio.get(
+                "/me/videos",
+                params={
+                    "page": page,
+                    "per_page": per_page,
+                    "fields": fields,
+                    "sort": "modified_time",
+                    "direction": "desc",
+                },
+            )
+            data = res.get("data", [])
+            for d in data:
+                if since and parse_time(d["modified_time"]) < since:
+                    return videos
+                videos.append(d)
+            if len(data) < per_page:
+                return videos
+            page += 1
+
+    async def fetch_all(self):
+        """Fetch all Vimeo videos (pages in parallel)"""
+
+        fields = f"{VIMEO_FIELDS},modified_time"
+        return await self.vimeo.aio.get_videos(all=True, fields=fields)
+
+    def to_records(self, vimeo_videos):
+        """Sort Vimeo response into DB attributes (with modified time)"""
+
+        return [
+            {**self.vimeo.sort(d), "modified_time": d.get("modified_time", None)}
+            for d in vimeo_videos
+        ]
+
+    def read_items(self, records, full=False):
+        """Read DB items to compare (all videos when full)"""
+
+        if full:
+            items, _ = self.db.query(
+                dict(
+                    IndexName="GSI-1-SK",
+                    KeyConditionExpression="indexKey = :video",
+                    FilterExpression="attribute_exists(invalid)",
+                    ExpressionAttributeValues={":video": "Video"},
+                )
+            )
+            return {(item["PK"], item["SK"]): item for item in items}
+        keys = [{"PK": r["uri"], "SK": r["uri"]} for r in records if r["uri"]]
+        return self.db.batch_get(keys, fields=list(SYNC_ATTRIBUTES))
+
+    def plan(self, vimeo_videos, full=False, items=None):
+        """Diff Vimeo videos against DynamoDB items by hash index"""
+
+        result = SyncResult(fetched=len(vimeo_videos))
+        records = self.to_records(vimeo_videos)
+        if items is None:
+            items = self.read_items(records, full)
+
+        # PKのハッシュで突き合わせる（DBのアイテムは書き換えない）
+        index = {pk: item for (pk, _), item in items.items()}
+        for data in records:
+            if (item := index.get(data["uri"], None)) is None:
+                result.missing_in_db.append(data["uri"])
+            elif changes := diff_attributes(item, data):
+                result.changes.append((data["uri"], changes))
+        # 差分同期ではVimeo側で削除された動画は分からない
+        if full:
+            uris = {data["uri"] for data in records}
+            result.missing_in_vimeo = [pk for pk in index if pk not in uris]
+
+        times = [r["modified_time"] for r in records if r["modified_time"]]
+        if times:
+            result.watermark = max(times, key=parse_time)
+        return result
+
+    def apply(self, result):
+        """Write changed attributes with UpdateItem in parallel"""
+
+        inputs = [update_input(uri, changes) for uri, changes in result.changes]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=SYNC_WORKERS) as ex:
+            for _ in ex.map(lambda input: self.db.client.update_item(**input), inputs):
+                result.written += 1
+        return result
+
+    def run(self, dry_run=False, full=False, since=None, snapshot=None):
+        """Run sync and return result (save fetched data when snapshot root given)"""
+
+        since = since or (None if full else self.get_watermark())
+
+        async def fetch():
+            try:
+                if full:
+                    return await self.fetch_all()
+                return await self.fetch_modified(since)
+            finally:
+                await self.vimeo.aio.close()
+
+        vimeo_videos = asyncio.run(fetch())
+        items = self.read_items(self.to_records(vimeo_videos), full)
+        if snapshot is not None:
+            write_snapshot("vimeo", vimeo_videos, "uri", "uri", root=snapshot)
+            write_snapshot("videos", items.values(), root=snapshot)
+
+        result = self.plan(vimeo_videos, full=full, items=items)
+        result.since = since
+        if dry_run:
+            return result
+
+        self.apply(result)
+        if result.watermark and (not since or result.watermark != since):
+            self.put_watermark(result.watermark, result)
+        return result
+
+    def run_offline(self, root=SNAPSHOT_ROOT, full=False, since=None):
+        """Diff latest snapshots of Vimeo & DynamoDB (nothing is written)"""
+
+        with Snapshot("vimeo", root=root) as vimeo, Snapshot("videos", root=root) as db:
+            since = parse_time(since) if since else None
+            vimeo_videos = [
+                d
+                for d in vimeo.iter()
+                # 更新日時がない（古いスナップショットの）動画は対象にする
+                if since is None
+                or not d.get("modified_time", None)
+                or parse_time(d["modified_time"]) >= since
+            ]
+            # DB側は対象のPKだけ読む
+            keys = None if full else [d["uri"] for d in vimeo_videos]
+            items = {(item["PK"], item["SK"]): item for item in db.iter(keys)}
+        result = self.plan(vimeo_videos, full=full, items=items)
+        result.since = since and since.isoformat()
+        return result
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime
+
+import pytz
+
+#
+# 時刻順に並ぶID（ULID形式: 先頭10文字がミリ秒の時刻、残り16文字が乱数, Crockford base32）
+# ・文字列の辞書順が時刻順になるので、SKにすればキー条件(begins_with/between)で新しい順・期間指定で読める
+# ・同じミリ秒の中では乱数部分を1ずつ増やして、発行順に並ぶようにする
+# ・移行用に(PK, 元のSK)から毎回同じIDを作る（何回実行しても同じキーになる）
+#
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+TIME_LENGTH = 10
+RANDOM_LENGTH = 16
+ID_LENGTH = TIME_LENGTH + RANDOM_LENGTH
+RANDOM_MAX = (1 << 80) - 1
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+TOKYO = pytz.timezone("Asia/Tokyo")
+
+lock = threading.Lock()
+last = [0, 0]
+
+
+def encode(value, length):
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, 32)
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def decode(text):
+    value = 0
+    for char in text:
+        value = value * 32 + ALPHABET.index(char)
+    return value
+
+
+def parse_jst(timestamp):
+    """Return epoch milliseconds of JST timestamp formated yyyy-mm-dd hh:mm:ss"""
+
+    local = datetime.strptime(timestamp.replace("T", " ")[:19], TIMESTAMP_FORMAT)
+    return int(TOKYO.localize(local).timestamp() * 1000)
+
+
+def format_jst(ms):
+    """Return JST timestamp formated yyyy-mm-dd hh:mm:ss of epoch milliseconds"""
+
+    utc = datetime.fromtimestamp(ms / 1000, tz=pytz.utc)
+    return utc.astimezone(TOKYO).strftime(TIMESTAMP_FORMAT)
+
+
+def new_id(timestamp=None):
+    """Return monotonic time-ordered ID (now or at JST timestamp)"""
+
+    ms = parse_jst(timestamp) if timestamp else int(time.time() * 1000)
+    with lock:
+        if ms == last[0] and last[1] < RANDOM_MAX:
+            random = last[1] + 1
+        else:
+            random = int.from_bytes(os.urandom(10), "big")
+        last[:] = [ms, random]
+    return encode(ms, TIME_LENGTH) + encode(random, RANDOM_LENGTH)
+
+
+def stable_id(timestamp, *seeds):
+    """Return time-ordered ID which is always same for same seeds (migration)"""
+
+    digest = hashlib.sha1("\n".join(seeds).encode("utf-8")).digest()
+    random = int.from_bytes(digest[:10], "big")
+    return encode(parse_jst(timestamp), TIME_LENGTH) + encode(random, RANDOM_LENGTH)
+
+
+def is_time_id(text):
+    return len(text) == ID_LENGTH and all(char in ALPHABET for char in text)
+
+
+def id_time(id):
+    """Return epoch milliseconds of ID"""
+
+    return decode(id[:TIME_LENGTH])
+
+
+def id_timestamp(id):
+    """Return JST timestamp formated yyyy-mm-dd hh:mm:ss of ID"""
+
+    return format_jst(id_time(id))
+
+
+def id_floor(timestamp):
+    """Smallest ID at JST timestamp or date (for between key conditions)"""
+
+    if len(timestamp) == 10:
+        timestamp += " 00:00:00"
+    return encode(parse_jst(timestamp), TIME_LENGTH) + ALPHABET[0] * RANDOM_LENGTH
+
+
+def id_ceil(timestamp):
+    """Largest ID within the second of JST timestamp (or within the date)"""
+
+    if len(timestamp) == 10:
+        timestamp += " 23:59:59"
+    ms = parse_jst(timestamp) + 999
+    return encode(ms, TIME_LENGTH) + ALPHABET[-1] * RANDOM_LENGTH
@@ -3,6 +3,8 @@ import pytz
 from pprint import pprint
 from functools import wraps
 
+from api.join import join_videos
+from api.reference import ReferenceIndex, build_video_rows
 
 dammy_videmo = {
     "indexKey": "",
@@ -39,35 +41,11 @@ dammy_vimeo = {
 def merge_videos(vimeo_response, db_response, all):
     """Merge videos from vimeo & videos from db"""
 
-    vimeo_data = vimeo_response.get("data", [])
-    records = []
-    # マージ(DBを正としてループを回す->DBレコードは全て取得される)
-    for item in db_response:
-        item["match"] = False
-        for data in vimeo_data:
-            if item.get("PK", None) == data.get("uri", None):
-                item["match"] = True
-                item.update(data)
-                records.append(item)
-        # DBにあってVimeoにない
-        if not item["match"]:
-            records.append(item)
-
-    # VimeoにあってDBにない
-    for data in vimeo_data:
-        data["match"] = False
-        for item in db_response:
-            if data.get("uri", None) == item.get("PK", None):
-                data["match"] = True
-        if not data["match"]:
-            records.append(data)
-
+    # DBを正としてVimeoのレコードをハッシュ結合する
     # DBにあってVimeoにない動画は除外する（バグる）
-    if not all:
-        excluded = [item for item in records if item["match"]]
-        return excluded
-    else:
-        return records
+    vimeo_data = vimeo_response.get("data", [])
+    result = join_videos(db_response, vimeo_data, all)
+    return result.records
 
 
 def merge_paths_and_videos(paths, videos):
@@ -89,76 +67,13 @@ def merge_paths_and_videos(paths, videos):
 # レスポンスでエラーにせず（値は返す）、管理画面でエラーをキャッチする
 
 
-def merge_table_for_video(videos, categories, tags, paths, users):
+def merge_table_for_video(videos, categories, tags, paths, users, index=None):
     """Create table data for video"""
-    rows = []
-    for i, video in enumerate(videos, 1):
-        row = {}
-        row["id"] = i
-        row["match"] = video.get("match", True)
-        row["uri"] = video.get("uri", "")
-        row["invalid"] = video.get("invalid", True)
-
-        if (thumbnail := video.get("thumbnail", None)) is not None:
-            row["thumbnail"] = thumbnail.get("link", "")
-        else:
-            row["thumbnail"] = ""
-
-        row["name"] = video.get("name", "")
-        row["description"] = video.get("description", "")
-        # find category
-        secondary = [c for c in categories if c["PK"] == video.get("categoryId", None)]
-        if not secondary:
-            row["primary"] = ""
-            row["secondary"] = ""
-        else:
-            primary = [c for c in categories if c["PK"] == secondary[0]["parentId"]]
-            row["primary"] = primary[0]["name"]
-            row["secondary"] = secondary[0]["name"]
-        # find tags
-        if not video.get("tagIds", None):
-            row["tags"] = []
-        else:
-            tag_names = [
-                t["name"] for t in tags for id in video["tagIds"] if id == t["PK"]
-            ]
-            row["tags"] = tag_names
-
-        # find learning paths
-        if not video.get("learningPathIds", None):
-            row["paths"] = []
-        else:
-            path_names = [
-                p["name"]
-                for p in paths
-                for id in video["learningPathIds"]
-                if id == p["PK"]
-            ]
-            row["paths"] = path_names
-
-        row["note"] = video.get("note", "")
-        row["duration"] = video.get("duration", 0)
-
-        if (stats := video.get("stats", None)) is not None:
-            row["plays"] = stats.get("plays", 0)
-        else:
-            row["plays"] = 0
-
-        # find user
-        if not video.get("createdUser", None):
-            row["createdUser"] = ""
-            row["updatedUser"] = ""
-        else:
-            created_user = [u["name"] for u in users if video["createdUser"] == u["PK"]]
-            updated_user = [u["name"] for u in users if video["updatedUser"] == u["PK"]]
-            row["createdUser"] = created_user[0]
-            row["updatedUser"] = updated_user[0]
-
-        row["createdAt"] = video.get("createdAt", "")
-        row["updatedAt"] = video.get("updatedAt", "")
-
-        rows.append(row)
-    return rows
+
+    # 参照データはPKで引けるようにインデックスを1回だけ作る
+    if index is None:
+        index = ReferenceIndex.build(categories, tags, paths, users)
+    return build_video_rows(videos, index)
 
 
 def merge_categories(categories):
@@ -244,6 +159,13 @@ def document_it(func):
     return wrapper
 
 
+def set_cursor(response, cursor):
+    """Set cursor for next page to response header"""
+
+    if response is not None and cursor:
+        response.headers["X-Next-Cursor"] = cursor
+
+
 def timestamp_jst():
     """Return timestamp(JST) formated yyyy-mm-dd hh:mm:ss"""
 
@@ -0,0 +1,161 @@
+import os
+import math
+import time
+import asyncio
+import random
+from datetime import datetime
+
+import aiohttp
+
+#
+# asyncioで動くVimeoクライアント
+# ・コネクションはkeep-aliveでプールして使い回す
+#   セッションはイベントループごとに作り、ループが終わるとき(asyncio.runがタスクを
+#   キャンセルするとき)に閉じる（ループが変わっても前のセッションを閉じずに捨てない）
+# ・同時リクエスト数はセマフォで制限する
+# ・X-RateLimit-*ヘッダを見て残りが少なければ間隔を空ける、429ならリセットまで待つ
+#
+
+VIMEO_API = "https://api.vimeo.com"
+VIMEO_ACCEPT = "application/vnd.vimeo.*+json;version=3.4"
+VIMEO_CONCURRENCY = int(os.environ.get("VIMEO_CONCURRENCY", 5))
+VIMEO_FIELDS = "uri,name,duration,stats,privacy,embed.html,pictures.sizes"
+VIMEO_RETRIES = 5
+
+
+def parse_reset(value):
+    """Parse X-RateLimit-Reset (ISO 8601) to epoch seconds"""
+
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+class AsyncVimeoClient:
+    """Vimeo client on asyncio with keep-alive connection pool"""
+
+    def __init__(self, token, concurrency=VIMEO_CONCURRENCY, timeout=20):
+        self.token = token
+        self.concurrency = concurrency
+        self.timeout = timeout
+        # イベントループ -> (セッション, セマフォ)
+        self.sessions = {}
+        # イベントループ -> セッションを閉じるタスク
+        self.closers = {}
+        # レートリミットで待つ必要がある時刻(epoch)
+        self.pause_until = 0.0
+
+    def get_session(self):
+        """Get (session, semaphore) of running event loop"""
+
+        loop = asyncio.get_running_loop()
+        # 終わったループのセッションはclose_with_loop()で閉じてある
+        for other in [other for other in self.sessions if other.is_closed()]:
+            del self.sessions[other]
+            self.closers.pop(other, None)
+        entry = self.sessions.get(loop, None)
+        if entry is None or entry[0].closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.concurrency, keepalive_timeout=60, ttl_dns_cache=300
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={
+                    "Authorization": f"bearer {self.token}",
+                    "Accept": VIMEO_ACCEPT,
+                },
+            )
+            entry = (session, asyncio.Semaphore(self.concurrency))
+            self.sessions[loop] = entry
+            self.closers[loop] = loop.create_task(self.close_with_loop(session))
+        return entry
+
+    async def close_with_loop(self, session):
+        """Wait until the loop cancels this task and close session"""
+
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            if not session.closed:
+                await session.close()
+
+    def throttle(self, headers):
+        """Adjust pause from rate limit headers"""
+
+        remaining = headers.get("X-RateLimit-Remaining", None)
+        reset_at = parse_reset(headers.get("X-RateLimit-Reset", None))
+        if remaining is None or reset_at is None:
+            return
+        remaining = int(remaining)
+        now = time.time()
+        # 残りが少なければリセットまでの時間を残り回数で割って間隔を空ける
+        if remaining <= 0:
+            self.pause_until = max(self.pause_until, reset_at)
+        elif remaining < self.concurrency * 2:
+            interval = max(reset_at - now, 0) / remaining
+            self.pause_until = max(self.pause_until, now + interval)
+
+    async def get(self, path, params=None):
+        """GET Vimeo API and return json (retry 429/5xx with backoff)"""
+
+        session, semaphore = self.get_session()
+        for attempt in range(VIMEO_RETRIES + 1):
+            if (wait := self.pause_until - time.time()) > 0:
+                await asyncio.sleep(wait)
+            async with semaphore:
+                async with session.get(f"{VIMEO_API}{path}", params=params) as res:
+                    self.throttle(res.headers)
+                    if res.status == 429 or res.status >= 500:
+                        if attempt >= VIMEO_RETRIES:
+                            res.raise_for_status()
+                        retry_after = res.headers.get("Retry-After", None)
+                        reset_at = parse_reset(res.headers.get("X-RateLimit-Reset"))
+                        if retry_after is not None:
+                            delay = float(retry_after)
+                        elif res.status == 429 and reset_at is not None:
+                            delay = reset_at - time.time()
+                        else:
+                            delay = 0.5 * 2**attempt
+                        delay = max(delay, 0) + random.uniform(0, 0.25)
+                        self.pause_until = max(self.pause_until, time.time() + delay)
+                        continue
+                    res.raise_for_status()
+                    return await res.json()
+
+    async def get_videos_page(self, page, per_page=100, fields=VIMEO_FIELDS):
+        """Get a page of my videos (response has total)"""
+
+        params = {"page": page, "per_page": per_page, "fields": fields}
+        return await self.get("/me/videos", params=params)
+
+    async def get_videos(self, page=1, all=False, per_page=100, fields=VIMEO_FIELDS):
+        """Get my videos from page (and rest pages in parallel when all)"""
+
+        # 最初のページで総数が分かるので、残りのページはまとめて並列に取得する
+        first = await self.get_videos_page(page, per_page, fields)
+        data = list(first.get("data", []))
+        if not all:
+            return data
+
+        last = math.ceil(first.get("total", 0) / per_page)
+        pages = await asyncio.gather(
+            *[
+                self.get_videos_page(i, per_page, fields)
+                for i in range(page + 1, last + 1)
+            ]
+        )
+        for res in pages:
+            data.extend(res.get("data", []))
+        return data
+
+    async def close(self):
+        """Close connection pool of running event loop"""
+
+        loop = asyncio.get_running_loop()
+        entry = self.sessions.pop(loop, None)
+        if (closer := self.closers.pop(loop, None)) is not None:
+            closer.cancel()
+        if entry is not None and not entry[0].closed:
+            await entry[0].close()
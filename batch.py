@@ -17,6 +17,7 @@ from functools import reduce
 
 from pprint import pprint
 import pickle
+from api.snapshot import SNAPSHOT_ROOT, write_snapshot
 
 load_dotenv(override=True)
 
@@ -255,11 +256,19 @@ def bulk_update(db, items):
         print(err)
 
 
-def make_pickle(data, name):
-    """DB/Vimeoレスポンスをpickle化する"""
+def make_snapshot(data, name, key="PK", sort_key="SK", root=SNAPSHOT_ROOT):
+    """DB/Vimeoレスポンスをスナップショットに保存する"""
 
-    with open(name, "wb") as f:
-        pickle.dump(data, f)
+    return write_snapshot(name, data, key, sort_key, root=root)
+
+
+def import_pickles(root=SNAPSHOT_ROOT):
+    """既存のdb.pickle/vimeo.pickleをスナップショットに変換する"""
+
+    with open("db.pickle", "rb") as f:
+        print(make_snapshot(pickle.load(f), "videos", root=root))
+    with open("vimeo.pickle", "rb") as f:
+        print(make_snapshot(pickle.load(f), "vimeo", "uri", "uri", root=root))
 
 
 #
@@ -431,64 +440,86 @@ class VimeoAPI(Auth):
             raise err
 
 
-if __name__ == "__main__":
+def print_result(result, dry_run):
+    """同期結果を表示する"""
+
+    print(f"since: {result.since or '-'} -> watermark: {result.watermark or '-'}")
+    print(f"fetched from vimeo: {result.fetched}")
+    print(f"changed: {len(result.changes)}")
+    for uri, changes in result.changes:
+        print(f"  {uri}: {', '.join(changes)}")
+        if dry_run:
+            for key, value in changes.items():
+                print(f"    {key} = {str(value)[:80]}")
+    if result.missing_in_db:
+        print(f"not in DynamoDB: {len(result.missing_in_db)}")
+        for uri in result.missing_in_db:
+            print(f"  {uri}")
+    if result.missing_in_vimeo:
+        print(f"not in vimeo: {len(result.missing_in_vimeo)}")
+        for uri in result.missing_in_vimeo:
+            print(f"  {uri}")
+    if dry_run:
+        print("dry run: nothing was written")
+    else:
+        print(f"written: {result.written}")
 
-    db_client = create_dynamodb_client()
-    vimeo_client = create_vimeo_client()
-    db_resource = create_dynamodb_resource()
 
-    db = DynamoDB()
-    v = VimeoAPI()
+if __name__ == "__main__":
+    import argparse
+    from api.sync import VimeoSync
+
+    #
+    # Vimeo -> DynamoDBの差分同期
+    # $ python batch.py --dry-run
+    # $ python batch.py --full
+    # $ python batch.py --full --dry-run --snapshot snapshots  (取得したデータを保存)
+    # $ python batch.py --offline snapshots                    (保存したデータで差分だけ見る)
+    # $ python batch.py --import-pickles snapshots             (pickleから変換)
+    #
+
+    parser = argparse.ArgumentParser(description="Sync videos from Vimeo to DynamoDB")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="show changes without writing"
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="compare all videos (ignore watermark)"
+    )
+    parser.add_argument(
+        "--since", default=None, help="modified time to start from (ISO 8601)"
+    )
+    parser.add_argument(
+        "--snapshot", default=None, help="save fetched data as snapshot to directory"
+    )
+    parser.add_argument(
+        "--offline", default=None, help="diff snapshots in directory (implies dry run)"
+    )
+    parser.add_argument(
+        "--import-pickles",
+        default=None,
+        help="convert db.pickle/vimeo.pickle to snapshots in directory",
+    )
+    args = parser.parse_args()
 
+    start = time.time()
     try:
-
-        """pickleがない場合はAPIをコールする"""
-        db_res = db.query(open=False)
-        print(len(db_res))
-
-        vimeo_res = asyncio.run(v.get_videos())
-        print(len(vimeo_res))
-
-        data_diff = db.diff(db_res, vimeo_res)
-        print(len(data_diff))
-        if len(data_diff) > 0:
-            pprint(data_diff)
-
-        # res = db.bulk_update(items=data_diff)
-        # print(res)
-
-        # vimeo_res = asyncio.run(getter(vimeo_client))
-        # print("vimeo_total:", len(vimeo_res))
-        # make_pickle(vimeo_res, "vimeo.pickle")
-
-        # db_res = query(db_client, open=False)
-        # print("db_total:", len(db_res))
-        # make_pickle(db_res, "db.pickle")
-
-        """pickleがある場合は読み込む"""
-
-        # f_db = open("db.pickle", "rb")
-        # db_res = pickle.load(f_db)
-
-        # f_vimeo = open("vimeo.pickle", "rb")
-        # vimeo_res = pickle.load(f_vimeo)
-
-        # vimeo_res_sorted = sort(vimeo_res)
-
-        """差分更新"""
-        # db_res_diff = diff(db_res, vimeo_res_sorted)
-        # pprint(db_res_diff)
-        # res = bulk_update(db=db_resource, items=db_res_diff)
-
-        """全更新"""
-        # merged_items = merge(db_res=db_res, vimeo_res=vimeo_res_sorted)
-        # pprint(merged_items[0])
-        # res = bulk_update(db=db_resource, items=merged_items)
-        # print(res)
-
+        if args.import_pickles:
+            import_pickles(args.import_pickles)
+        elif args.offline:
+            result = VimeoSync().run_offline(
+                root=args.offline, full=args.full, since=args.since
+            )
+            print_result(result, True)
+        else:
+            result = VimeoSync().run(
+                dry_run=args.dry_run,
+                full=args.full,
+                since=args.since,
+                snapshot=args.snapshot,
+            )
+            print_result(result, args.dry_run)
+        print(time.time() - start)
     except HTTPError as err:
         print(err)
     except ClientError as err:
         print(err)
-    except BaseException as err:
-        print(err)
@@ -0,0 +1,481 @@
+import argparse
+import copy
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+from typing import List
+
+from aws_dynamodb_parser import parse
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+from api.deserialize import deserialize_page
+from api.response import fast_response
+from api.routes.video.schema import VideoDB
+from api.util import merge_videos, merge_table_for_video
+from api.reference import ReferenceIndex
+from api.snapshot import encode
+
+#
+# ローカルで実行するベンチマーク（AWS/Vimeoにはアクセスしない）
+# $ python benchmark.py join --sizes 1000 10000 100000
+# $ python benchmark.py deserialize --sizes 10000
+# $ python benchmark.py response --sizes 10000
+#
+
+
+def make_videos(size, *, match_rate=0.9, seed=0):
+    """Make dammy DynamoDB items & Vimeo records"""
+
+    rand = random.Random(seed)
+    uris = [f"/videos/{500000000 + i}" for i in range(size)]
+    db_items = [
+        {
+            "PK": uri,
+            "SK": uri,
+            "indexKey": "Video",
+            "invalid": False,
+            "categoryId": f"C-{rand.randrange(50):08}",
+            "tagIds": [f"T-{rand.randrange(200):08}" for _ in range(3)],
+            "learningPathIds": [f"L-{rand.randrange(30):08}"],
+            "description": "description " * 10,
+            "createdUser": f"user{rand.randrange(100)}@example.com",
+            "updatedUser": f"user{rand.randrange(100)}@example.com",
+        }
+        for uri in uris
+    ]
+    vimeo_data = [
+        {
+            "uri": uri if rand.random() < match_rate else f"/videos/{i}",
+            "name": f"video {i}",
+            "duration": rand.randrange(3600),
+            "plays": rand.randrange(1000),
+            "html": "<iframe></iframe>",
+            "thumbnail": "https://i.vimeocdn.com/video/0.jpg",
+        }
+        for i, uri in enumerate(uris)
+    ]
+    rand.shuffle(vimeo_data)
+    return db_items, vimeo_data
+
+
+def measure(func, *args, repeat=1):
+    """Return best elapsed seconds of func"""
+
+    best = None
+    for _ in range(repeat):
+        fixture = copy.deepcopy(args)
+        start = time.perf_counter()
+        func(*fixture)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def legacy_merge_videos(vimeo_response, db_response, all):
+    """merge_videos before hash join (nested loops)"""
+
+    vimeo_data = vimeo_response.get("data", [])
+    records = []
+    for item in db_response:
+        item["match"] = False
+        for data in vimeo_data:
+            if item.get("PK", None) == data.get("uri", None):
+                item["match"] = True
+                item.update(data)
+                records.append(item)
+        if not item["match"]:
+            records.append(item)
+
+    for data in vimeo_data:
+        data["match"] = False
+        for item in db_response:
+            if data.get("uri", None) == item.get("PK", None):
+                data["match"] = True
+        if not data["match"]:
+            records.append(data)
+
+    if not all:
+        return [item for item in records if item["match"]]
+    return records
+
+
+def bench_join(args):
+    """merge_videos: nested loops vs hash join"""
+
+    print(f"{'size':>8} {'all':>6} {'legacy(s)':>12} {'hash(s)':>12} {'ratio':>8}")
+    for size in args.sizes:
+        db_items, vimeo_data = make_videos(size)
+        for all in (False, True):
+            hashed = measure(
+                merge_videos, {"data": vimeo_data}, db_items, all, repeat=args.repeat
+            )
+            if size > args.legacy_max:
+                legacy = None
+            else:
+                legacy = measure(
+                    legacy_merge_videos, {"data": vimeo_data}, db_items, all
+                )
+            ratio = f"{legacy / hashed:8.1f}" if legacy else f"{'-':>8}"
+            legacy = f"{legacy:12.4f}" if legacy else f"{'skipped':>12}"
+            print(f"{size:>8} {str(all):>6} {legacy} {hashed:12.4f} {ratio}")
+
+
+def make_references(*, categories=50, tags=200, paths=30, users=100):
+    """Make dammy categories, tags, learning paths and users"""
+
+    parents = [
+        {"PK": f"C-{i:08}", "name": f"category {i}", "parentId": "C999"}
+        for i in range(0, categories, 5)
+    ]
+    children = [
+        {"PK": f"C-{i:08}", "name": f"category {i}", "parentId": f"C-{i - i % 5:08}"}
+        for i in range(categories)
+        if i % 5
+    ]
+    return dict(
+        categories=parents + children,
+        tags=[{"PK": f"T-{i:08}", "name": f"tag {i}"} for i in range(tags)],
+        paths=[{"PK": f"L-{i:08}", "name": f"path {i}"} for i in range(paths)],
+        users=[
+            {"PK": f"user{i}@example.com", "name": f"user {i}"} for i in range(users)
+        ],
+    )
+
+
+def legacy_merge_table_for_video(videos, categories, tags, paths, users):
+    """merge_table_for_video before reference index (linear scans per row)"""
+
+    rows = []
+    for i, video in enumerate(videos, 1):
+        row = {}
+        row["id"] = i
+        row["match"] = video.get("match", True)
+        row["uri"] = video.get("uri", "")
+        row["invalid"] = video.get("invalid", True)
+        if (thumbnail := video.get("thumbnail", None)) is not None:
+            row["thumbnail"] = thumbnail.get("link", "")
+        else:
+            row["thumbnail"] = ""
+        row["name"] = video.get("name", "")
+        row["description"] = video.get("description", "")
+        secondary = [c for c in categories if c["PK"] == video.get("categoryId", None)]
+        if not secondary:
+            row["primary"] = ""
+            row["secondary"] = ""
+        else:
+            primary = [c for c in categories if c["PK"] == secondary[0]["parentId"]]
+            row["primary"] = primary[0]["name"] if primary else ""
+            row["secondary"] = secondary[0]["name"]
+        if not video.get("tagIds", None):
+            row["tags"] = []
+        else:
+            row["tags"] = [
+                t["name"] for t in tags for id in video["tagIds"] if id == t["PK"]
+            ]
+        if not video.get("learningPathIds", None):
+            row["paths"] = []
+        else:
+            row["paths"] = [
+                p["name"]
+                for p in paths
+                for id in video["learningPathIds"]
+                if id == p["PK"]
+            ]
+        row["note"] = video.get("note", "")
+        row["duration"] = video.get("duration", 0)
+        if (stats := video.get("stats", None)) is not None:
+            row["plays"] = stats.get("plays", 0)
+        else:
+            row["plays"] = 0
+        if not video.get("createdUser", None):
+            row["createdUser"] = ""
+            row["updatedUser"] = ""
+        else:
+            created_user = [u["name"] for u in users if video["createdUser"] == u["PK"]]
+            updated_user = [u["name"] for u in users if video["updatedUser"] == u["PK"]]
+            row["createdUser"] = created_user[0]
+            row["updatedUser"] = updated_user[0]
+        row["createdAt"] = video.get("createdAt", "")
+        row["updatedAt"] = video.get("updatedAt", "")
+        rows.append(row)
+    return rows
+
+
+def bench_table(args):
+    """merge_table_for_video: linear scans vs reference index"""
+
+    print(
+        f"{'videos':>8} {'refs':>6} {'legacy(s)':>12} {'index(s)':>12}"
+        f" {'cached(s)':>12} {'ratio':>8}"
+    )
+    for scale in args.scales:
+        references = make_references(
+            categories=50 * scale, tags=200 * scale, paths=30 * scale, users=100
+        )
+        refs = sum(len(v) for v in references.values())
+        index = ReferenceIndex.build(**references)
+        for size in args.sizes:
+            videos, _ = make_videos(size)
+            legacy = measure(legacy_merge_table_for_video, videos, *references.values())
+            indexed = measure(
+                merge_table_for_video, videos, *references.values(), repeat=args.repeat
+            )
+            # インデックスをリクエスト間でキャッシュした場合
+            cached = measure(
+                lambda videos: merge_table_for_video(
+                    videos, None, None, None, None, index=index
+                ),
+                videos,
+                repeat=args.repeat,
+            )
+            print(
+                f"{size:>8} {refs:>6} {legacy:12.4f} {indexed:12.4f}"
+                f" {cached:12.4f} {legacy / indexed:8.1f}"
+            )
+
+
+def make_low_level_items(size):
+    """Make dammy video items as returned by client (low-level API)"""
+
+    db_items, vimeo_data = make_videos(size)
+    records = {data["uri"]: data for data in vimeo_data}
+    serializer = TypeSerializer()
+    items = []
+    for item in db_items:
+        data = records.get(item["PK"], {})
+        item = {
+            **item,
+            "tagIds": set(item["tagIds"]),
+            "duration": data.get("duration", 0),
+            "plays": data.get("plays", 0),
+            "score": Decimal(str(round(data.get("plays", 0) / 7, 3))),
+            "thumbnail": {"link": data.get("thumbnail", ""), "width": 640},
+            "note": None,
+        }
+        items.append({name: serializer.serialize(v) for name, v in item.items()})
+    return items
+
+
+def type_deserialize(items):
+    """Deserialize attribute by attribute as resource (Table) does"""
+
+    deserializer = TypeDeserializer()
+    return [
+        {name: deserializer.deserialize(value) for name, value in item.items()}
+        for item in items
+    ]
+
+
+def bench_deserialize(args):
+    """Deserialize client output: TypeDeserializer vs parse vs deserialize_page"""
+
+    print(
+        f"{'items':>8} {'resource(s)':>12} {'parser(s)':>12} {'fast(s)':>12}"
+        f" {'vs res':>8} {'vs parser':>10}"
+    )
+    for size in args.sizes:
+        items = make_low_level_items(size)
+        # 変換結果が同じことを確かめる（resourceはDecimal/setで返す）
+        expected = json.loads(json.dumps(type_deserialize(items), default=encode))
+        fast = [
+            {**item, "tagIds": set(item["tagIds"])} for item in deserialize_page(items)
+        ]
+        assert json.loads(json.dumps(fast, default=encode)) == expected
+        resource = measure(type_deserialize, items, repeat=args.repeat)
+        parser = measure(parse, items, repeat=args.repeat)
+        fast = measure(deserialize_page, items, repeat=args.repeat)
+        print(
+            f"{size:>8} {resource:12.4f} {parser:12.4f} {fast:12.4f}"
+            f" {resource / fast:8.1f} {parser / fast:10.1f}"
+        )
+
+
+def make_response_app(rows):
+    """App returning rows by response_model, fast JSON & NDJSON"""
+
+    from fastapi import FastAPI
+
+    app = FastAPI()
+
+    @app.get("/model", response_model=List[VideoDB])
+    def model():
+        return rows
+
+    @app.get("/fast", response_model=List[VideoDB])
+    def fast():
+        return fast_response(rows, "fast")
+
+    @app.get("/ndjson", response_model=List[VideoDB])
+    def ndjson():
+        return fast_response(rows, "ndjson")
+
+    return app
+
+
+def call_app(app, path):
+    """Call ASGI app in process, return size of body (body is not kept)"""
+
+    import asyncio
+
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "server": ("testserver", 80),
+        "client": ("testclient", 50000),
+    }
+    size = 0
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if requested:
+            # StreamingResponseは切断を待っているので、返し終わるまで待たせる
+            await asyncio.Event().wait()
+        requested = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal size
+        size += len(message.get("body", b""))
+
+    asyncio.run(app(scope, receive, send))
+    return size
+
+
+def bench_response(args):
+    """List response: response_model vs fast JSON vs NDJSON (time & peak memory)"""
+
+    print(f"{'rows':>8} {'mode':>8} {'time(s)':>10} {'peak(MB)':>10} {'bytes':>10}")
+    for size in args.sizes:
+        db_items, vimeo_data = make_videos(size)
+        rows = merge_videos({"data": vimeo_data}, db_items, all=False)
+        app = make_response_app(rows)
+        for mode in ("model", "fast", "ndjson"):
+            # 時間はtracemallocなしで測る
+            # appはコピーできないので引数にしない
+            elapsed = measure(lambda: call_app(app, f"/{mode}"), repeat=args.repeat)
+            tracemalloc.start()
+            body = call_app(app, f"/{mode}")
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"{size:>8} {mode:>8} {elapsed:10.4f} {peak / 2**20:10.1f} {body:>10}"
+            )
+
+
+# 子プロセスで実行する（importのキャッシュを効かせないため）
+# botocoreはネットワークに出ないようにして、生成されたclient/resourceの数を数える
+STARTUP_SCRIPT = """
+import json, time
+import boto3.session
+import botocore.client
+
+created = {"client": 0, "resource": 0}
+client, resource = boto3.session.Session.client, boto3.session.Session.resource
+
+
+def count(kind, func):
+    def wrapper(*args, **kwargs):
+        created[kind] += 1
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def offline(self, operation_name, api_params):
+    raise RuntimeError(f"network call in startup: {operation_name}")
+
+
+boto3.session.Session.client = count("client", client)
+boto3.session.Session.resource = count("resource", resource)
+botocore.client.BaseClient._make_api_call = offline
+
+start = time.perf_counter()
+import api.index
+
+print(json.dumps({"seconds": time.perf_counter() - start, **created}))
+"""
+
+
+def bench_startup(args):
+    """Import time of api.index (Lambda cold start) with botocore stubbed out"""
+
+    env = {
+        **os.environ,
+        "REGION": os.environ.get("REGION", "ap-northeast-1"),
+        "AWS_ACCESS_KEY_ID": os.environ.get("AWS_ACCESS_KEY_ID", "dammy"),
+        "AWS_SECRET_ACCESS_KEY": os.environ.get("AWS_SECRET_ACCESS_KEY", "dammy"),
+        "VIMEO_TOKEN_PROD": os.environ.get("VIMEO_TOKEN_PROD", "dammy"),
+        "VIMEO_KEY_PROD": os.environ.get("VIMEO_KEY_PROD", "dammy"),
+        "VIMEO_SECRET_PROD": os.environ.get("VIMEO_SECRET_PROD", "dammy"),
+    }
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for _ in range(args.repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT],
+            cwd=cwd,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    seconds = sorted(result["seconds"] for result in results)
+    print(
+        f"import api.index: min {seconds[0]:.3f}s median {seconds[len(seconds) // 2]:.3f}s"
+    )
+    print(f"clients: {results[0]['client']} resources: {results[0]['resource']}")
+    if args.budget is not None and seconds[len(seconds) // 2] > args.budget:
+        sys.exit(f"startup regression: over budget {args.budget:.3f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    join = commands.add_parser("join", help=bench_join.__doc__)
+    join.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    join.add_argument("--repeat", type=int, default=3)
+    # 入れ子ループはO(N*M)なので大きいサイズはスキップする
+    join.add_argument("--legacy-max", type=int, default=10000)
+    join.set_defaults(func=bench_join)
+
+    table = commands.add_parser("table", help=bench_table.__doc__)
+    table.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    # 参照データの倍率（1=カテゴリ50, タグ200, 再生リスト30）
+    table.add_argument("--scales", type=int, nargs="+", default=[1, 4])
+    table.add_argument("--repeat", type=int, default=3)
+    table.set_defaults(func=bench_table)
+
+    startup = commands.add_parser("startup", help=bench_startup.__doc__)
+    startup.add_argument("--repeat", type=int, default=5)
+    # 中央値がこの秒数を超えたら失敗にする（CI用）
+    startup.add_argument("--budget", type=float, default=None)
+    startup.set_defaults(func=bench_startup)
+
+    deserialize = commands.add_parser("deserialize", help=bench_deserialize.__doc__)
+    deserialize.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    deserialize.add_argument("--repeat", type=int, default=5)
+    deserialize.set_defaults(func=bench_deserialize)
+
+    response = commands.add_parser("response", help=bench_response.__doc__)
+    response.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    response.add_argument("--repeat", type=int, default=3)
+    response.set_defaults(func=bench_response)
+
+    args = parser.parse_args()
+    args.func(args)
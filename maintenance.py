@@ -0,0 +1,427 @@
+import argparse
+import time
+from collections import defaultdict
+
+from boto3.dynamodb.conditions import Key, Attr
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+import uuid
+
+from api.adjacency import VIDEO_PREFIX, adjacency_key, facet_ids, write_adjacency
+from api.client import TABLE_NAME, DynamoDB, serializer
+from api.counter import METRICS, counter_key, periods
+from api.rank import REBALANCE_LENGTH, rank_between, sort_orders, spread_ranks
+from api.search import SEARCH_SNAPSHOT, SearchIndex
+from api.timeid import is_time_id, stable_id
+from api.routes.history.input import HISTORY_PREFIX
+from api.routes.like.input import LIKE_PREFIX
+from api.routes.thread.input import THREAD_PREFIX
+from api.routes.upload.input import STATUS_PREFIX
+
+#
+# DynamoDBのデータ移行・メンテナンス用のコマンド
+# （backfill-adjacencyは隣接アイテムを読むルートより先に実行する、api/adjacency.py）
+# $ python maintenance.py backfill-adjacency --dry-run
+# $ python maintenance.py build-search-index --output search.json.gz
+# $ python maintenance.py migrate-ranks --dry-run
+# $ python maintenance.py rebalance-ranks --max-length 12
+# $ python maintenance.py check-adjacency --repair
+# $ python maintenance.py backfill-counters --dry-run
+# $ python maintenance.py migrate-time-ids --dry-run
+#
+
+
+def query_videos(db):
+    """Get all video items (without video orders)"""
+
+    items, _ = db.query(
+        dict(
+            IndexName="GSI-1-SK",
+            KeyConditionExpression=Key("indexKey").eq("Video"),
+            FilterExpression=Attr("invalid").exists(),
+        )
+    )
+    return items
+
+
+def backfill_adjacency(args):
+    """Create tag/category -> video adjacency items for existing videos"""
+
+    db = DynamoDB()
+    start = time.time()
+    videos = query_videos(db)
+    keys = [
+        adjacency_key(id, video["PK"]) for video in videos for id in facet_ids(video)
+    ]
+    print(f"videos: {len(videos)} adjacency items: {len(keys)}")
+
+    # 再生リストは再生順のアイテムを使うので、足りないものは表示だけする
+    orders = db.batch_get(
+        [
+            {"PK": path_id, "SK": video["PK"]}
+            for video in videos
+            for path_id in video.get("learningPathIds", None) or []
+            if path_id
+        ]
+    )
+    missing = [
+        (path_id, video["PK"])
+        for video in videos
+        for path_id in video.get("learningPathIds", None) or []
+        if path_id and (path_id, video["PK"]) not in orders
+    ]
+    for path_id, uri in missing:
+        print(f"  no video order: {path_id} {uri}")
+
+    if args.dry_run:
+        print("dry run: nothing was written")
+    else:
+        # 同じキーで上書きするだけなので何回実行してもよい
+        write_adjacency(db.table, keys, [])
+        print(f"written: {len(keys)}")
+    print(time.time() - start)
+
+
+def build_search_index(args):
+    """Build full-text search index and save snapshot for Lambda package"""
+
+    db = DynamoDB()
+    start = time.time()
+    videos = query_videos(db)
+    tags, _ = db.query(
+        dict(IndexName="GSI-1-SK", KeyConditionExpression=Key("indexKey").eq("Tag"))
+    )
+    index = SearchIndex().build(videos, tags)
+    index.save(args.output)
+    print(f"videos: {len(videos)} tags: {len(tags)} terms: {len(index.postings)}")
+    print(time.time() - start)
+
+
+def rerank_paths(db, needs_rerank, dry_run=False):
+    """Spread ranks of video orders again for paths that need it"""
+
+    paths, _ = db.query(
+        dict(
+            IndexName="GSI-1-SK",
+            KeyConditionExpression=Key("indexKey").eq("LearningPath"),
+        )
+    )
+    for path in paths:
+        # orderを書き戻すのでDecimalのまま読む
+        rows, _ = db.query(
+            dict(
+                KeyConditionExpression=Key("PK").eq(path["PK"])
+                & Key("SK").begins_with("/videos/"),
+            ),
+            fast=False,
+        )
+        if not rows or not needs_rerank(rows):
+            continue
+        rows = sort_orders(rows)
+        ranks = spread_ranks(len(rows))
+        print(f"{path['PK']} {path.get('name', '')}: {len(rows)} orders")
+        if dry_run:
+            continue
+        # orderも今の並び順で書き直しておく
+        items = [
+            {
+                "Update": dict(
+                    TableName=TABLE_NAME,
+                    Key={"PK": {"S": row["PK"]}, "SK": {"S": row["SK"]}},
+                    UpdateExpression="SET #rank=:rank, #order=:order",
+                    ExpressionAttributeNames={"#rank": "rank", "#order": "order"},
+                    ExpressionAttributeValues={
+                        ":rank": {"S": rank},
+                        ":order": {"N": str(row["order"])},
+                    },
+                )
+            }
+            for row, rank in zip(rows, ranks)
+        ]
+        db.transact_write(items)
+
+
+def migrate_ranks(args):
+    """Give rank keys to video orders that have only integer order"""
+
+    start = time.time()
+    rerank_paths(
+        DynamoDB(),
+        lambda rows: any(not row.get("rank", None) for row in rows),
+        args.dry_run,
+    )
+    print(time.time() - start)
+
+
+def rebalance_ranks(args):
+    """Spread rank keys again for paths whose ranks got too long (run daily)"""
+
+    start = time.time()
+    rerank_paths(
+        DynamoDB(),
+        lambda rows: any(len(row.get("rank", "")) > args.max_length for row in rows),
+        args.dry_run,
+    )
+    print(time.time() - start)
+
+
+def scan_adjacency(db):
+    """Scan tag/category -> video adjacency items (without indexKey)"""
+
+    input = dict(
+        FilterExpression=Attr("SK").begins_with(VIDEO_PREFIX)
+        & Attr("indexKey").not_exists(),
+        ProjectionExpression="PK, SK",
+    )
+    keys = set()
+    while True:
+        res = db.table.scan(**input)
+        keys.update((item["PK"], item["SK"]) for item in res.get("Items", []))
+        if "LastEvaluatedKey" not in res:
+            return keys
+        input["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+
+
+def check_adjacency(args):
+    """Check reverse indexes against video items (and rebuild with --repair)"""
+
+    db = DynamoDB()
+    start = time.time()
+    videos = query_videos(db)
+
+    # タグ・カテゴリ -> 動画
+    expected = {(id, video["PK"]) for video in videos for id in facet_ids(video)}
+    actual = scan_adjacency(db)
+    missing = sorted(expected - actual)
+    stale = sorted(actual - expected)
+    print(f"adjacency: {len(actual)} missing: {len(missing)} stale: {len(stale)}")
+    for pk, sk in missing:
+        print(f"  missing {pk} {sk}")
+    for pk, sk in stale:
+        print(f"  stale   {pk} {sk}")
+
+    # 再生リスト -> 動画（再生順のアイテム）
+    rows, _ = db.query(
+        dict(
+            IndexName="GSI-1-SK",
+            KeyConditionExpression=Key("indexKey").eq("Video"),
+            FilterExpression=Attr("invalid").not_exists(),
+        )
+    )
+    orders = {(row["PK"], row["SK"]): row for row in rows}
+    expected_orders = {
+        (path_id, video["PK"])
+        for video in videos
+        for path_id in video.get("learningPathIds", None) or []
+        if path_id
+    }
+    missing_orders = sorted(expected_orders - orders.keys())
+    stale_orders = sorted(orders.keys() - expected_orders)
+    stale_keys = set(stale_orders)
+    print(
+        f"orders: {len(orders)} missing: {len(missing_orders)}"
+        f" stale: {len(stale_orders)}"
+    )
+    for pk, sk in missing_orders:
+        print(f"  missing {pk} {sk}")
+    for pk, sk in stale_orders:
+        print(f"  stale   {pk} {sk}")
+
+    if not args.repair:
+        print(time.time() - start)
+        return
+
+    write_adjacency(
+        db.table,
+        [adjacency_key(pk, sk) for pk, sk in missing],
+        [adjacency_key(pk, sk) for pk, sk in stale],
+    )
+    # 足りない再生順は再生リストの最後に追加する
+    last = {}
+    for key, row in orders.items():
+        if key in stale_keys:
+            continue
+        path_id = row["PK"]
+        count, rank = last.get(path_id, (0, None))
+        rank = max(rank or "", row.get("rank", None) or "") or None
+        last[path_id] = (count + 1, rank)
+    with db.table.batch_writer() as batch:
+        for path_id, uri in missing_orders:
+            count, rank = last.get(path_id, (0, None))
+            rank = rank_between(rank, None)
+            batch.put_item(
+                Item=dict(
+                    PK=path_id,
+                    SK=uri,
+                    indexKey="Video",
+                    createdAt=str(uuid.uuid1())[:8],
+                    order=count + 1,
+                    rank=rank,
+                )
+            )
+            last[path_id] = (count + 1, rank)
+        for path_id, uri in stale_orders:
+            batch.delete_item(Key={"PK": path_id, "SK": uri})
+    print("repaired")
+    print(time.time() - start)
+
+
+def backfill_counters(args):
+    """Rebuild daily & hourly counters from history, user & upload status items"""
+
+    # ユーザーは最後のログイン日時しか持たないので、過去のログイン数は少なめになる
+    # 上書きするので、実行中に数えたイベントは消える（アクセスの少ない時間に実行する）
+    sources = {"views": "History", "logins": "User", "uploads": "Status"}
+    db = DynamoDB()
+    start = time.time()
+    counters = []
+    for metric, index_key in sources.items():
+        items, _ = db.query(
+            dict(
+                IndexName="GSI-1-SK",
+                KeyConditionExpression=Key("indexKey").eq(index_key),
+                ProjectionExpression="PK, createdAt",
+            )
+        )
+        counts = defaultdict(int)
+        members = defaultdict(set)
+        for item in items:
+            for period in periods(item["createdAt"]):
+                counts[period] += 1
+                members[period].add(item["PK"])
+        for period, count in sorted(counts.items()):
+            counter = {**counter_key(metric, period), "count": count}
+            if METRICS[metric]:
+                counter["count"] = len(members[period])
+                counter["members"] = members[period]
+            counters.append(counter)
+        print(f"{metric}: {len(items)} items -> {len(counts)} counters")
+
+    if args.dry_run:
+        print("dry run: nothing was written")
+    else:
+        with db.table.batch_writer() as batch:
+            for counter in counters:
+                batch.put_item(Item=counter)
+        print(f"written: {len(counters)}")
+    print(time.time() - start)
+
+
+def time_sk(index_key, item):
+    """Return new SK with time-ordered ID (None if already migrated)"""
+
+    pk, sk = item["PK"], item["SK"]
+    if index_key == "Thread":
+        if sk.startswith(THREAD_PREFIX):
+            return None
+        # 以前のSKは<親スレッドの日時>_<投稿の日時>、親と返信で同じ親IDになるように親の日時から作る
+        root, posted = sk.split("_", 1)
+        return f"{THREAD_PREFIX}{stable_id(root, pk, root)}_{stable_id(posted, pk, sk)}"
+
+    prefix = {"History": HISTORY_PREFIX, "Like": LIKE_PREFIX, "Status": STATUS_PREFIX}[
+        index_key
+    ]
+    if sk.startswith(prefix) and is_time_id(sk[len(prefix) :]):
+        return None
+    return f"{prefix}{stable_id(item['createdAt'], pk, sk)}"
+
+
+def migrate_time_ids(args):
+    """Rewrite SK of history, like, thread & upload status with time-ordered IDs"""
+
+    db = DynamoDB()
+    start = time.time()
+    transact_items = []
+    for index_key in ("History", "Like", "Thread", "Status"):
+        # アイテム全体を書き直すのでDecimal/setのまま読む
+        items, _ = db.query(
+            dict(
+                IndexName="GSI-1-SK",
+                KeyConditionExpression=Key("indexKey").eq(index_key),
+            ),
+            fast=False,
+        )
+        moved = 0
+        for item in items:
+            try:
+                if (sk := time_sk(index_key, item)) is None:
+                    continue
+                # 新しいキーで書いて古いキーを消す（IDは元のキーから作るので何回実行してもよい）
+                new_item = {k: serializer.serialize(v) for k, v in item.items()}
+                new_item["SK"] = serializer.serialize(sk)
+            except (KeyError, ValueError, TypeError) as err:
+                print(f"  skipped {item['PK']} {item['SK']}: {err}")
+                continue
+            moved += 1
+            transact_items.append({"Put": dict(TableName=TABLE_NAME, Item=new_item)})
+            transact_items.append(
+                {
+                    "Delete": dict(
+                        TableName=TABLE_NAME,
+                        Key={
+                            "PK": serializer.serialize(item["PK"]),
+                            "SK": serializer.serialize(item["SK"]),
+                        },
+                        ConditionExpression="attribute_exists(PK)",
+                    )
+                }
+            )
+            if args.dry_run:
+                print(f"  {item['PK']} {item['SK']} -> {sk}")
+        print(f"{index_key}: {len(items)} items, {moved} to migrate")
+
+    if args.dry_run:
+        print("dry run: nothing was written")
+    elif transact_items:
+        # 1チャンク100件なので、PutとDeleteの組はチャンクをまたがない
+        res = db.transact_write(transact_items)
+        print(f"written: {len(transact_items) // 2} (token {res['token']})")
+    print(time.time() - start)
+
+
+def rebalance_handler(event, context):
+    """Lambda handler of daily rebalance (serverless.yml)"""
+
+    rebalance_ranks(argparse.Namespace(max_length=REBALANCE_LENGTH, dry_run=False))
+    return {"status": "finished"}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DynamoDB maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backfill = commands.add_parser(
+        "backfill-adjacency", help=backfill_adjacency.__doc__
+    )
+    backfill.add_argument("--dry-run", action="store_true")
+    backfill.set_defaults(func=backfill_adjacency)
+
+    search = commands.add_parser("build-search-index", help=build_search_index.__doc__)
+    search.add_argument("--output", default=SEARCH_SNAPSHOT)
+    search.set_defaults(func=build_search_index)
+
+    check = commands.add_parser("check-adjacency", help=check_adjacency.__doc__)
+    check.add_argument("--repair", action="store_true")
+    check.set_defaults(func=check_adjacency)
+
+    migrate = commands.add_parser("migrate-ranks", help=migrate_ranks.__doc__)
+    migrate.add_argument("--dry-run", action="store_true")
+    migrate.set_defaults(func=migrate_ranks)
+
+    rebalance = commands.add_parser("rebalance-ranks", help=rebalance_ranks.__doc__)
+    rebalance.add_argument("--max-length", type=int, default=REBALANCE_LENGTH)
+    rebalance.add_argument("--dry-run", action="store_true")
+    rebalance.set_defaults(func=rebalance_ranks)
+
+    counters = commands.add_parser("backfill-counters", help=backfill_counters.__doc__)
+    counters.add_argument("--dry-run", action="store_true")
+    counters.set_defaults(func=backfill_counters)
+
+    time_ids = commands.add_parser("migrate-time-ids", help=migrate_time_ids.__doc__)
+    time_ids.add_argument("--dry-run", action="store_true")
+    time_ids.set_defaults(func=migrate_time_ids)
+
+    args = parser.parse_args()
+    args.func(args)